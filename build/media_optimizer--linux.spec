@@ -1,9 +1,15 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+import argparse
 from pathlib import Path
 
 import pymediainfo
 
+# Arguments given after "--" to PyInstaller (see src/devtools/build.py)
+parser = argparse.ArgumentParser()
+parser.add_argument("--onedir", action="store_true")
+options = parser.parse_args()
+
 mediainfo_bin_location = Path(pymediainfo.__path__[0]).joinpath("libmediainfo.so.0")
 
 a = Analysis(
@@ -13,7 +19,12 @@ a = Analysis(
         (str(mediainfo_bin_location), "."),
     ],
     datas=[],
-    hiddenimports=[],
+    hiddenimports=[
+        # Loaded lazily by the entry point, so PyInstaller can't detect them on its own
+        "src.optimizers.pictures",
+        "src.optimizers.videos",
+        "src.optimizers.mixed",
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -23,23 +34,52 @@ a = Analysis(
 )
 pyz = PYZ(a.pure)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name="media_optimizer",
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=True,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-)
+if options.onedir:
+    # Files are kept next to the executable instead of being unpacked to a temporary directory on every launch, and
+    # aren't compressed with UPX, which would also have to be undone on every launch
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name="media_optimizer",
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=False,
+        console=True,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=False,
+        name="media_optimizer-onedir",
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        [],
+        name="media_optimizer",
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=True,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
@@ -3,9 +3,31 @@ Utility commands for Media Optimizer development.
 """
 
 import argparse
+import sys
+from pathlib import Path
 
+from src.devtools.benchmark import (
+    DEFAULT_BASELINE_FILE,
+    DEFAULT_CORPUS_DIR,
+    DEFAULT_REGRESSION_THRESHOLD,
+    DEFAULT_REPEAT,
+    DEFAULT_RESULTS_FILE,
+    BenchmarkRegression,
+    run_benchmarks,
+)
 from src.devtools.build import build
+from src.devtools.large_images import (
+    DEFAULT_LARGE_IMAGES_DIR,
+    DEFAULT_MEMORY_MB,
+    DEFAULT_SHORT_SIDE,
+    DEFAULT_SIZE,
+    LargeImageBenchmarkFailed,
+    run_large_image_benchmarks,
+)
+from src.devtools.launch import DEFAULT_LAUNCH_RUNS, LaunchBenchmarkFailed, measure_launch
 from src.devtools.licenses import list_python_dependencies_licenses
+from src.devtools.palette import DEFAULT_PALETTE_REPEAT, PaletteBenchmarkFailed, run_palette_benchmarks
+from src.devtools.startup import DEFAULT_RUNS, DEFAULT_STARTUP_BUDGET_MS, StartupBudgetExceeded, measure_startup
 from src.devtools.version import bump_major_version, bump_minor_version, bump_patch_version, set_version, valid_version
 
 
@@ -23,10 +45,52 @@ def main():
         elif args.bump_patch:
             bump_patch_version()
     elif args.command == "build":
-        build(args.release, args.macos)
+        build(args.release, args.macos, args.onedir)
     elif args.command == "licenses":
         if args.list_python:
             list_python_dependencies_licenses()
+    elif args.command == "startup":
+        try:
+            measure_startup(args.runs, args.budget_ms)
+        except StartupBudgetExceeded as err:
+            print(f"\n[ERROR] {err}")
+
+            sys.exit(1)
+    elif args.command == "launch":
+        try:
+            measure_launch(args.artifact, args.runs)
+        except LaunchBenchmarkFailed as err:
+            print(f"\n[ERROR] {err}")
+
+            sys.exit(1)
+    elif args.command == "benchmark":
+        try:
+            run_benchmarks(
+                args.corpus_dir,
+                args.output,
+                args.baseline,
+                args.threshold,
+                args.repeat,
+                args.save_baseline,
+            )
+        except BenchmarkRegression as err:
+            print(f"\n[ERROR] {err}")
+
+            sys.exit(1)
+    elif args.command == "large-images":
+        try:
+            run_large_image_benchmarks(args.corpus_dir, args.size, args.memory_mb, args.short_side)
+        except LargeImageBenchmarkFailed as err:
+            print(f"\n[ERROR] {err}")
+
+            sys.exit(1)
+    elif args.command == "palette":
+        try:
+            run_palette_benchmarks(args.repeat)
+        except PaletteBenchmarkFailed as err:
+            print(f"\n[ERROR] {err}")
+
+            sys.exit(1)
     else:
         parser.print_help()
 
@@ -52,6 +116,11 @@ def get_arg_parser() -> argparse.ArgumentParser:
     # Build tools
     build_parser = subparsers.add_parser("build", help="build tools")
     build_parser.add_argument("-r", "--release", action="store_true", help="pack the build result for release")
+    build_parser.add_argument(
+        "--onedir",
+        action="store_true",
+        help="build a directory with the executable and its dependencies instead of a single file, which starts faster",
+    )
     build_parser.add_argument("--macos", action="store_true", help=argparse.SUPPRESS)
 
     # License tools
@@ -63,6 +132,133 @@ def get_arg_parser() -> argparse.ArgumentParser:
         help="list licenses of Python dependencies",
     )
 
+    # Startup time tools
+    startup_parser = subparsers.add_parser("startup", help="measure startup time of the entry point against a budget")
+    startup_parser.add_argument(
+        "-b",
+        "--budget-ms",
+        type=float,
+        default=DEFAULT_STARTUP_BUDGET_MS,
+        help=f"max allowed import time of the entry point, in milliseconds (default: {DEFAULT_STARTUP_BUDGET_MS})",
+    )
+    startup_parser.add_argument(
+        "-n",
+        "--runs",
+        type=int,
+        default=DEFAULT_RUNS,
+        help=f"number of measured runs, the median is used (default: {DEFAULT_RUNS})",
+    )
+
+    # Launch time tools
+    launch_parser = subparsers.add_parser(
+        "launch",
+        help="measure cold and warm launch time of the built executables, for --version and a tiny batch",
+    )
+    launch_parser.add_argument(
+        "-a",
+        "--artifact",
+        type=Path,
+        action="append",
+        help="built executable to launch, can be used several times (default: every one found in dist/)",
+    )
+    launch_parser.add_argument(
+        "-n",
+        "--runs",
+        type=int,
+        default=DEFAULT_LAUNCH_RUNS,
+        help=f"number of warm launches of each command, the median is used (default: {DEFAULT_LAUNCH_RUNS})",
+    )
+
+    # Benchmark tools
+    benchmark_parser = subparsers.add_parser("benchmark", help="benchmark the optimizers on a synthetic corpus")
+    benchmark_parser.add_argument(
+        "-c",
+        "--corpus-dir",
+        type=Path,
+        default=DEFAULT_CORPUS_DIR,
+        help="where the synthetic corpus is generated (default: build/benchmark_corpus)",
+    )
+    benchmark_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=DEFAULT_RESULTS_FILE,
+        help="JSON file the results are written to (default: build/benchmark_results.json)",
+    )
+    benchmark_parser.add_argument(
+        "-b",
+        "--baseline",
+        type=Path,
+        default=DEFAULT_BASELINE_FILE,
+        help="JSON file with the baseline results to compare against (default: benchmarks/baseline.json)",
+    )
+    benchmark_parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=DEFAULT_REGRESSION_THRESHOLD,
+        help=f"max allowed slowdown per stage compared to the baseline (default: {DEFAULT_REGRESSION_THRESHOLD})",
+    )
+    benchmark_parser.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help=f"times each stage is run, the fastest run is kept (default: {DEFAULT_REPEAT})",
+    )
+    benchmark_parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="save the results as the new baseline instead of comparing against it",
+    )
+
+    # Large picture tools
+    large_images_parser = subparsers.add_parser(
+        "large-images",
+        help="benchmark time and peak memory of optimizing very large pictures against a memory cap",
+    )
+    large_images_parser.add_argument(
+        "-c",
+        "--corpus-dir",
+        type=Path,
+        default=DEFAULT_LARGE_IMAGES_DIR,
+        help="where the synthetic pictures are generated (default: build/large_images_corpus)",
+    )
+    large_images_parser.add_argument(
+        "-s",
+        "--size",
+        type=int,
+        default=DEFAULT_SIZE,
+        help=f"width and height of the synthetic pictures (default: {DEFAULT_SIZE})",
+    )
+    large_images_parser.add_argument(
+        "-m",
+        "--memory-mb",
+        type=int,
+        default=DEFAULT_MEMORY_MB,
+        help=f"memory cap for each picture, in MiB (default: {DEFAULT_MEMORY_MB})",
+    )
+    large_images_parser.add_argument(
+        "--short-side",
+        type=int,
+        choices=[1080, 720],
+        default=DEFAULT_SHORT_SIDE,
+        help=f"short side of the optimized pictures (default: {DEFAULT_SHORT_SIDE})",
+    )
+
+    # PNG palette tools
+    palette_parser = subparsers.add_parser(
+        "palette",
+        help="benchmark time per megapixel and size savings of lossy PNG palettes against truecolor PNG",
+    )
+    palette_parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=DEFAULT_PALETTE_REPEAT,
+        help=f"number of runs of each quantization, the fastest one is used (default: {DEFAULT_PALETTE_REPEAT})",
+    )
+
     return parser
 
 
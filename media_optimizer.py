@@ -5,64 +5,431 @@ Entry point script that lets you choose which optimization tool you want to use.
 import argparse
 import sys
 from functools import cached_property
-from typing import Any
+from pathlib import Path
+from typing import Any, Self
 
 from src._version import __VERSION__
-from src.components.files import Files, print_size_reduction_info
+from src.components.config import ConfigError, load_config, merge, parse_assignments
+from src.components.daemon import WatchDaemon
+from src.components.estimator import DEFAULT_SAMPLE_SIZE, EstimateError, estimate, print_estimate_info
+from src.components.files import (
+    DEFAULT_TARGET_DIR,
+    FileOrder,
+    Files,
+    FilesError,
+    print_failed_files_info,
+    print_size_reduction_info,
+    print_suspect_files_info,
+    quarantine_failed_files,
+)
 from src.components.media_optimizer import MediaOptimizer
+from src.components.metrics import METRICS
+from src.components.mirror import MirrorMode, mirror_files, print_mirror_info
 from src.components.options import MenuOption, ask_for_source_dir
-from src.optimizers.pictures import PictureOptimizer
-from src.optimizers.videos import VideoOptimizer
+from src.components.profiling import DEFAULT_PROFILE_TOP, PROFILER
+from src.components.resources import RESOURCES, IoPriority, ResourceLimits, parse_size
+from src.components.results import ReportFormat, ResultsReport
+from src.components.server import DEFAULT_HOST, DEFAULT_PORT, JobQueue, JobServer
+from src.components.watcher import create_watcher
+from src.optimizers import OPTIMIZERS, load_optimizer
+
+# Exit status of runs that went through every file, but could not optimize some of them (1 is for errors that stop the
+# run, and 2 for invalid arguments)
+EXIT_FILES_FAILED = 3
 
 
 class MediaOptimizerOption(MenuOption):
-    PICTURES = PictureOptimizer, "Picture optimizer", "pictures"
-    VIDEOS = VideoOptimizer, "Video optimizer", "videos"
+    PICTURES = "pictures", "Picture optimizer", "pictures"
+    VIDEOS = "videos", "Video optimizer", "videos"
+    MIXED = "mixed", "Picture and video optimizer (for folders with both)", "pictures and videos"
 
-    def __init__(self, optimizer_class: type[MediaOptimizer[Any]], name: str, resource_label: str):
+    def __init__(self, optimizer_name: str, name: str, resource_label: str):
         super().__init__()
-        self._value_: type[MediaOptimizer[Any]] = optimizer_class
+        self._value_: str = optimizer_name
         self._name_ = name
         self.resource_label = resource_label
 
+    @classmethod
+    def from_optimizer_name(cls, optimizer_name: str) -> Self:
+        for option in cls:
+            if option.value == optimizer_name:
+                return option
+
+        raise ValueError(f"Unknown optimizer '{optimizer_name}'. Valid optimizers are: {', '.join(OPTIMIZERS)}")
+
     @cached_property
     def optimizer(self) -> MediaOptimizer[Any]:
-        return self._value_()
+        return load_optimizer(self._value_)
 
-    def run(self):
+    def run(
+        self,
+        source_dir: str | None = None,
+        target_dir: str | None = None,
+        options: Any | None = None,
+        report_format: ReportFormat | None = None,
+        order: FileOrder = FileOrder.LARGEST_FIRST,
+        mirror: MirrorMode | None = None,
+        quarantine_dir: Path | None = None,
+    ) -> int:
+        """
+        Runs the optimizer once. Anything not provided (source directory, options) is asked interactively. Files that
+        are not optimized are mirrored into the target directory if a mirror mode is provided, and the sources of the
+        files that failed are moved to the quarantine directory, if provided. Returns how many files failed.
+        """
         files = Files(
-            source_dir=ask_for_source_dir(self.resource_label),
+            source_dir=source_dir if source_dir is not None else ask_for_source_dir(self.resource_label),
+            target_dir=target_dir,
             filter_lambda=self.optimizer.is_valid_file,
             create_file_lambda=self.optimizer.create_file,
         )
+        files.sort(order, self.optimizer.estimate_work)
+
+        if options is None:
+            options = self.optimizer.ask_for_options(files)
+
+        report = ResultsReport.in_directory(files.target_dir, report_format) if report_format is not None else None
 
-        self.optimizer.run(files)
+        try:
+            self.optimizer.run(files, options, report)
+        finally:
+            # Only waited for by run() when it succeeds, and the verifier writes to the report
+            self.optimizer.stop_verification()
+
+            if report is not None:
+                report.close()
 
         files.calculate_final_size()
         print_size_reduction_info(files)
+        print_failed_files_info(files)
+        print_suspect_files_info(files)
+
+        if mirror is not None:
+            # Mirrored files are not part of the size totals, which only cover the files that were optimized
+            print_mirror_info(mirror_files(files, mirror))
+
+        # Only once the totals are calculated, as they need the sources
+        if quarantine_dir is not None and quarantine_failed_files(files, quarantine_dir) > 0:
+            print(f"The sources of the files that could not be optimized have been moved to {quarantine_dir}\n")
+        print(f"You can find the optimized files in {files.target_dir}\n")
+
+        if report is not None:
+            print(f"Per-file results have been written to {report.path}\n")
+
+        return len(files.failed_files())
+
+    def estimate(
+        self,
+        source_dir: str | None = None,
+        target_dir: str | None = None,
+        options: Any | None = None,
+        sample_size: int = DEFAULT_SAMPLE_SIZE,
+    ):
+        """Estimates the results of running the optimizer, by only optimizing a sample of the files."""
+        files = Files(
+            source_dir=source_dir if source_dir is not None else ask_for_source_dir(self.resource_label),
+            target_dir=target_dir,
+            filter_lambda=self.optimizer.is_valid_file,
+            create_file_lambda=self.optimizer.create_file,
+            create_target_dir=False,
+        )
+
+        if options is None:
+            options = self.optimizer.ask_for_options(files)
+
+        print(f"\nEstimating, by optimizing a sample of up to {sample_size} file(s)...")
+
+        print_estimate_info(estimate(self.optimizer, files, options, sample_size))
+
+    def watch(
+        self,
+        source_dir: str | None = None,
+        target_dir: str | None = None,
+        options: Any | None = None,
+        report_format: ReportFormat | None = None,
+    ):
+        """Watches a directory until interrupted. Anything not provided (source directory, options) is asked."""
+        run_only_options = self.optimizer.get_run_only_options(options) if options is not None else []
+        if len(run_only_options) > 0:
+            raise ConfigError(f"'{run_only_options[0]}' is only supported by regular runs, not in watch mode")
+
+        files = Files(
+            source_dir=source_dir if source_dir is not None else ask_for_source_dir(self.resource_label),
+            target_dir=target_dir,
+            filter_lambda=self.optimizer.is_valid_file,
+            create_file_lambda=self.optimizer.create_file,
+            allow_empty=True,
+        )
+
+        if options is None:
+            options = self.optimizer.ask_for_options(files)
+
+        report = ResultsReport.in_directory(files.target_dir, report_format) if report_format is not None else None
+
+        daemon = WatchDaemon(
+            self.optimizer,
+            options,
+            watcher=create_watcher(files.source_dir),
+            target_dir=files.target_dir,
+            workers=self.optimizer.workers if self.optimizer.parallelizable else 1,
+            report=report,
+        )
+
+        try:
+            daemon.run()
+        finally:
+            if report is not None:
+                report.close()
+
         print(f"You can find the optimized files in {files.target_dir}\n")
 
 
 def main():
-    args = __parse_args()
+    parser = __get_arg_parser()
+    args = parser.parse_args()
     if args.version:
         __version()
 
+    # Applied before anything else is started, so that every thread and child process inherits them
     try:
-        MediaOptimizerOption.choose("Choose an optimization tool:").run()
+        RESOURCES.apply(ResourceLimits(args.max_cores, args.nice, args.io_priority, args.io_limit))
+    except ValueError as err:
+        parser.error(str(err))
+
+    if args.metrics_interval <= 0:
+        parser.error("--metrics-interval must be greater than 0")
+
+    if args.metrics is not None:
+        METRICS.enable()
+        METRICS.start_periodic_export(args.metrics, args.metrics_interval)
+
+    if args.profile is not None:
+        if args.profile_top < 1:
+            parser.error("--profile-top must be at least 1")
+        if args.serve is not None and args.workers > 1:
+            parser.error("--profile runs one job at a time, so it can't be used with --workers")
+
+        PROFILER.enable(args.profile, args.profile_top)
+
+    try:
+        if args.serve is not None:
+            __serve(args.host, args.serve, args.workers)
+            return
+
+        config = load_config(args.config) if args.config is not None else {}
+
+        # Anything provided through arguments or the config file is not asked interactively.
+        # Choosing the optimizer that way also means running headless: options are never asked, defaults are used.
+        optimizer_name = args.optimizer or config.get("optimizer")
+        source_dir = args.source or config.get("source")
+        target_dir = args.target or config.get("target")
+        report_format = args.report or (ReportFormat(config["report"]) if "report" in config else None)
+        mirror = args.mirror or (MirrorMode(config["mirror"]) if "mirror" in config else None)
+        quarantine_dir = args.quarantine or (Path(config["quarantine"]) if "quarantine" in config else None)
+        options = None
+
+        if optimizer_name is not None:
+            if source_dir is None:
+                parser.error("a source directory (--source or 'source' in the config file) is required")
+
+            option = MediaOptimizerOption.from_optimizer_name(optimizer_name)
+            options = option.optimizer.options_from_dict(
+                merge(config.get(optimizer_name, {}), parse_assignments(args.set))
+            )
+        else:
+            option = MediaOptimizerOption.choose("Choose an optimization tool:")
+
+        if args.estimate is not None:
+            option.estimate(source_dir, target_dir, options, args.estimate)
+        elif args.watch:
+            option.watch(source_dir, target_dir, options, report_format)
+        else:
+            failed = option.run(source_dir, target_dir, options, report_format, args.order, mirror, quarantine_dir)
+            if failed > 0:
+                sys.exit(EXIT_FILES_FAILED)
+    except (ConfigError, FilesError, EstimateError, ValueError, OSError) as err:
+        print(f"[ERROR] {err}")
+
+        sys.exit(1)
     except KeyboardInterrupt:
         print("Cancelled")
 
         sys.exit(0)
+    finally:
+        if args.metrics is not None:
+            METRICS.stop_periodic_export()
+            METRICS.export(args.metrics)
 
+        PROFILER.dump()
 
-def __parse_args() -> argparse.Namespace:
+
+def __get_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description=f"Media Optimizer v{__VERSION__}. Run without arguments for regular usage.",
     )
     parser.add_argument("-v", "--version", action="store_true", help="show Media Optimizer version")
+    parser.add_argument(
+        "-o",
+        "--optimizer",
+        choices=list(OPTIMIZERS),
+        help="optimizer to use. When provided, runs without asking any questions (using default options unless "
+        "configured through --config or --set)",
+    )
+    parser.add_argument("-s", "--source", metavar="DIR", help="directory with the files to optimize")
+    parser.add_argument(
+        "-t",
+        "--target",
+        metavar="DIR",
+        help=f"directory for the optimized files (default: '{DEFAULT_TARGET_DIR}' inside the source directory)",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=Path,
+        metavar="FILE",
+        help="TOML or JSON config file with the optimizer, directories and options to use",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="set an option of the chosen optimizer, overriding the config file (e.g. --set jpeg_quality=80). "
+        "Can be used several times",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help="keep running and optimize new files as soon as they land in the source directory",
+    )
+    parser.add_argument(
+        "--order",
+        type=FileOrder,
+        choices=list(FileOrder),
+        default=FileOrder.LARGEST_FIRST,
+        metavar="{largest,listing}",
+        help="order in which files are optimized: the ones with the most work first (default), which shortens "
+        "parallel runs, or as listed in the source directory",
+    )
+    parser.add_argument(
+        "--mirror",
+        type=MirrorMode,
+        choices=list(MirrorMode),
+        nargs="?",
+        const=MirrorMode.COPY,
+        metavar="{copy,link}",
+        help="also mirror the files that are not optimized (other files, and skipped media) into the target directory, "
+        "as reflinks or kernel-side copies when possible (default), or as hard links with 'link'",
+    )
+    parser.add_argument(
+        "--quarantine",
+        type=Path,
+        metavar="DIR",
+        help="move the source files that could not be optimized (e.g. corrupt ones) to DIR at the end of the run, "
+        "each with the reason why next to it",
+    )
+    parser.add_argument(
+        "-e",
+        "--estimate",
+        type=int,
+        nargs="?",
+        const=DEFAULT_SAMPLE_SIZE,
+        metavar="SAMPLES",
+        help="dry run: only optimize a random sample of files (or short segments of videos) to estimate the final "
+        f"size and processing time of the whole batch (default sample size: {DEFAULT_SAMPLE_SIZE})",
+    )
+    parser.add_argument(
+        "--serve",
+        type=int,
+        nargs="?",
+        const=DEFAULT_PORT,
+        metavar="PORT",
+        help=f"run as a server that accepts optimization jobs through a local HTTP API (default port: {DEFAULT_PORT})",
+    )
+    parser.add_argument(
+        "--host",
+        default=DEFAULT_HOST,
+        help=f"address the server listens on (default: {DEFAULT_HOST}, only reachable from this machine)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="how many jobs the server runs at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--max-cores",
+        type=int,
+        default=0,
+        metavar="N",
+        help="max CPU cores used by the run, including picture workers and FFmpeg (default: every core)",
+    )
+    parser.add_argument(
+        "--nice",
+        type=int,
+        default=0,
+        metavar="N",
+        help="niceness (0-19) of the run and of every process it starts, to leave the CPU to other services",
+    )
+    parser.add_argument(
+        "--io-priority",
+        type=IoPriority,
+        choices=list(IoPriority),
+        default=IoPriority.NORMAL,
+        metavar="{normal,low,idle}",
+        help="disk priority of the run and of every process it starts (Linux only, default: normal)",
+    )
+    parser.add_argument(
+        "--io-limit",
+        type=parse_size,
+        default=0,
+        metavar="BYTES",
+        help="max bytes read and written per second by the run, including FFmpeg, e.g. 50M (default: unlimited)",
+    )
+    parser.add_argument(
+        "--report",
+        type=ReportFormat,
+        choices=list(ReportFormat),
+        metavar="{jsonl,csv}",
+        help="write a per-file results report (sizes, timings, options, skip/failure reasons) to the target directory",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        metavar="DIR",
+        help="collect per-stage timing metrics, and export them to DIR as JSON and as a Prometheus textfile",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=60.0,
+        metavar="SECONDS",
+        help="how often metrics are exported while running (default: 60)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="DIR",
+        help="profile the CPU time and memory of the work on each file with cProfile and tracemalloc, and write the "
+        "profiles of the slowest and most memory-hungry files, and one merged over the run, to DIR. Files (and server "
+        "jobs) are then optimized one at a time",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=DEFAULT_PROFILE_TOP,
+        metavar="N",
+        help="how many of the slowest and of the most memory-hungry files are kept when profiling "
+        f"(default: {DEFAULT_PROFILE_TOP})",
+    )
+
+    return parser
+
 
-    return parser.parse_args()
+def __serve(host: str, port: int, workers: int):
+    # Optimizers are only loaded by the queue, so the regular usage doesn't pay for them
+    JobServer(JobQueue(workers), host, port).run()
 
 
 def __version():
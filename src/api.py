@@ -0,0 +1,76 @@
+"""
+Headless API to run the optimizers programmatically (e.g. from job runners or ingestion services), without any
+interactive prompts or progress output.
+
+    from src.api import optimize
+
+    results = optimize("/data/incoming", "pictures", {"short_side_limit": 1080, "jpeg_quality": 80})
+    failed = [result for result in results if result.status == FileStatus.FAILED]
+"""
+
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from typing import Any, Mapping
+
+from src.components.files import FileOrder, Files
+from src.components.results import FileResult, ReportFormat, ResultsReport
+from src.optimizers import load_optimizer
+
+
+def optimize(
+    source_dir: str | Path,
+    optimizer: str = "pictures",
+    options: Any | Mapping[str, Any] | None = None,
+    target_dir: str | Path | None = None,
+    report_format: ReportFormat | None = None,
+    order: FileOrder = FileOrder.LARGEST_FIRST,
+) -> list[FileResult]:
+    """
+    Optimizes every valid file in the source directory, and returns the result of each of them.
+
+    `optimizer` is the name of the optimizer ("pictures" or "videos"), and `options` can either be an instance of
+    its options dataclass (e.g. PictureOptions), or plain values to build one from (missing values take their
+    defaults). Raises FilesError if the source directory does not exist, and ConfigError for invalid options.
+    """
+    media_optimizer = load_optimizer(optimizer)
+
+    if options is None or isinstance(options, Mapping):
+        options = media_optimizer.options_from_dict(options or {})
+
+    files = Files(
+        source_dir,
+        target_dir,
+        filter_lambda=media_optimizer.is_valid_file,
+        create_file_lambda=media_optimizer.create_file,
+        allow_empty=True,
+    )
+
+    if len(files) == 0:
+        return []
+
+    files.sort(order, media_optimizer.estimate_work)
+
+    report = ResultsReport.in_directory(files.target_dir, report_format) if report_format is not None else None
+
+    try:
+        return media_optimizer.run(files, options, report, show_progress=False)
+    finally:
+        # Only waited for by run() when it succeeds, and the verifier writes to the report
+        media_optimizer.stop_verification()
+
+        if report is not None:
+            report.close()
+
+
+async def optimize_async(
+    source_dir: str | Path,
+    optimizer: str = "pictures",
+    options: Any | Mapping[str, Any] | None = None,
+    target_dir: str | Path | None = None,
+    report_format: ReportFormat | None = None,
+    order: FileOrder = FileOrder.LARGEST_FIRST,
+) -> list[FileResult]:
+    """Same as optimize(), but runs in a worker thread so that it can be awaited without blocking the event loop."""
+    return await asyncio.to_thread(optimize, source_dir, optimizer, options, target_dir, report_format, order)
@@ -0,0 +1,131 @@
+"""
+Archives that optimized outputs are streamed into instead of being written as separate files, for huge sets of small
+files (e.g. thumbnails), where one file per output means inode pressure, a metadata syscall per file and slow uploads.
+
+Outputs are appended to the current part of the archive as soon as they are encoded, from any worker, and a new part is
+started once it reaches its max size, so the archive is never held in memory. Every output is recorded in a CSV index
+with its part, and the offset and size of its data, which are stored uncompressed, so it can be read straight from the
+part without extracting it.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import math
+import tarfile
+import threading
+import time
+import zipfile
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import IO
+
+INDEX_FIELDS = ("name", "part", "offset", "size")
+
+
+class ArchiveFormat(str, Enum):
+    TAR = "tar"
+    # Stored (uncompressed) zip, as optimized outputs wouldn't compress any further. Unlike tar, it keeps an entry per
+    # output in memory until its part is complete, to write its central directory.
+    ZIP = "zip"
+
+
+@dataclass
+class ArchiveOptions:
+    # Whether outputs are streamed into archives in the target directory, instead of being written as separate files
+    enabled: bool = False
+    format: ArchiveFormat = ArchiveFormat.TAR
+    # Size (in MiB) of each part of the archive, after which a new part is started (0 = a single part)
+    part_mb: int = 1024
+    # Name of the parts (e.g. "pictures-0001.tar") and of the index ("pictures.index.csv")
+    name: str = "pictures"
+
+    def __post_init__(self):
+        if self.part_mb < 0:
+            raise ValueError(f"The size of archive parts can't be negative, got {self.part_mb}")
+
+        if self.name == "" or "/" in self.name or "\\" in self.name:
+            raise ValueError(f"Archives must be named without directories, got '{self.name}'")
+
+
+class ArchiveWriter:
+    """Streams outputs into the parts of an archive, one at a time from any thread, and indexes them."""
+
+    def __init__(self, directory: Path, options: ArchiveOptions):
+        self.directory = directory
+        self.options = options
+        self.parts: list[Path] = []
+        self.index_path = directory.joinpath(f"{options.name}.index.csv")
+        self.__file: IO[bytes] | None = None
+        self.__archive: tarfile.TarFile | zipfile.ZipFile | None = None
+        self.__lock = threading.Lock()
+
+        self.__index = open(self.index_path, "w", newline="", encoding="utf-8")  # pylint: disable=consider-using-with
+        self.__index_writer = csv.writer(self.__index)
+        self.__index_writer.writerow(INDEX_FIELDS)
+
+    def add(self, target: Path, data: bytes | memoryview):
+        """Appends an output to the archive, named after its target relative to the target directory."""
+        name = target.relative_to(self.directory).as_posix()
+        max_bytes = self.options.part_mb * 1024 * 1024
+
+        with self.__lock:
+            position = self.__file.tell() if self.__file is not None else 0
+            if self.__file is None or (max_bytes > 0 and position > 0 and position + len(data) > max_bytes):
+                self.__start_part()
+
+            offset = self.__write(name, data)
+            self.__index_writer.writerow((name, self.parts[-1].name, offset, len(data)))
+
+    def close(self):
+        with self.__lock:
+            self.__close_part()
+            self.__index.close()
+
+    def __write(self, name: str, data: bytes | memoryview) -> int:
+        """Writes an entry to the current part, and returns the offset of its data in the part."""
+        assert self.__file is not None
+
+        if isinstance(self.__archive, zipfile.ZipFile):
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            self.__archive.writestr(info, data)
+
+            # The part is seekable, so the data is the last thing written (there is no data descriptor after it)
+            return self.__file.tell() - len(data)
+
+        assert isinstance(self.__archive, tarfile.TarFile)
+
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self.__archive.addfile(info, io.BytesIO(data))
+        # Entries are only needed to list the archive, and would otherwise grow with every output
+        self.__archive.members.clear()
+
+        # Data is padded to whole tar blocks
+        return self.__file.tell() - math.ceil(len(data) / tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+    def __start_part(self):
+        self.__close_part()
+
+        path = self.directory.joinpath(f"{self.options.name}-{len(self.parts) + 1:04d}.{self.options.format.value}")
+        self.parts.append(path)
+        self.__file = open(path, "wb")  # pylint: disable=consider-using-with
+
+        if self.options.format == ArchiveFormat.ZIP:
+            self.__archive = zipfile.ZipFile(self.__file, "w", zipfile.ZIP_STORED)
+        else:
+            self.__archive = tarfile.open(fileobj=self.__file, mode="w", format=tarfile.PAX_FORMAT)
+
+    def __close_part(self):
+        if self.__archive is not None:
+            self.__archive.close()
+            self.__archive = None
+
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
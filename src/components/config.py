@@ -0,0 +1,176 @@
+"""
+Loading of optimization options from config files (TOML or JSON) and command-line assignments, so that the
+optimizers can run without asking any questions.
+
+A config file looks like this (every key is optional, and option names match the fields of the options
+dataclass of each optimizer, e.g. PictureOptions and VideoOptions):
+
+    optimizer = "videos"
+    source = "/data/incoming"
+    target = "/data/optimized"
+    report = "jsonl"
+
+    [videos]
+    short_side_limit = 1080
+    quality = 22
+    preset = "slow"
+
+    [videos.retry_policy]
+    stall_timeout = 60
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import tomllib
+import types
+from enum import Enum
+from pathlib import Path
+from typing import Any, Mapping, TypeVar, Union, get_args, get_origin, get_type_hints
+
+GenericDataclass = TypeVar("GenericDataclass")
+
+
+class ConfigError(Exception):
+    pass
+
+
+def load_config(path: Path) -> dict[str, Any]:
+    try:
+        with open(path, "rb") as config_file:
+            if path.suffix.lower() == ".json":
+                config = json.load(config_file)
+            else:
+                config = tomllib.load(config_file)
+    except (OSError, ValueError) as err:
+        raise ConfigError(f"Could not load config file {path}: {err}") from err
+
+    if not isinstance(config, dict):
+        raise ConfigError(f"Config file {path} must contain a table/object at its top level")
+
+    return config  # type: ignore
+
+
+def parse_assignments(assignments: list[str]) -> dict[str, Any]:
+    """
+    Parses KEY=VALUE assignments into a (possibly nested, for dotted keys) dict.
+    Values are parsed as JSON when possible (numbers, booleans, null...), and kept as strings otherwise.
+    """
+    result: dict[str, Any] = {}
+
+    for assignment in assignments:
+        key, separator, raw_value = assignment.partition("=")
+        if separator == "" or key.strip() == "":
+            raise ConfigError(f"Invalid option '{assignment}', expected KEY=VALUE")
+
+        try:
+            value = json.loads(raw_value)
+        except ValueError:
+            value = raw_value
+
+        *parents, name = key.strip().split(".")
+        target = result
+        for parent in parents:
+            target = target.setdefault(parent, {})
+
+        target[name] = value
+
+    return result
+
+
+def merge(base: Mapping[str, Any], override: Mapping[str, Any]) -> dict[str, Any]:
+    """Deep-merges two dicts, with values from `override` taking precedence."""
+    result = dict(base)
+
+    for key, value in override.items():
+        if isinstance(value, Mapping) and isinstance(result.get(key), Mapping):
+            result[key] = merge(result[key], value)  # type: ignore
+        else:
+            result[key] = value
+
+    return result
+
+
+def build_options(options_class: type[GenericDataclass], values: Mapping[str, Any]) -> GenericDataclass:
+    """Creates an options dataclass from plain values, converting them to the types declared by its fields."""
+    assert dataclasses.is_dataclass(options_class)
+
+    fields = {field.name: field for field in dataclasses.fields(options_class)}
+    unknown = sorted(values.keys() - fields.keys())
+    if len(unknown) > 0:
+        raise ConfigError(
+            f"Unknown option(s) for {options_class.__name__}: {', '.join(unknown)}. "
+            f"Valid options are: {', '.join(fields)}"
+        )
+
+    hints = get_type_hints(options_class)
+
+    return options_class(**{name: __convert(hints[name], value, name) for name, value in values.items()})
+
+
+def __convert(expected_type: Any, value: Any, name: str) -> Any:
+    if get_origin(expected_type) in (Union, types.UnionType):
+        if value is None and type(None) in get_args(expected_type):
+            return None
+
+        errors: list[str] = []
+        for option in get_args(expected_type):
+            if option is type(None):
+                continue
+
+            try:
+                return __convert(option, value, name)
+            except ConfigError as err:
+                errors.append(str(err))
+
+        raise ConfigError(errors[0] if len(errors) > 0 else f"Invalid value for option '{name}': {value!r}")
+
+    if get_origin(expected_type) in (list, tuple):
+        if not isinstance(value, (list, tuple)):
+            raise ConfigError(f"Option '{name}' must be a list, got {value!r}")
+
+        item_type = get_args(expected_type)[0] if len(get_args(expected_type)) > 0 else Any
+
+        return [__convert(item_type, item, name) for item in value]  # type: ignore
+
+    if not isinstance(expected_type, type):
+        return value
+
+    if dataclasses.is_dataclass(expected_type):
+        if isinstance(value, expected_type):
+            return value
+        if not isinstance(value, Mapping):
+            raise ConfigError(f"Option '{name}' must be a table/object, got {value!r}")
+
+        return build_options(expected_type, value)  # type: ignore
+
+    if issubclass(expected_type, Enum):
+        try:
+            return expected_type(value)
+        except ValueError as err:
+            valid_values = ", ".join(repr(member.value) for member in expected_type)
+            raise ConfigError(
+                f"Invalid value for option '{name}': {value!r}. Valid values are: {valid_values}"
+            ) from err
+
+    if expected_type is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ("true", "yes", "1", "false", "no", "0"):
+            return value.lower() in ("true", "yes", "1")
+
+        raise ConfigError(f"Option '{name}' must be a boolean, got {value!r}")
+
+    if expected_type in (int, float, str, Path):
+        try:
+            converted = expected_type(value)
+        except (TypeError, ValueError) as err:
+            raise ConfigError(f"Option '{name}' must be of type {expected_type.__name__}, got {value!r}") from err
+
+        if expected_type is int and isinstance(value, float) and converted != value:
+            raise ConfigError(f"Option '{name}' must be an integer, got {value!r}")
+
+        return converted
+
+    return value
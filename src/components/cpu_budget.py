@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class CpuBudget:
+    """
+    Counting semaphore over CPU cores, shared by everything that runs at the same time (e.g. picture workers and a
+    video encode). Cores are granted in request order, so that a request for several cores isn't starved by a
+    stream of requests for a single one.
+    """
+
+    def __init__(self, cores: int):
+        self.cores = max(cores, 1)
+        self.__available = self.cores
+        self.__condition = threading.Condition()
+        self.__waiting: deque[object] = deque()
+
+    @property
+    def available(self) -> int:
+        with self.__condition:
+            return self.__available
+
+    def acquire(self, cores: int) -> int:
+        """Blocks until the requested cores (capped to the budget) are available, and returns how many were granted."""
+        cores = min(max(cores, 1), self.cores)
+        ticket = object()
+
+        with self.__condition:
+            self.__waiting.append(ticket)
+            self.__condition.wait_for(lambda: self.__waiting[0] is ticket and self.__available >= cores)
+            self.__waiting.popleft()
+            self.__available -= cores
+            # The next request in line might fit in what is left
+            self.__condition.notify_all()
+
+        return cores
+
+    def release(self, cores: int):
+        with self.__condition:
+            self.__available = min(self.__available + cores, self.cores)
+            self.__condition.notify_all()
+
+    @contextmanager
+    def reserve(self, cores: int) -> Iterator[int]:
+        granted = self.acquire(cores)
+
+        try:
+            yield granted
+        finally:
+            self.release(granted)
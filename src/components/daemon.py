@@ -0,0 +1,213 @@
+"""
+Long-running mode that watches a source directory and optimizes new files as soon as they have been fully written.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Generic
+
+from src.components.files import GenericFile
+from src.components.media_optimizer import GenericOptions, MediaOptimizer
+from src.components.results import ResultsReport
+from src.components.watcher import Watcher, WatchEvent
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_METRICS_INTERVAL = 60.0
+METRICS_FILE_NAME = ".watch_metrics.json"
+
+
+class LatencyStats:
+    """Ingest-to-output latency of the most recent files. Only a fixed window is kept, so memory usage is stable."""
+
+    def __init__(self, window: int = 1000):
+        self.__latencies: deque[float] = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds: float):
+        self.__latencies.append(seconds)
+        self.count += 1
+
+    def summary(self) -> dict[str, float]:
+        if len(self.__latencies) == 0:
+            return {}
+
+        latencies = sorted(self.__latencies)
+
+        return {
+            "mean": round(sum(latencies) / len(latencies), 3),
+            "p50": round(latencies[int(0.50 * (len(latencies) - 1))], 3),
+            "p95": round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+            "max": round(latencies[-1], 3),
+        }
+
+
+class WatchDaemon(Generic[GenericFile, GenericOptions]):
+    """
+    Feeds the files reported by a watcher into an optimizer through a bounded work queue, until interrupted.
+
+    The calling thread is always one of the workers, so that keyboard interruptions reach the running job.
+    """
+
+    def __init__(
+        self,
+        optimizer: MediaOptimizer[GenericFile, GenericOptions],
+        options: GenericOptions,
+        watcher: Watcher,
+        target_dir: Path,
+        workers: int = 1,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        metrics_interval: float = DEFAULT_METRICS_INTERVAL,
+        report: ResultsReport | None = None,
+    ):
+        self.optimizer = optimizer
+        self.options = options
+        self.watcher = watcher
+        self.target_dir = target_dir
+        self.workers = max(workers, 1)
+        self.metrics_interval = metrics_interval
+        self.metrics_file = Path(target_dir, METRICS_FILE_NAME)
+        self.report = report
+
+        self.latency = LatencyStats()
+        self.failed = 0
+
+        self.__queue: queue.Queue[WatchEvent] = queue.Queue(maxsize=queue_size)
+        self.__in_flight: set[Path] = set()
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        # Error that stopped the watcher, raised again by run() once the workers are done
+        self.__producer_error: Exception | None = None
+        self.__last_published_at = time.monotonic()
+
+    def run(self):
+        producer = threading.Thread(target=self.__produce, name="watcher", daemon=True)
+        producer.start()
+
+        consumers = [
+            threading.Thread(target=self.__consume, name=f"worker-{idx}", daemon=True)
+            for idx in range(1, self.workers)
+        ]
+        for consumer in consumers:
+            consumer.start()
+
+        print(f"Watching {self.watcher.directory} for new files (press Ctrl+C to stop)...\n")
+
+        try:
+            self.__consume(publish_metrics=True)
+        except KeyboardInterrupt:
+            print("\nStopping...")
+        finally:
+            self.__stop.set()
+
+            for consumer in consumers:
+                consumer.join()
+
+            self.optimizer.wait_for_verification()
+            self.__publish_metrics()
+
+        if self.__producer_error is not None:
+            raise self.__producer_error
+
+    def __produce(self):
+        try:
+            self.__watch()
+        except Exception as err:  # pylint: disable=broad-exception-caught  # <- raised again by run()
+            self.__producer_error = err
+        finally:
+            # Without a watcher no more files will be queued, so the daemon stops
+            self.__stop.set()
+
+    def __watch(self):
+        for event in self.watcher.watch(self.__stop):
+            with self.__lock:
+                if event.path in self.__in_flight:
+                    continue
+
+                self.__in_flight.add(event.path)
+
+            # Block while the queue is full, so that a burst of new files can't exhaust memory
+            while not self.__stop.is_set():
+                try:
+                    self.__queue.put(event, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+
+    def __consume(self, publish_metrics: bool = False):
+        while not self.__stop.is_set():
+            if publish_metrics and time.monotonic() - self.__last_published_at >= self.metrics_interval:
+                self.__publish_metrics()
+
+            try:
+                event = self.__queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            try:
+                self.__process(event)
+            finally:
+                with self.__lock:
+                    self.__in_flight.discard(event.path)
+
+                self.optimizer.media_info_service.forget(event.path)
+
+    def __process(self, event: WatchEvent):
+        error: str | None = None
+
+        try:
+            # Probing the file can fail too (e.g. if it was deleted in the meantime, or is still being written)
+            if not event.path.is_file() or not self.optimizer.is_valid_file(event.path):
+                return
+
+            file = self.optimizer.create_file(event.path, Path(self.target_dir, event.path.name))
+            self.optimizer.process_file(file, self.options, self.report)
+            error = file.error
+        except Exception as err:  # pylint: disable=broad-exception-caught  # <- one bad file must not stop the daemon
+            error = str(err) or type(err).__name__
+
+        latency = time.monotonic() - event.detected_at
+
+        with self.__lock:
+            if error is not None:
+                self.failed += 1
+            else:
+                self.latency.add(latency)
+
+        if error is not None:
+            print(f'{self.__timestamp()} [ERROR] "{event.path.name}" could not be optimized: {error}')
+        else:
+            print(f'{self.__timestamp()} Optimized "{event.path.name}" ({round(latency, 2)}s after landing)')
+
+    def __publish_metrics(self):
+        with self.__lock:
+            metrics: dict[str, Any] = {
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+                "processed": self.latency.count,
+                "failed": self.failed,
+                "queued": self.__queue.qsize(),
+                "latency_seconds": self.latency.summary(),
+            }
+
+        self.__last_published_at = time.monotonic()
+
+        tmp_file = self.metrics_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+        os.replace(tmp_file, self.metrics_file)
+
+        if metrics["processed"] > 0 or metrics["failed"] > 0:
+            latency = metrics["latency_seconds"]
+            print(
+                f"{self.__timestamp()} processed={metrics['processed']} failed={metrics['failed']} "
+                f"queued={metrics['queued']} latency p50={latency.get('p50', '-')}s p95={latency.get('p95', '-')}s"
+            )
+
+    def __timestamp(self) -> str:
+        return datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
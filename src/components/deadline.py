@@ -0,0 +1,96 @@
+"""
+Planning of encoder presets against a wall-clock deadline, so that a batch uses the slowest (most efficient) presets
+that still let it finish in time.
+
+Throughput is measured while encoding, in units of work per second (see MediaOptimizer.estimate_work()), and the
+plan is made again before each file with the latest measurements and the time that is left.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Generic, Mapping, TypeVar
+
+GenericPreset = TypeVar("GenericPreset")
+
+# Weight of each new throughput measurement in the moving average of its preset
+SMOOTHING = 0.3
+
+
+class DeadlinePlanner(Generic[GenericPreset]):
+    def __init__(self, deadline_seconds: float, relative_speeds: Mapping[GenericPreset, float]):
+        """
+        Plans presets for a run that must end within `deadline_seconds` from now. `relative_speeds` contains every
+        preset, with its approximate speed relative to the others (e.g. 1.0 and 0.5 for one that is twice as slow),
+        which is only used to extrapolate the throughput of presets that haven't been measured yet.
+        """
+        self.deadline = time.monotonic() + deadline_seconds
+        # From slowest to fastest, as slower presets are preferred
+        self.presets = sorted(relative_speeds, key=lambda preset: relative_speeds[preset])
+        self.__relative_speeds = dict(relative_speeds)
+        self.__throughputs: dict[GenericPreset, float] = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def seconds_left(self) -> float:
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def observe(self, preset: GenericPreset, work_per_second: float):
+        """Records a throughput measurement (e.g. from the progress of an encode) for a preset."""
+        if work_per_second <= 0:
+            return
+
+        with self.__lock:
+            previous = self.__throughputs.get(preset)
+            self.__throughputs[preset] = (
+                work_per_second if previous is None else previous + SMOOTHING * (work_per_second - previous)
+            )
+
+    def throughput(self, preset: GenericPreset) -> float | None:
+        """Measured (or, if not measured yet, extrapolated) work per second of a preset, or None if nothing is known."""
+        with self.__lock:
+            if preset in self.__throughputs:
+                return self.__throughputs[preset]
+
+            estimates = [
+                throughput * self.__relative_speeds[preset] / self.__relative_speeds[measured]
+                for measured, throughput in self.__throughputs.items()
+            ]
+
+        return sum(estimates) / len(estimates) if len(estimates) > 0 else None
+
+    def choose(self, work: float, remaining_work: float) -> GenericPreset:
+        """
+        Chooses the preset for the next file, given its work and the work of the files after it.
+
+        The rest of the files are planned with the slowest preset that lets all of them finish in time, and the next
+        file gets the slowest preset that still fits along with them, so that any time left is used up first. Until a
+        throughput has been measured, or if not even the fastest preset fits, the fastest preset is chosen.
+        """
+        fastest = self.presets[-1]
+        seconds_left = self.seconds_left
+
+        def seconds(preset: GenericPreset, amount: float) -> float | None:
+            throughput = self.throughput(preset)
+            return amount / throughput if throughput is not None else None
+
+        rest_preset = next(
+            (
+                preset
+                for preset in self.presets
+                if (total := seconds(preset, work + remaining_work)) is not None and total <= seconds_left
+            ),
+            None,
+        )
+        if rest_preset is None:
+            return fastest
+
+        rest_seconds = seconds(rest_preset, remaining_work) or 0.0
+
+        for preset in self.presets:
+            file_seconds = seconds(preset, work)
+            if file_seconds is not None and file_seconds + rest_seconds <= seconds_left:
+                return preset
+
+        return rest_preset
@@ -0,0 +1,246 @@
+"""
+Dry-run estimation of the output size and processing time of a batch, without optimizing it.
+
+A random sample of files (or representative parts of them, see MediaOptimizer.sample_file()) is optimized into a
+temporary directory, and the results are extrapolated to the whole batch with ratio estimators: output bytes per
+source byte, and seconds per unit of work (see MediaOptimizer.estimate_work()). Their confidence intervals shrink as
+more files are sampled, and collapse to the measured values when every file is sampled.
+
+Files are sampled and extrapolated separately for each lane they are optimized in (see MediaOptimizer.get_lane()),
+e.g. pictures and videos in mixed runs, whose work isn't measured in the same units. Lanes run at the same time, so
+the run takes as long as its slowest lane.
+"""
+
+from __future__ import annotations
+
+import math
+import random
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from src.components.files import Files, GenericFile, get_file_size_as_str
+
+if TYPE_CHECKING:
+    from src.components.media_optimizer import MediaOptimizer
+
+DEFAULT_SAMPLE_SIZE = 8
+Z_SCORE_95 = 1.96
+
+
+class EstimateError(Exception):
+    pass
+
+
+@dataclass
+class EstimateSample:
+    """Measured results of optimizing a sampled file. Work and source bytes only cover the part that was optimized."""
+
+    work: float
+    source_bytes: int
+    target_bytes: int | None
+    seconds: float
+    error: str | None = None
+
+
+@dataclass
+class Interval:
+    value: float
+    # Unknown when there are not enough successful samples to measure their variance
+    low: float | None
+    high: float | None
+
+
+@dataclass
+class Estimate:
+    total_files: int
+    sampled_files: int
+    failed_samples: int
+    source_bytes: int
+    target_bytes: Interval
+    seconds: Interval
+    estimation_seconds: float
+
+    @property
+    def size_reduction(self) -> Interval:
+        """Size reduction as a fraction of the source size (a smaller output means a bigger reduction)."""
+        if self.source_bytes == 0:
+            return Interval(0.0, 0.0, 0.0)
+
+        def reduction(target_bytes: float | None) -> float | None:
+            return 1 - target_bytes / self.source_bytes if target_bytes is not None else None
+
+        return Interval(
+            reduction(self.target_bytes.value),  # type: ignore
+            reduction(self.target_bytes.high),
+            reduction(self.target_bytes.low),
+        )
+
+
+def estimate(
+    optimizer: MediaOptimizer[GenericFile, Any],
+    files: Files[GenericFile],
+    options: Any,
+    sample_size: int = DEFAULT_SAMPLE_SIZE,
+    seed: int | None = None,
+) -> Estimate:
+    """Samples up to `sample_size` files at random, and extrapolates their results to every file."""
+    start = time.perf_counter()
+    population = list(files)
+    rng = random.Random(seed)
+
+    lanes: dict[str, list[GenericFile]] = defaultdict(list)
+    workers: dict[str, int] = {}
+    for file in population:
+        lane, workers[lane] = optimizer.get_lane(file)
+        lanes[lane].append(file)
+
+    target_bytes: list[Interval] = []
+    lane_seconds: list[Interval] = []
+    sampled = failed = 0
+
+    with tempfile.TemporaryDirectory(prefix="media_optimizer_estimate_") as sample_dir:
+        for lane, lane_files in lanes.items():
+            # Allocated in proportion to the size of each lane, but every lane needs at least one sample
+            lane_sample_size = max(round(max(sample_size, 1) * len(lane_files) / len(population)), 1)
+            sampled_files = rng.sample(lane_files, min(lane_sample_size, len(lane_files)))
+            samples = [optimizer.sample_file(file, options, Path(sample_dir)) for file in sampled_files]
+
+            successful = [sample for sample in samples if sample.error is None and sample.target_bytes is not None]
+            if len(successful) == 0:
+                errors = "; ".join(sorted({sample.error or "no output" for sample in samples}))
+                raise EstimateError(f"None of the sampled files of the {lane} lane could be optimized ({errors})")
+
+            sampled += len(samples)
+            failed += len(samples) - len(successful)
+
+            target_bytes.append(
+                __ratio_estimate(
+                    [sample.source_bytes for sample in successful],
+                    [sample.target_bytes or 0 for sample in successful],
+                    sum(file.source.stat().st_size for file in lane_files),
+                    len(lane_files),
+                )
+            )
+            lane_seconds.append(
+                __scale(
+                    __ratio_estimate(
+                        [sample.work for sample in successful],
+                        [sample.seconds for sample in successful],
+                        sum(optimizer.estimate_work(file) for file in lane_files),
+                        len(lane_files),
+                    ),
+                    # Samples are optimized one at a time, but the files of a lane are split between its workers
+                    1 / min(workers[lane], len(lane_files)),
+                )
+            )
+
+    return Estimate(
+        total_files=len(population),
+        sampled_files=sampled,
+        failed_samples=failed,
+        source_bytes=sum(file.source.stat().st_size for file in population),
+        target_bytes=__sum(target_bytes),
+        seconds=__slowest(lane_seconds),
+        estimation_seconds=time.perf_counter() - start,
+    )
+
+
+def __ratio_estimate(xs: list[float], ys: list[float], x_total: float, population_size: int) -> Interval:
+    """
+    Estimates the total of y over the population from a simple random sample, as the sample's y/x ratio times the
+    known total of x, with a 95% confidence interval from the (finite population corrected) variance of its residuals.
+    """
+    sample_size = len(xs)
+    ratio = sum(ys) / sum(xs) if sum(xs) > 0 else 0.0
+    value = ratio * x_total
+
+    if sample_size >= population_size:
+        return Interval(value, value, value)
+    if sample_size < 2:
+        return Interval(value, None, None)
+
+    residual_variance = sum((y - ratio * x) ** 2 for x, y in zip(xs, ys)) / (sample_size - 1)
+    variance = population_size**2 * (1 - sample_size / population_size) * residual_variance / sample_size
+    margin = Z_SCORE_95 * math.sqrt(variance)
+
+    return Interval(value, max(value - margin, 0.0), value + margin)
+
+
+def __sum(intervals: list[Interval]) -> Interval:
+    """Total of independent estimates, whose margins add up in quadrature."""
+    value = sum(interval.value for interval in intervals)
+    if any(interval.high is None for interval in intervals):
+        return Interval(value, None, None)
+
+    margin = math.sqrt(sum((interval.high - interval.value) ** 2 for interval in intervals))  # type: ignore
+
+    return Interval(value, max(value - margin, 0.0), value + margin)
+
+
+def __slowest(intervals: list[Interval]) -> Interval:
+    """Duration of lanes that run at the same time, which is that of the slowest one."""
+    lows = [interval.low for interval in intervals]
+    highs = [interval.high for interval in intervals]
+
+    return Interval(
+        max(interval.value for interval in intervals),
+        max(lows) if None not in lows else None,  # type: ignore
+        max(highs) if None not in highs else None,  # type: ignore
+    )
+
+
+def __scale(interval: Interval, factor: float) -> Interval:
+    return Interval(
+        interval.value * factor,
+        interval.low * factor if interval.low is not None else None,
+        interval.high * factor if interval.high is not None else None,
+    )
+
+
+def get_duration_as_str(seconds: float) -> str:
+    seconds = round(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+
+    if hours > 0:
+        return f"{hours}h {minutes:02}m"
+    if minutes > 0:
+        return f"{minutes}m {seconds:02}s"
+
+    return f"{seconds}s"
+
+
+def print_estimate_info(result: Estimate):
+    def interval_as_str(interval: Interval, to_str: Any) -> str:
+        if interval.low is None or interval.high is None:
+            return f"{to_str(interval.value)} (not enough samples for a confidence interval)"
+        if interval.low == interval.high:
+            return to_str(interval.value)
+
+        return f"{to_str(interval.value)} ({to_str(interval.low)} - {to_str(interval.high)})"
+
+    def percent(value: float) -> str:
+        return f"{round(value * 100, 1)}%"
+
+    def size(value: float) -> str:
+        return get_file_size_as_str(round(value))
+
+    print(f"\nEstimate based on {result.sampled_files} of {result.total_files} file(s), with 95% confidence intervals:")
+    print(f"- Total initial size: {get_file_size_as_str(result.source_bytes)}")
+    print(f"- Estimated final size: {interval_as_str(result.target_bytes, size)}")
+    print(f"- Estimated size reduction: {interval_as_str(result.size_reduction, percent)}")
+    print(f"- Estimated processing time: {interval_as_str(result.seconds, get_duration_as_str)}")
+
+    if result.failed_samples > 0:
+        print(f"\n[WARNING] {result.failed_samples} sampled file(s) could not be optimized, and were left out")
+
+    share = (
+        f" ({percent(result.estimation_seconds / result.seconds.value)} of the estimated time)"
+        if result.seconds.value > 0
+        else ""
+    )
+    print(f"\nThe estimate took {get_duration_as_str(result.estimation_seconds)}{share}\n")
@@ -1,16 +1,164 @@
 import concurrent
+import os
+import signal
 import subprocess
-from typing import IO, Optional, Union, override
+import time
+from dataclasses import dataclass
+from typing import IO, Optional, Self, Union, override
 
 from ffmpeg import FFmpeg as BaseFFmpeg
+from ffmpeg import Progress
 from ffmpeg.errors import FFmpegAlreadyExecuted, FFmpegError
 from ffmpeg.utils import create_subprocess, ensure_io  # type: ignore
 
+from src.components.resources import Throttle
+from src.components.results import record_child_cpu_time
+
+# Input options that make FFmpeg skip over corrupt packets instead of stalling or aborting on them
+TOLERANT_INPUT_OPTIONS: dict[str, str] = {
+    "fflags": "+discardcorrupt+genpts",
+    "err_detect": "ignore_err",
+}
+
+
+class FFmpegStalled(FFmpegError):
+    "Represents FFmpeg was killed by the watchdog because it stopped making progress or took too long"
+
+
+@dataclass
+class RetryPolicy:
+    """Settings that control when a running FFmpeg job is considered stalled, and how failed jobs are retried."""
+
+    # Seconds without `progress.time` advancing after which the job is killed
+    stall_timeout: float = 120.0
+    # Max wall-clock runtime, as a multiple of the media duration. The lower bound avoids killing very short media
+    # while FFmpeg is still warming up.
+    max_runtime_factor: float = 30.0
+    min_max_runtime: float = 600.0
+    # Total attempts per file, and seconds to wait before the first retry (doubled on each subsequent retry)
+    max_attempts: int = 3
+    backoff: float = 5.0
+    # Whether retries should use more tolerant decoding flags (see TOLERANT_INPUT_OPTIONS)
+    tolerant_retries: bool = True
+
+    def __post_init__(self):
+        if self.max_attempts < 1:
+            raise ValueError(f"There must be at least 1 attempt per file, got {self.max_attempts}")
+
+        if self.backoff < 0:
+            raise ValueError(f"The retry backoff can't be negative, got {self.backoff}")
+
+    def max_runtime(self, expected_duration: float | None) -> float | None:
+        if expected_duration is None or self.max_runtime_factor <= 0:
+            return None
+
+        return max(expected_duration * self.max_runtime_factor, self.min_max_runtime)
+
+    def backoff_for(self, attempt: int) -> float:
+        """Returns the delay before the provided attempt (1-based, so attempt 2 is the first retry)."""
+        return self.backoff * 2 ** max(attempt - 2, 0)
+
+
+class Watchdog:
+    """Tracks the progress events of an FFmpeg job, and decides when the job should be killed."""
+
+    def __init__(self, stall_timeout: float | None = None, max_runtime: float | None = None):
+        self.stall_timeout = stall_timeout
+        self.max_runtime = max_runtime
+        self.__started_at = time.monotonic()
+        self.__last_advance_at = self.__started_at
+        self.__last_time = -1.0
+
+    @classmethod
+    def from_policy(cls, policy: RetryPolicy, expected_duration: float | None = None) -> Self:
+        return cls(policy.stall_timeout, policy.max_runtime(expected_duration))
+
+    def start(self):
+        self.__started_at = time.monotonic()
+        self.__last_advance_at = self.__started_at
+        self.__last_time = -1.0
+
+    def postpone(self, seconds: float):
+        """Gives the job more time, e.g. while it is paused on purpose."""
+        self.__started_at += seconds
+        self.__last_advance_at += seconds
+
+    def on_progress(self, progress: Progress):
+        seconds = progress.time.total_seconds()
+
+        if seconds > self.__last_time:
+            self.__last_time = seconds
+            self.__last_advance_at = time.monotonic()
+
+    def check(self) -> str | None:
+        """Returns the reason why the job should be killed, or None if it is still healthy."""
+        now = time.monotonic()
+
+        if self.stall_timeout is not None and now - self.__last_advance_at > self.stall_timeout:
+            return f"no progress for {round(now - self.__last_advance_at)}s"
+
+        if self.max_runtime is not None and now - self.__started_at > self.max_runtime:
+            return f"runtime exceeded {round(self.max_runtime)}s"
+
+        return None
+
 
 class FFmpeg(BaseFFmpeg):
+    # Seconds to wait for FFmpeg to exit gracefully after being terminated by the watchdog, before killing it
+    KILL_GRACE_PERIOD = 10.0
+
+    _watchdog: Watchdog | None = None
+
+    def watch(self, watchdog: Watchdog) -> Self:
+        """Attaches a watchdog that will kill the job if it stalls. execute() then raises FFmpegStalled."""
+        self._watchdog = watchdog
+        self.on("progress", watchdog.on_progress)  # type: ignore
+
+        return self
+
+    def throttle(self, throttle: Throttle, input_bytes: int, expected_duration: float | None) -> Self:
+        """
+        Keeps the bytes read and written by the job under the rate of a throttle, by pausing FFmpeg whenever it gets
+        ahead of it. Bytes read are estimated from the progress through the input, which is `input_bytes` long.
+        """
+        transferred = 0
+
+        def on_progress(progress: Progress):
+            nonlocal transferred
+
+            read = input_bytes * min(progress.time.total_seconds() / expected_duration, 1) if expected_duration else 0
+            total = int(read) + progress.size
+            delay = throttle.reserve(total - transferred)
+            transferred = total
+
+            if delay > 0:
+                self.pause(delay)
+
+        self.on("progress", on_progress)  # type: ignore
+
+        return self
+
+    def pause(self, seconds: float):
+        """Suspends the running FFmpeg process for a while. Only possible on POSIX systems, elsewhere it keeps going."""
+        process: subprocess.Popen[bytes] | None = getattr(self, "_process", None)
+        if process is None or not hasattr(signal, "SIGSTOP"):
+            return
+
+        if self._watchdog is not None:
+            self._watchdog.postpone(seconds)
+
+        process.send_signal(signal.SIGSTOP)
+        try:
+            time.sleep(seconds)
+        finally:
+            process.send_signal(signal.SIGCONT)
+
     @override
     def execute(self, stream: Optional[Union[bytes, IO[bytes]]] = None, timeout: Optional[float] = None) -> bytes:
-        """Overridden version of Ffmpeg.execute() to fix keyboard interruptions not working correctly in some cases."""
+        """
+        Overridden version of Ffmpeg.execute() to fix keyboard interruptions not working correctly in some cases,
+        and to support watchdogs.
+        """
         if self._executed:
             raise FFmpegAlreadyExecuted("FFmpeg is already executed", arguments=self.arguments)
 
@@ -30,35 +178,62 @@ class FFmpeg(BaseFFmpeg):
             stderr=subprocess.PIPE,
         )
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:  # type: ignore
-            self._executed = True
-            futures = [  # type: ignore
-                executor.submit(self._write_stdin, stream),  # type: ignore
-                executor.submit(self._read_stdout),  # type: ignore
-                executor.submit(self._handle_stderr),  # type: ignore
-                executor.submit(self._process.wait, timeout),  # type: ignore
-            ]
-            pending = futures  # type: ignore
-            try:
-                while pending:
-                    done, pending = concurrent.futures.wait(  # type: ignore
-                        futures,
-                        timeout=1,
-                        return_when=concurrent.futures.FIRST_EXCEPTION,  # type: ignore
-                    )
-            except KeyboardInterrupt as e:
-                self.terminate()
-                executor.shutdown(wait=True, cancel_futures=True)  # type: ignore
-                raise e
-            self._executed = False
-
-            for future in done:  # type: ignore
-                exception = future.exception()  # type: ignore
-                if exception is not None:
-                    self._process.terminate()  # type: ignore
-                    concurrent.futures.wait(pending)  # type: ignore
-
-                    raise exception
+        if self._watchdog is not None:
+            self._watchdog.start()
+
+        self.__child_cpu_seconds = 0.0
+        stall_reason: str | None = None
+        terminated_at = 0.0
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:  # type: ignore
+                self._executed = True
+                futures = [  # type: ignore
+                    executor.submit(self._write_stdin, stream),  # type: ignore
+                    executor.submit(self._read_stdout),  # type: ignore
+                    executor.submit(self._handle_stderr),  # type: ignore
+                    executor.submit(self.__wait, timeout),
+                ]
+                pending = futures  # type: ignore
+                try:
+                    while pending:
+                        done, pending = concurrent.futures.wait(  # type: ignore
+                            futures,
+                            timeout=1,
+                            return_when=concurrent.futures.FIRST_EXCEPTION,  # type: ignore
+                        )
+
+                        if not pending or self._watchdog is None:
+                            continue
+
+                        if stall_reason is None:
+                            stall_reason = self._watchdog.check()
+                            if stall_reason is not None:
+                                self.terminate()
+                                terminated_at = time.monotonic()
+                        elif time.monotonic() - terminated_at > self.KILL_GRACE_PERIOD:
+                            # A hung FFmpeg process might not react to the graceful termination signal
+                            self._process.kill()  # type: ignore
+                except KeyboardInterrupt as e:
+                    self.terminate()
+                    executor.shutdown(wait=True, cancel_futures=True)  # type: ignore
+                    raise e
+                self._executed = False
+
+                for future in done:  # type: ignore
+                    exception = future.exception()  # type: ignore
+                    if exception is not None:
+                        self._process.terminate()  # type: ignore
+                        concurrent.futures.wait(pending)  # type: ignore
+
+                        raise exception
+        finally:
+            # The executor waits for FFmpeg to be reaped before exiting, and the CPU time it used is attributed to the
+            # work of the calling thread
+            record_child_cpu_time(self.__child_cpu_seconds)
+
+        if stall_reason is not None:
+            raise FFmpegStalled(message=f"FFmpeg job killed by watchdog: {stall_reason}", arguments=self.arguments)
 
         if self._process.returncode == 0:  # type: ignore
             self.emit("completed")
@@ -68,3 +243,25 @@ class FFmpeg(BaseFFmpeg):
             raise FFmpegError.create(message=futures[2].result(), arguments=self.arguments)  # type: ignore
 
         return futures[1].result()  # type: ignore
+
+    def __wait(self, timeout: Optional[float]) -> int:
+        """Waits for FFmpeg to exit like Popen.wait(), also collecting the CPU time it used where wait4() exists."""
+        process: subprocess.Popen[bytes] = self._process  # type: ignore
+
+        if timeout is not None or not hasattr(os, "wait4"):
+            return process.wait(timeout)
+
+        # Same lock as Popen.wait(), so that polling it from another thread (e.g. terminate()) can't reap it first
+        with process._waitpid_lock:  # type: ignore  # pylint: disable=protected-access
+            if process.returncode is None:
+                try:
+                    _, status, usage = os.wait4(process.pid, 0)
+                except ChildProcessError:
+                    # Already reaped elsewhere, which Popen.wait() also takes as a success, so its CPU time is unknown
+                    process.returncode = 0
+                    return 0
+
+                process.returncode = os.waitstatus_to_exitcode(status)
+                self.__child_cpu_seconds += usage.ru_utime + usage.ru_stime
+
+        return process.returncode
@@ -2,17 +2,36 @@ from __future__ import annotations
 
 import math
 import os
-import sys
+import shutil
+import threading
+from enum import Enum
 from pathlib import Path
-from typing import Callable, Generic, TypeVar
-
-from pymediainfo import MediaInfo
+from typing import TYPE_CHECKING, Callable, Generic, TypeVar
 
+from src.components.metrics import METRICS
+from src.components.profiling import PROFILER
 from src.components.stdout import CLEAR_LINE
 
+if TYPE_CHECKING:
+    from pymediainfo import MediaInfo
+
 DEFAULT_TARGET_DIR = "optimized"
 FILE_SIZE_UNITS = ("B", "KiB", "MiB", "GiB", "TiB", "PiB", "EiB", "ZiB", "YiB")
 
+# libmediainfo is not safe to use from several threads at the same time, even through different services
+_MEDIAINFO_LOCK = threading.Lock()
+
+
+class FilesError(Exception):
+    pass
+
+
+class FileOrder(str, Enum):
+    # Most work first, so that a long job doesn't start last and stretch a parallel run while other workers sit idle
+    LARGEST_FIRST = "largest"
+    # Order in which the files are listed in the source directory
+    LISTING = "listing"
+
 
 class File:
     """A file to optimize, whose definition includes both the source and target paths."""
@@ -20,6 +39,54 @@ class File:
     def __init__(self, source: Path, target: Path):
         self.source = source
         self.target = target
+        # Size of the source when it was found, which is still known if it is moved or deleted later on
+        self.source_bytes = source.stat().st_size
+        self.error: str | None = None
+        self.skip_reason: str | None = None
+        # Seconds spent in each stage of the optimization (see METRICS.stage())
+        self.timings: dict[str, float] = {}
+        # Targets of the renditions written instead of the target, when optimizing to several sizes at once
+        self.renditions: list[Path] = []
+        # Why the output looks broken, if it was verified and it does (see src.components.verification)
+        self.suspect_reason: str | None = None
+        # Total size of the outputs streamed into an archive instead of being written as files (see
+        # src.components.archive)
+        self.archived_bytes: int | None = None
+
+    def reset(self):
+        """Clears the outcome of any previous optimization of this file."""
+        self.error = None
+        self.skip_reason = None
+        self.timings.clear()
+        self.renditions.clear()
+        self.suspect_reason = None
+        self.archived_bytes = None
+
+    def rendition_target(self, name: str) -> Path:
+        """Target of a rendition, in a subdirectory of the target directory named after the rendition."""
+        return Path(self.target.parent, name, self.target.name)
+
+    @property
+    def outputs(self) -> list[Path]:
+        return self.renditions if len(self.renditions) > 0 else [self.target]
+
+    @property
+    def output_bytes(self) -> int | None:
+        """Total size of the outputs that exist (or that were archived), or None if there are none."""
+        if self.archived_bytes is not None:
+            return self.archived_bytes
+
+        sizes = [output.stat().st_size for output in self.outputs if output.is_file()]
+
+        return sum(sizes) if len(sizes) > 0 else None
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    @property
+    def skipped(self) -> bool:
+        return self.skip_reason is not None
 
 
 GenericFile = TypeVar("GenericFile", bound=File, covariant=True, default=File)
@@ -30,31 +97,33 @@ class Files(Generic[GenericFile]):
 
     def __init__(
         self,
-        source_dir: str,
-        target_dir: str | None = None,
+        source_dir: str | Path,
+        target_dir: str | Path | None = None,
         filter_lambda: Callable[[Path], bool] | None = None,
         create_file_lambda: Callable[[Path, Path], GenericFile] | None = None,
+        allow_empty: bool = False,
+        create_target_dir: bool = True,
     ):
         self.source_dir = Path(source_dir)
         if not self.source_dir.is_dir():
-            print("[ERROR] The provided source path is not a directory or does not exist")
-
-            sys.exit(1)
+            raise FilesError(f"The provided source path is not a directory or does not exist: {self.source_dir}")
 
         self.target_dir = Path(target_dir) if target_dir is not None else Path(source_dir, DEFAULT_TARGET_DIR)
         self.initial_size = 0
         self.final_size = 0
+        # Files of the source directory that the optimizer doesn't handle (e.g. documents), which can be mirrored
+        self.unmatched: list[Path] = []
         self.__files: list[GenericFile] = []
         self.__extensions: set[str] = set()
 
-        self.__load_files(filter_lambda, create_file_lambda)
+        with METRICS.stage("scan"), PROFILER.profile("scan", is_file=False):
+            self.__load_files(filter_lambda, create_file_lambda)
 
-        if len(self.__files) == 0:
-            print(f"[ERROR] No valid files found for selected optimizer in source directory {self.source_dir}")
+        if len(self.__files) == 0 and not allow_empty:
+            raise FilesError(f"No valid files found for selected optimizer in source directory {self.source_dir}")
 
-            sys.exit(1)
-
-        self.__init_target_dir()
+        if create_target_dir:
+            self.__init_target_dir()
 
     def __getitem__(self, index: int):
         return self.__files[index]
@@ -75,16 +144,17 @@ class Files(Generic[GenericFile]):
             source = Path(self.source_dir, fname)
             target = Path(self.target_dir, fname)
 
-            if source.is_dir() or (filter_lambda is not None and not filter_lambda(source)):
+            if source.is_dir():
+                continue
+
+            if filter_lambda is not None and not filter_lambda(source):
+                self.unmatched.append(source)
                 continue
 
-            self.__files.append(
-                create_file_lambda(source, target)
-                if create_file_lambda is not None
-                else File(source, target)  # type: ignore
-            )  # fmt: skip
+            file = create_file_lambda(source, target) if create_file_lambda is not None else File(source, target)
+            self.__files.append(file)  # type: ignore  # <- plain files are only created without an optimizer
             self.__extensions.add(Path(fname).suffix)
-            self.initial_size += source.stat().st_size
+            self.initial_size += file.source_bytes
 
     def __init_target_dir(self):
         os.umask(0)
@@ -95,9 +165,27 @@ class Files(Generic[GenericFile]):
 
         return extension in self.__extensions
 
+    def sort(self, order: FileOrder, work_lambda: Callable[[GenericFile], float]):
+        if order == FileOrder.LARGEST_FIRST:
+            self.__files.sort(key=work_lambda, reverse=True)
+
+    def failed_files(self) -> list[GenericFile]:
+        return [file for file in self if file.failed]
+
+    def suspect_files(self) -> list[GenericFile]:
+        return [file for file in self if file.suspect_reason is not None]
+
     def calculate_final_size(self):
         for file in self:
-            self.final_size += file.target.stat().st_size
+            output_bytes = file.output_bytes
+
+            if file.failed or output_bytes is None:
+                # Failed files (and files skipped without a target, e.g. pictures too large to be optimized) have no
+                # complete target, so their source size is not part of the totals either
+                self.initial_size -= file.source_bytes
+                continue
+
+            self.final_size += output_bytes
 
 
 class MediaInfoService:
@@ -105,15 +193,55 @@ class MediaInfoService:
         self.__cache: dict[Path, MediaInfo | None] = {}
 
     def get(self, path: Path) -> MediaInfo | None:
-        if path not in self.__cache:
-            try:
-                info = MediaInfo.parse(path, mediainfo_options={"File_TestContinuousFileNames": "0"})
-            except RuntimeError:
-                info = None
+        # Imported here so that loading this module stays cheap for the entry point
+        from pymediainfo import MediaInfo  # pylint: disable=import-outside-toplevel
+
+        with _MEDIAINFO_LOCK:
+            if path not in self.__cache:
+                try:
+                    with METRICS.stage("probe"):
+                        info = MediaInfo.parse(path, mediainfo_options={"File_TestContinuousFileNames": "0"})
+                except RuntimeError:
+                    info = None
+
+                self.__cache[path] = info
+
+            return self.__cache[path]
+
+    def forget(self, path: Path):
+        """Drops the cached info of a file, so that long-running processes don't keep it in memory forever."""
+        with _MEDIAINFO_LOCK:
+            self.__cache.pop(path, None)
+
+
+def quarantine_failed_files(files: Files[GenericFile], quarantine_dir: Path) -> int:
+    """
+    Moves the sources of the files that could not be optimized to a quarantine directory, each with the reason why in a
+    text file next to it, so that they are not retried by later runs and can be looked into. Returns how many files
+    were moved.
+    """
+    failed_files = files.failed_files()
+    if len(failed_files) == 0:
+        return 0
+
+    quarantine_dir.mkdir(parents=True, exist_ok=True)
+    moved = 0
 
-            self.__cache[path] = info
+    for file in failed_files:
+        target = Path(quarantine_dir, file.source.name)
+        duplicates = 0
+        while target.exists():  # <- files with the same name from earlier runs are kept
+            duplicates += 1
+            target = Path(quarantine_dir, f"{file.source.stem} ({duplicates}){file.source.suffix}")
 
-        return self.__cache[path]
+        try:
+            shutil.move(file.source, target)
+            Path(f"{target}.error.txt").write_text(f"{file.error}\n", encoding="utf-8")
+            moved += 1
+        except OSError as err:
+            print(f'{CLEAR_LINE}[WARNING] "{file.source.name}" could not be moved to the quarantine directory: {err}')
+
+    return moved
 
 
 def get_file_size_as_str(size_bytes: int, number_format: str | None = None) -> str:
@@ -143,12 +271,35 @@ def print_size_reduction_info(files: Files[GenericFile]):
     initial = get_file_size_as_str(files.initial_size)
     final = get_file_size_as_str(files.final_size)
 
-    reduction_percent = round(
-        (1 - files.final_size / files.initial_size) * 100,
-        1,
-    )
+    reduction_percent = (
+        round((1 - files.final_size / files.initial_size) * 100, 1)
+        if files.initial_size > 0
+        else 0.0
+    )  # fmt: skip
 
     print(f"\n{CLEAR_LINE}\n{CLEAR_LINE}Finished!")
     print(f"{CLEAR_LINE}- Total initial size: {initial}")
     print(f"{CLEAR_LINE}- Total final size: {final}")
     print(f"\n{CLEAR_LINE}Size reduction: {reduction_percent}%\n")
+
+
+def print_failed_files_info(files: Files[GenericFile]):
+    failed_files = files.failed_files()
+    if len(failed_files) == 0:
+        return
+
+    print(f"{CLEAR_LINE}[WARNING] {len(failed_files)} file(s) could not be optimized:")
+    for file in failed_files:
+        print(f"{CLEAR_LINE}- {file.source.name}: {file.error}")
+    print()
+
+
+def print_suspect_files_info(files: Files[GenericFile]):
+    suspect_files = files.suspect_files()
+    if len(suspect_files) == 0:
+        return
+
+    print(f"{CLEAR_LINE}[WARNING] {len(suspect_files)} optimized file(s) failed verification and might be broken:")
+    for file in suspect_files:
+        print(f"{CLEAR_LINE}- {file.source.name}: {file.suspect_reason}")
+    print()
@@ -0,0 +1,54 @@
+"""
+Estimation of the quality a JPEG was saved at, from its quantization tables alone (which are read along with its
+header, without decoding it).
+
+Most encoders (libjpeg and everything based on it, including Pillow, and most cameras and editors) derive their
+tables by scaling the standard tables from the JPEG specification according to the quality, so the quality can be
+recovered from the ratio between the actual and the standard tables.
+"""
+
+from __future__ import annotations
+
+from PIL import Image
+
+# Standard tables from Annex K of the JPEG specification (ITU-T T.81). Only their sums are used, so the order of the
+# coefficients (zigzag or natural) doesn't matter.
+STANDARD_LUMINANCE_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+)  # fmt: skip
+STANDARD_CHROMINANCE_TABLE = (
+    17, 18, 24, 47, 99, 99, 99, 99,
+    18, 21, 26, 66, 99, 99, 99, 99,
+    24, 26, 56, 99, 99, 99, 99, 99,
+    47, 66, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+)  # fmt: skip
+
+
+def estimate_jpeg_quality(image: Image.Image) -> int | None:
+    """Estimates the quality (1-100, as in libjpeg) an opened JPEG was saved at, or returns None if not a JPEG."""
+    tables: dict[int, list[int]] | None = getattr(image, "quantization", None)
+    if image.format != "JPEG" or not tables or 0 not in tables:
+        return None
+
+    actual = sum(tables[0])
+    standard = sum(STANDARD_LUMINANCE_TABLE)
+    if 1 in tables:
+        actual += sum(tables[1])
+        standard += sum(STANDARD_CHROMINANCE_TABLE)
+
+    # libjpeg scales the standard tables by 5000 / quality below quality 50, and by 200 - 2 * quality above it
+    scale = actual * 100 / standard
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+
+    return min(max(round(quality), 1), 100)
@@ -0,0 +1,251 @@
+"""
+Bounded-memory decoding and downscaling of pictures too large to be decoded at once (e.g. gigapixel panoramas or
+scans), so that the memory used for each picture stays under a limit regardless of its dimensions.
+
+- JPEG pictures are decoded at a reduced resolution (1/2, 1/4 or 1/8, straight from the DCT coefficients) that is
+  still at least as large as the target size.
+- Uncompressed pictures (e.g. uncompressed TIFF, BMP, PPM) are decoded a band of rows at a time, and each band is
+  downscaled into the output as soon as it is decoded.
+
+Other pictures can't be decoded in parts, and raise LargeImageError instead of exhausting the available memory. That
+includes compressed TIFF (LZW, deflate, JPEG...), which Pillow hands to libtiff as a whole even when its strips are
+compressed independently, and PNG, whose data is a single compressed stream.
+
+Opening such pictures requires lifting Pillow's decompression bomb check, which is only done within
+allow_large_images(), as the check is process-wide.
+
+Splitting the data into bands relies on Pillow internals (tile descriptors and the decoded size), which is why the
+supported Pillow versions are pinned.
+"""
+
+# pylint: disable=protected-access  # <- Pillow's tile descriptors are only exposed through protected members
+
+from __future__ import annotations
+
+import math
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from PIL import ExifTags, Image, ImageFile
+
+# Rows per band when splitting uncompressed data, which has no strips of its own
+RAW_BAND_ROWS = 64
+# Lanczos samples 3 source pixels on each side of every output pixel, scaled by the downscaling factor
+LANCZOS_SUPPORT = 3
+# Share of the memory limit left for everything but decoded pixels (e.g. read buffers and the encoded output)
+MEMORY_HEADROOM = 0.1
+
+_PIXEL_LIMIT_LOCK = threading.Lock()
+# Threads currently inside allow_large_images(), the last of which restores Pillow's limit
+_large_opens = 0
+_pixel_limit: int | None = None
+
+
+class LargeImageError(Exception):
+    pass
+
+
+@contextmanager
+def allow_large_images() -> Iterator[None]:
+    """
+    Lifts Pillow's decompression bomb check (only done when opening a picture) within the context, for pictures whose
+    memory is bounded by a memory limit instead. The check is restored as soon as no thread is inside the context.
+    """
+    global _large_opens, _pixel_limit  # pylint: disable=global-statement
+
+    with _PIXEL_LIMIT_LOCK:
+        if _large_opens == 0:
+            _pixel_limit = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = None
+        _large_opens += 1
+
+    try:
+        yield
+    finally:
+        with _PIXEL_LIMIT_LOCK:
+            _large_opens -= 1
+            if _large_opens == 0:
+                Image.MAX_IMAGE_PIXELS = _pixel_limit
+
+
+def get_decoded_size(size: tuple[int, int], mode: str) -> int:
+    """Bytes taken by a decoded picture. Pillow stores multi-band pixels in 4 bytes, regardless of their bands."""
+    if mode in ("1", "L", "P"):
+        bytes_per_pixel = 1
+    elif mode.startswith("I;16"):
+        bytes_per_pixel = 2
+    else:
+        bytes_per_pixel = 4
+
+    return size[0] * size[1] * bytes_per_pixel
+
+
+def load_reduced(image: ImageFile.ImageFile, target_size: tuple[int, int], memory_limit: int) -> Image.Image:
+    """Decodes a JPEG at the smallest reduced resolution that is still at least as large as the target size."""
+    image.draft(image.mode, target_size)
+
+    if get_decoded_size(image.size, image.mode) + get_decoded_size(target_size, image.mode) > memory_limit:
+        raise LargeImageError("even at a reduced resolution, decoding it would exceed the memory limit")
+
+    image.load()
+
+    return image
+
+
+def resize_in_strips(
+    path: Path,
+    image: ImageFile.ImageFile,
+    target_size: tuple[int, int],
+    memory_limit: int,
+) -> Image.Image:
+    """Downscales a picture to the target size, decoding as many rows at a time as fit in the memory limit."""
+    width, height = image.size
+    target_width, target_height = target_size
+    bands = __get_bands(image)
+
+    output_bytes = get_decoded_size(target_size, image.mode)
+    # Resizing first scales each decoded row horizontally, into an intermediate row of the target width
+    row_bytes = get_decoded_size((width + target_width, 1), image.mode)
+    scale = height / target_height
+    margin = math.ceil(LANCZOS_SUPPORT * max(scale, 1.0)) + 1
+    tallest_band = max(band_end - band_start for band_start, band_end, _ in bands)
+
+    # Rows decoded at once are the source rows of a chunk of output rows, plus the filter margin on each side and
+    # the rest of the bands they fall in
+    pixels_limit = memory_limit * (1 - MEMORY_HEADROOM)
+    source_rows = int((pixels_limit - output_bytes) // row_bytes) - 2 * (margin + tallest_band)
+    chunk_rows = math.floor(source_rows / scale)
+    if chunk_rows < 1:
+        raise LargeImageError("the memory limit is too low to decode it in parts")
+
+    output = Image.new(image.mode, target_size)
+    output.info = dict(image.info)
+
+    for chunk_start in range(0, target_height, chunk_rows):
+        chunk_end = min(chunk_start + chunk_rows, target_height)
+        box_top, box_bottom = chunk_start * scale, chunk_end * scale
+
+        needed_start = max(math.floor(box_top) - margin, 0)
+        needed_end = min(math.ceil(box_bottom) + margin, height)
+        chunk_bands = [band for band in bands if band[0] < needed_end and band[1] > needed_start]
+
+        strip = __decode_bands(path, width, chunk_bands)
+        strip_top = chunk_bands[0][0]
+
+        if image.mode == "P" and chunk_start == 0:
+            output.putpalette(strip.getpalette() or [])
+
+        # Pixels around the box (within the decoded strip) are still used by the filter, so chunks blend seamlessly
+        output.paste(
+            strip.resize(
+                (target_width, chunk_end - chunk_start),
+                Image.Resampling.LANCZOS,
+                box=(0, box_top - strip_top, width, box_bottom - strip_top),
+            ),
+            (0, chunk_start),
+        )
+        # Released before the next strip is decoded, so that there is never more than one in memory
+        del strip
+
+    return output
+
+
+def __get_bands(image: ImageFile.ImageFile) -> list[tuple[int, int, list[ImageFile._Tile]]]:
+    """Splits the data of a picture into bands of rows that can be decoded independently, as (start, end, tiles)."""
+    width, height = image.size
+    tiles = image.tile
+
+    # Rotated or flipped pictures (e.g. TIFF with an orientation tag) are transposed after being decoded as a whole
+    orientation = getattr(image, "tag_v2", {}).get(ExifTags.Base.Orientation, 1)
+    if getattr(image, "_tile_size", image.size) != image.size or orientation != 1:
+        raise LargeImageError(f"rotated {image.format} pictures can't be decoded in parts")
+
+    if len(tiles) == 1 and tiles[0].codec_name == "raw":
+        tiles = __split_raw_tile(image, tiles[0])
+
+    bands: dict[tuple[int, int], list[ImageFile._Tile]] = {}
+    for tile in tiles:
+        if tile.extents is None:
+            raise LargeImageError(f"{image.format} pictures can't be decoded in parts")
+
+        _, top, _, bottom = tile.extents
+        bands.setdefault((top, bottom), []).append(tile)
+
+    result = [(top, bottom, band_tiles) for (top, bottom), band_tiles in sorted(bands.items())]
+
+    # Every row must belong to exactly one band, which isn't the case for formats stored as a single stream
+    expected_start = 0
+    for top, bottom, band_tiles in result:
+        band_width = sum(tile.extents[2] - tile.extents[0] for tile in band_tiles)  # type: ignore
+        if top != expected_start or band_width != width:
+            raise LargeImageError(f"{image.format} pictures can't be decoded in parts")
+
+        expected_start = bottom
+
+    if expected_start != height or len(result) < 2:
+        raise LargeImageError(f"{image.format} pictures can't be decoded in parts")
+
+    return result
+
+
+def __split_raw_tile(image: ImageFile.ImageFile, tile: ImageFile._Tile) -> list[ImageFile._Tile]:
+    args = tile.args if isinstance(tile.args, tuple) else (tile.args,)
+    rawmode = args[0]
+    stride = args[1] if len(args) > 1 else 0
+    orientation = args[2] if len(args) > 2 else 1
+    width, height = image.size
+
+    if tile.extents != (0, 0, width, height) or orientation not in (1, -1):
+        raise LargeImageError(f"{image.format} pictures can't be decoded in parts")
+
+    if stride <= 0:
+        try:
+            stride = len(Image.new(image.mode, (width, 1)).tobytes("raw", rawmode))
+        except ValueError as err:
+            raise LargeImageError(f"{image.format} pictures can't be decoded in parts") from err
+
+    tiles: list[ImageFile._Tile] = []
+    for top in range(0, height, RAW_BAND_ROWS):
+        bottom = min(top + RAW_BAND_ROWS, height)
+        # Bottom-up data (orientation -1) stores the last row of each band first
+        first_stored_row = top if orientation == 1 else height - bottom
+        tiles.append(
+            ImageFile._Tile(
+                "raw",
+                (0, top, width, bottom),
+                tile.offset + first_stored_row * stride,
+                (rawmode, stride, orientation),
+            )
+        )
+
+    return tiles
+
+
+def __decode_bands(path: Path, width: int, bands: list[tuple[int, int, list[ImageFile._Tile]]]) -> Image.Image:
+    """Decodes consecutive bands into a picture that only contains their rows."""
+    top, bottom = bands[0][0], bands[-1][1]
+
+    with allow_large_images():
+        strip = Image.open(path)
+    assert isinstance(strip, ImageFile.ImageFile)
+
+    # The picture is made to look like one that only has these rows, so that Pillow decodes just their tiles
+    strip._size = (width, bottom - top)
+    if hasattr(strip, "_tile_size"):
+        # TIFF allocates its decoded picture from the size of its tiles, which would otherwise be the full size
+        strip._tile_size = strip._size
+    strip.tile = [
+        ImageFile._Tile(
+            tile.codec_name,
+            (tile.extents[0], tile.extents[1] - top, tile.extents[2], tile.extents[3] - top),  # type: ignore
+            tile.offset,
+            tile.args,
+        )
+        for _, _, band_tiles in bands
+        for tile in band_tiles
+    ]
+    strip.load()
+
+    return strip
@@ -1,20 +1,51 @@
+import threading
 from abc import ABC, abstractmethod
 from functools import cached_property
 from pathlib import Path
-from typing import Generic
+from typing import Any, Generic, Mapping, TypeVar
 
+from src.components.config import build_options
+from src.components.estimator import EstimateSample
 from src.components.files import Files, GenericFile, MediaInfoService
+from src.components.metrics import METRICS
+from src.components.profiling import PROFILER
+from src.components.results import FileResult, FileStatus, ResourceClock, ResultsReport
+from src.components.verification import VerificationOptions, Verifier
 
+GenericOptions = TypeVar("GenericOptions", default=Any)
 
-class MediaOptimizer(ABC, Generic[GenericFile]):
+_VERIFIER_LOCK = threading.Lock()
+
+
+class MediaOptimizer(ABC, Generic[GenericFile, GenericOptions]):
     """
     Abstract class that describes the basic interface that an optimizer class must have.
     """
 
+    # Whether several files can be optimized at the same time, or each file already uses all available cores
+    parallelizable: bool = False
+
+    # Dataclass that holds the options of the optimizer. Instantiating it without arguments gives the defaults.
+    options_class: type[GenericOptions]
+
+    @property
+    def workers(self) -> int:
+        """How many files are optimized at the same time by run(), for parallelizable optimizers."""
+        return 1
+
     @cached_property
     def media_info_service(self) -> MediaInfoService:
         return MediaInfoService()
 
+    @property
+    def verifier(self) -> Verifier:
+        # Created on first use, which might happen from several workers at the same time
+        with _VERIFIER_LOCK:
+            if "_verifier" not in self.__dict__:
+                self.__dict__["_verifier"] = Verifier()
+
+            return self.__dict__["_verifier"]
+
     @abstractmethod
     def is_valid_file(self, path: Path) -> bool:
         raise NotImplementedError
@@ -24,5 +55,125 @@ class MediaOptimizer(ABC, Generic[GenericFile]):
         raise NotImplementedError
 
     @abstractmethod
-    def run(self, files: Files[GenericFile]) -> None:
+    def ask_for_options(self, files: Files[GenericFile]) -> GenericOptions:
+        """
+        Prompts the user for the options of the optimization process. The provided files might be empty (e.g. when
+        watching a directory), in which case no assumptions should be made about which files will be optimized.
+        """
+        raise NotImplementedError
+
+    def options_from_dict(self, values: Mapping[str, Any]) -> GenericOptions:
+        """Builds the options from plain values (e.g. from a config file), without asking any questions."""
+        return build_options(self.options_class, values)
+
+    def estimate_work(self, file: GenericFile) -> float:
+        """
+        Relative amount of work needed to optimize a file, used to extrapolate processing times. Optimizers should
+        provide a better measure than the default one, the size of the file in megabytes.
+        """
+        return file.source.stat().st_size / 1_000_000
+
+    def get_lane(self, file: GenericFile) -> tuple[str, int]:  # pylint: disable=unused-argument
+        """
+        Lane a file is optimized in during a run, as its name and the number of files it optimizes at the same time.
+        Lanes run alongside each other, and are estimated separately (see src.components.estimator).
+        """
+        return "files", self.workers if self.parallelizable else 1
+
+    def sample_file(self, file: GenericFile, options: GenericOptions, target_dir: Path) -> EstimateSample:
+        """
+        Optimizes (a representative part of) a file into the provided directory, to estimate the results of the whole
+        batch. By default the whole file is optimized, which is only reasonable for quick optimizers.
+        """
+        original_target = file.target
+        file.target = Path(target_dir, file.source.name)
+
+        try:
+            result = self.process_file(file, options)
+            self.wait_for_verification()
+        finally:
+            file.target = original_target
+
+        return EstimateSample(
+            work=self.estimate_work(file),
+            source_bytes=result.source_bytes,
+            target_bytes=result.target_bytes,
+            seconds=result.wall_seconds,
+            error=result.reason if file.failed else None,
+        )
+
+    @abstractmethod
+    def optimize_file(self, file: GenericFile, options: GenericOptions) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def run(
+        self,
+        files: Files[GenericFile],
+        options: GenericOptions,
+        report: ResultsReport | None = None,
+        show_progress: bool = True,
+    ) -> list[FileResult]:
         raise NotImplementedError
+
+    def process_file(
+        self,
+        file: GenericFile,
+        options: GenericOptions,
+        report: ResultsReport | None = None,
+    ) -> FileResult:
+        """Optimizes a single file, measuring it, and streams its result to the report (if any)."""
+        file.reset()
+
+        # Profiled files wait for each other (see src.components.profiling), which must not count as their time
+        with PROFILER.profile(file.source.name):
+            clock = ResourceClock()
+
+            try:
+                self.optimize_file(file, options)
+            except Exception as err:  # pylint: disable=broad-exception-caught  # <- e.g. a corrupt file
+                # A single bad file must not abort the rest of the batch, it is reported as failed instead
+                file.error = str(err) or type(err).__name__
+                METRICS.increment("files_failed")
+
+            elapsed = clock.elapsed()
+
+        result = FileResult.from_file(file, options, *elapsed)
+
+        if result.status == FileStatus.OPTIMIZED and self.should_verify(file, options):
+            # Verified while the next file is being optimized, and only reported once verified
+            self.verifier.submit(file, result, lambda: self.verify_file(file, options), report)
+        elif report is not None:
+            report.write(result)
+
+        return result
+
+    def get_run_only_options(self, options: GenericOptions) -> list[str]:  # pylint: disable=unused-argument
+        """
+        Names of the enabled options that span a whole batch, and are therefore only supported by run(). Watch mode,
+        which processes files one at a time, rejects them instead of silently ignoring them.
+        """
+        return []
+
+    def should_verify(self, file: GenericFile, options: GenericOptions) -> bool:  # pylint: disable=unused-argument
+        verification = getattr(options, "verification", None)
+
+        return isinstance(verification, VerificationOptions) and verification.enabled
+
+    def verify_file(self, file: GenericFile, options: GenericOptions) -> str | None:  # pylint: disable=unused-argument
+        """
+        Checks the outputs of an optimized file (see src.components.verification), and returns why they look broken,
+        or None if they look fine. Optimizers that can't verify their outputs consider them fine.
+        """
+        return None
+
+    def wait_for_verification(self):
+        """Blocks until every optimized file has been verified. Must be called before using their results."""
+        self.verifier.wait()
+
+    def stop_verification(self):
+        """
+        Stops verifying the files that are still waiting for it (e.g. after an error or an interruption), once the file
+        being verified is done. Must be called before closing the report that verified files are written to.
+        """
+        self.verifier.cancel()
@@ -0,0 +1,201 @@
+"""
+Low-overhead instrumentation of the optimization hot paths.
+
+Stages are timed through `METRICS.stage(name)`, which returns a shared no-op context manager while metrics are
+disabled (the default), so instrumented code costs a single attribute check when nobody is collecting metrics.
+Stages can also be recorded into a per-file timings dict, which is always filled in, as it is cheap compared to the
+work being timed and it feeds the per-file results.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import AbstractContextManager, nullcontext
+from datetime import datetime
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+METRICS_JSON_FILE_NAME = "metrics.json"
+METRICS_PROMETHEUS_FILE_NAME = "metrics.prom"
+PROMETHEUS_PREFIX = "media_optimizer"
+
+# Upper bounds, in seconds, of the stage duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+NULL_STAGE: AbstractContextManager[None] = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # <- the last one is the +Inf bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> list[tuple[str, int]]:
+        bounds = [*map(str, self.buckets), "+Inf"]
+        total = 0
+        result: list[tuple[str, int]] = []
+
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            result.append((bound, total))
+
+        return result
+
+
+class StageTimer:
+    def __init__(self, metrics: Metrics, name: str, timings: dict[str, float] | None = None):
+        self.__metrics = metrics
+        self.__name = name
+        self.__timings = timings
+        self.__start = 0.0
+
+    def __enter__(self):
+        self.__start = time.perf_counter()
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ):
+        elapsed = time.perf_counter() - self.__start
+
+        if self.__timings is not None:
+            self.__timings[self.__name] = self.__timings.get(self.__name, 0.0) + elapsed
+
+        self.__metrics.observe(self.__name, elapsed)
+
+
+class Metrics:
+    """Registry of counters and stage duration histograms."""
+
+    def __init__(self):
+        self.enabled = False
+        self.counters: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.__lock = threading.Lock()
+        self.__exporter: threading.Thread | None = None
+        self.__stop_exporter = threading.Event()
+
+    def enable(self):
+        self.enabled = True
+
+    def stage(self, name: str, timings: dict[str, float] | None = None) -> AbstractContextManager[None]:
+        if not self.enabled and timings is None:
+            return NULL_STAGE
+
+        return StageTimer(self, name, timings)
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+
+        with self.__lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+
+            histogram.observe(seconds)
+
+    def increment(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_json(self) -> dict[str, Any]:
+        with self.__lock:
+            return {
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+                "counters": dict(self.counters),
+                "stages": {
+                    name: {
+                        "count": histogram.count,
+                        "sum_seconds": round(histogram.sum, 6),
+                        "mean_seconds": round(histogram.sum / histogram.count, 6) if histogram.count > 0 else 0.0,
+                        "buckets": dict(histogram.cumulative_counts()),
+                    }
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format, as expected by textfile collectors."""
+        lines: list[str] = []
+
+        with self.__lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f"{PROMETHEUS_PREFIX}_{self.__sanitize(name)}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+
+            if len(self.histograms) > 0:
+                metric = f"{PROMETHEUS_PREFIX}_stage_duration_seconds"
+                lines.append(f"# HELP {metric} Time spent in each optimization stage.")
+                lines.append(f"# TYPE {metric} histogram")
+
+            for name, histogram in sorted(self.histograms.items()):
+                for bound, count in histogram.cumulative_counts():
+                    lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'{metric}_sum{{stage="{name}"}} {histogram.sum}')
+                lines.append(f'{metric}_count{{stage="{name}"}} {histogram.count}')
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, directory: Path):
+        """Writes the metrics as JSON and as a Prometheus textfile. Files are replaced atomically."""
+        if not self.enabled:
+            return
+
+        directory.mkdir(parents=True, exist_ok=True)
+
+        self.__write_atomically(directory.joinpath(METRICS_JSON_FILE_NAME), json.dumps(self.to_json(), indent=2))
+        self.__write_atomically(directory.joinpath(METRICS_PROMETHEUS_FILE_NAME), self.to_prometheus())
+
+    def start_periodic_export(self, directory: Path, interval: float):
+        """Exports the metrics every `interval` seconds from a background thread, until stop_periodic_export()."""
+        if not self.enabled or self.__exporter is not None:
+            return
+
+        def export_periodically():
+            while not self.__stop_exporter.wait(interval):
+                self.export(directory)
+
+        self.__stop_exporter.clear()
+        self.__exporter = threading.Thread(target=export_periodically, name="metrics-exporter", daemon=True)
+        self.__exporter.start()
+
+    def stop_periodic_export(self):
+        if self.__exporter is None:
+            return
+
+        self.__stop_exporter.set()
+        self.__exporter.join()
+        self.__exporter = None
+
+    @staticmethod
+    def __sanitize(name: str) -> str:
+        return "".join(char if char.isalnum() else "_" for char in name)
+
+    @staticmethod
+    def __write_atomically(path: Path, content: str):
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(content, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+# Process-wide registry used by all the instrumented code
+METRICS = Metrics()
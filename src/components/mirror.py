@@ -0,0 +1,161 @@
+"""
+Mirroring of the files that are not optimized (files that aren't media, and media skipped without an output) into the
+target directory, so that it ends up with every file of the source directory without a separate sync.
+
+Files are mirrored without copying their data through the process whenever the system allows it, from the cheapest
+method to the most expensive one:
+
+- Hard links, only when asked for, as the target then shares its data with the source: editing one edits the other.
+- Reflinks (copy-on-write clones, e.g. on Btrfs and XFS), which are instant and share the data until either changes.
+- Kernel-side copies (copy_file_range() on Linux), which never go through user space.
+- A plain copy, as a last resort.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+from collections import Counter
+from enum import Enum
+from pathlib import Path
+from typing import IO, TYPE_CHECKING
+
+from src.components.metrics import METRICS
+from src.components.resources import RESOURCES
+from src.components.stdout import CLEAR_LINE
+
+if TYPE_CHECKING:
+    from src.components.files import File, Files
+
+# Bytes read at once by plain copies
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class MirrorMode(str, Enum):
+    # Reflinks or copies, so that the target never shares its data with the source
+    COPY = "copy"
+    # Hard links whenever the target is on the same file system as the source, copies otherwise
+    LINK = "link"
+
+
+class MirrorMethod(str, Enum):
+    HARDLINK = "hard linked"
+    REFLINK = "reflinked"
+    KERNEL_COPY = "copied by the kernel"
+    COPY = "copied"
+    # The target was already up to date, like rsync's quick check: same size and modification time
+    UNCHANGED = "already up to date"
+
+
+def mirror_file(source: Path, target: Path, mode: MirrorMode = MirrorMode.COPY) -> MirrorMethod:
+    """Mirrors a file to the provided target with the cheapest method available, keeping its metadata."""
+    source_stat = source.stat()
+
+    try:
+        target_stat = target.stat()
+        if target_stat.st_size == source_stat.st_size and target_stat.st_mtime_ns == source_stat.st_mtime_ns:
+            return MirrorMethod.UNCHANGED
+    except FileNotFoundError:
+        pass
+
+    # A hard link or a read-only file at the target must be replaced, not written through
+    target.unlink(missing_ok=True)
+
+    if mode == MirrorMode.LINK:
+        try:
+            os.link(source, target)
+
+            return MirrorMethod.HARDLINK
+        except OSError:
+            pass  # <- e.g. across file systems, or on a file system without hard links
+
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        if __reflink(source_file, target_file):
+            method = MirrorMethod.REFLINK
+        else:
+            RESOURCES.wait_for_io(2 * source_stat.st_size)  # <- read and written
+
+            if __kernel_copy(source_file, target_file, source_stat.st_size):
+                method = MirrorMethod.KERNEL_COPY
+            else:
+                shutil.copyfileobj(source_file, target_file, COPY_BUFFER_SIZE)
+                method = MirrorMethod.COPY
+
+    shutil.copystat(source, target)
+
+    return method
+
+
+def mirror_files(files: Files[File], mode: MirrorMode) -> Counter[MirrorMethod]:
+    """
+    Mirrors the files of the source directory that were not optimized into the target directory, under their source
+    name (and into every rendition directory, for media skipped without an output), and counts the methods used.
+    """
+    mirrors = [(source, Path(files.target_dir, source.name)) for source in files.unmatched]
+
+    for file in files:
+        if file.skipped and file.output_bytes is None:
+            targets = dict.fromkeys(Path(output.parent, file.source.name) for output in file.outputs)
+            mirrors.extend((file.source, target) for target in targets)
+
+    methods: Counter[MirrorMethod] = Counter()
+
+    with METRICS.stage("mirror"):
+        for source, target in mirrors:
+            try:
+                method = mirror_file(source, target, mode)
+            except OSError as err:
+                print(f'{CLEAR_LINE}[WARNING] "{source.name}" could not be mirrored to the target directory: {err}')
+                continue
+
+            methods[method] += 1
+            METRICS.increment(f"mirrored_{method.name.lower()}")
+
+    return methods
+
+
+def print_mirror_info(methods: Counter[MirrorMethod]):
+    if methods.total() == 0:
+        return
+
+    details = ", ".join(f"{count} {method.value}" for method, count in methods.items())
+    print(f"{CLEAR_LINE}{methods.total()} file(s) that were not optimized have been mirrored ({details})\n")
+
+
+def __reflink(source_file: IO[bytes], target_file: IO[bytes]) -> bool:
+    if sys.platform != "linux":
+        return False
+
+    import fcntl  # pylint: disable=import-outside-toplevel
+
+    try:
+        fcntl.ioctl(target_file.fileno(), fcntl.FICLONE, source_file.fileno())
+    except OSError:
+        return False  # <- e.g. across file systems, or on a file system without copy-on-write
+
+    return True
+
+
+def __kernel_copy(source_file: IO[bytes], target_file: IO[bytes], size: int) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+
+    copied = 0
+
+    try:
+        while copied < size:
+            chunk = os.copy_file_range(source_file.fileno(), target_file.fileno(), size - copied)
+            if chunk == 0:
+                break
+
+            copied += chunk
+    except OSError:
+        # Not supported between these file systems, so whatever was copied is started over with a plain copy
+        source_file.seek(0)
+        target_file.seek(0)
+        target_file.truncate()
+
+        return False
+
+    return True
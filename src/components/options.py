@@ -3,13 +3,17 @@ from __future__ import annotations
 import os
 from enum import Enum
 from pathlib import Path
-from typing import Any, Callable, Self, Sequence
-
-import questionary
-from questionary import Choice
+from typing import TYPE_CHECKING, Any, Callable, Self, Sequence
 
 from src.components.app import is_running_in_app_path
-from src.components.files import Files, GenericFile
+
+if TYPE_CHECKING:
+    from questionary import Choice
+
+    from src.components.files import Files, GenericFile
+
+# questionary (and prompt_toolkit with it) is imported lazily in this module, as it is one of the slowest imports
+# and the entry point needs this module before deciding whether any prompt will be shown at all (e.g. --version).
 
 
 class MenuOption(Enum):
@@ -36,6 +40,9 @@ class MenuOption(Enum):
         filter_lambda_or_options: Callable[[Self], bool] | Sequence[Self | Choice] | None = None,
         default: Self | None = None,
     ) -> Self:
+        import questionary  # pylint: disable=import-outside-toplevel
+        from questionary import Choice  # pylint: disable=import-outside-toplevel
+
         choices: list[Choice] = []
 
         # Load choices
@@ -60,12 +67,16 @@ class MenuOption(Enum):
 
     @classmethod
     def is_valid_option(cls, option: Any):
+        from questionary import Choice  # pylint: disable=import-outside-toplevel
+
         if isinstance(option, Choice):
             option = option.value
 
         return isinstance(option, cls)
 
     def as_choice(self) -> Choice:
+        from questionary import Choice  # pylint: disable=import-outside-toplevel
+
         return Choice(self.name, self)
 
 
@@ -142,6 +153,8 @@ class Resolution(int, MenuOption):
 
 
 def ask_for_source_dir(file_type: str) -> str:
+    import questionary  # pylint: disable=import-outside-toplevel
+
     default = os.path.join(Path.home(), "") if is_running_in_app_path() else os.path.join(os.getcwd(), "")
 
     return questionary.path(
@@ -159,6 +172,8 @@ def ask_for_short_side_limit(resolution_options: Sequence[Resolution | Choice] |
 
 
 def ask_for_overwrite_permission(files: Files[GenericFile]) -> bool:
+    import questionary  # pylint: disable=import-outside-toplevel
+
     return questionary.confirm(
         f"Overwrite existing files in target directory {files.target_dir}?",
     ).unsafe_ask()
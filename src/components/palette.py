@@ -0,0 +1,227 @@
+"""
+Lossy PNG compression by reducing pictures to a palette of up to 256 colors, which makes screenshots and graphics
+several times smaller than truecolor PNG with little visible difference.
+
+The palette is found with k-means clustering of the colors of the picture, vectorized with NumPy (an optional
+dependency, only imported when a palette is needed). Colors are clustered premultiplied by their alpha, so that
+transparent pixels don't spend palette entries on colors that can't be seen, and every fully transparent pixel ends up
+in the same entry. Pictures that already have few enough colors are converted losslessly.
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, Any
+
+from PIL import Image
+
+if TYPE_CHECKING:
+    import numpy as np
+    from numpy.typing import NDArray
+
+# Pixels (picked at random) that the palette is trained on, which is plenty to find 256 clusters in any picture
+TRAINING_PIXELS = 65536
+KMEANS_ITERATIONS = 8
+# Colors mapped to the palette at once, which bounds the memory taken by their distances to every palette entry
+MAPPING_CHUNK = 16384
+# Bytes of NumPy arrays held per pixel while quantizing a picture, in the worst case (with dithering)
+BYTES_PER_PIXEL = 48
+# Thresholds of ordered dithering, which (unlike error diffusion) can be applied to every pixel at once
+BAYER_MATRIX = (
+    (0, 8, 2, 10),
+    (12, 4, 14, 6),
+    (3, 11, 1, 9),
+    (15, 7, 13, 5),
+)
+
+
+@dataclass
+class PaletteOptions:
+    # Whether PNG outputs are reduced to a palette, which is lossy and requires NumPy
+    enabled: bool = False
+    colors: int = 256
+    # Ordered dithering, which hides banding in gradients at the cost of bigger files
+    dither: bool = False
+    # Minimum PSNR (in dB) against the truecolor picture, below which the picture is kept as truecolor
+    min_psnr: float = 40.0
+
+    def __post_init__(self):
+        if not 2 <= self.colors <= 256:
+            raise ValueError(f"PNG palettes must have between 2 and 256 colors, got {self.colors}")
+
+        if self.enabled and find_spec("numpy") is None:
+            raise ValueError("PNG palettes require NumPy, which can be installed with: pip install numpy")
+
+
+def quantize(image: Image.Image, colors: int = 256, dither: bool = False) -> tuple[Image.Image, float]:
+    """
+    Reduces an RGB or RGBA picture to a palette of up to `colors` colors, and returns it along with its PSNR (in dB)
+    against the original, which is infinite if no color was lost.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    if "transparency" in image.info:
+        image = image.convert("RGBA")
+
+    has_alpha = image.mode == "RGBA" and image.getextrema()[3][0] < 255
+    mode = "RGBA" if has_alpha else "RGB"
+    width, height = image.size
+
+    pixels = np.asarray(image.convert(mode)).reshape(-1, len(mode))
+    if has_alpha:
+        # Fully transparent pixels look the same whatever their color, so they can all share a single entry
+        pixels = np.where(pixels[:, 3:] == 0, 0, pixels).astype(np.uint8)
+
+    # Pictures have far fewer distinct colors than pixels, so the colors are clustered and mapped instead
+    packed = np.zeros(len(pixels), np.uint32)
+    for channel in range(len(mode)):
+        packed |= pixels[:, channel].astype(np.uint32) << (8 * channel)
+
+    del pixels
+    unique, inverse, counts = np.unique(packed, return_inverse=True, return_counts=True)
+    del packed
+    colors_found = np.stack([(unique >> (8 * channel)) & 0xFF for channel in range(len(mode))], axis=1)
+
+    if len(unique) <= colors:
+        return __to_image(inverse, colors_found.astype(np.uint8), mode, image.size), math.inf
+
+    points = __premultiply(colors_found.astype(np.float32))
+    rng = np.random.default_rng(0)  # <- the same picture always gets the same palette
+
+    # Pixels are sampled uniformly, so common colors weigh more in the training set
+    sample, sample_counts = np.unique(inverse[rng.integers(0, len(inverse), TRAINING_PIXELS)], return_counts=True)
+    centers = __train(points[sample], sample_counts.astype(np.float32), colors, rng)
+
+    # Entries are rounded to 8 bits per channel before mapping, so pixels are mapped to the colors actually stored
+    palette = __unpremultiply(centers)
+    centers = __premultiply(palette.astype(np.float32))
+
+    if dither:
+        indices, squared_error = __map_dithered(points, inverse, centers, (width, height))
+    else:
+        labels = __nearest(points, centers)
+        indices = labels[inverse]
+        squared_error = float(np.dot(((points - centers[labels]) ** 2).sum(axis=1), counts))
+
+    mean_squared_error = squared_error / (len(inverse) * len(mode))
+    psnr = math.inf if mean_squared_error == 0 else 10 * math.log10(255**2 / mean_squared_error)
+
+    return __to_image(indices, palette, mode, image.size), psnr
+
+
+def __train(points: NDArray[Any], weights: NDArray[Any], colors: int, rng: np.random.Generator) -> NDArray[Any]:
+    """Weighted k-means, seeded with k-means++ so that rare but distinct colors (e.g. small icons) get an entry."""
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    centers = np.empty((colors, points.shape[1]), np.float32)
+    centers[0] = points[weights.argmax()]
+    distances = ((points - centers[0]) ** 2).sum(axis=1)
+
+    for idx in range(1, colors):
+        scores = np.cumsum(distances * weights)
+        if scores[-1] <= 0:
+            # Fewer distinct colors were sampled than there are entries
+            centers = centers[:idx]
+            break
+
+        centers[idx] = points[min(np.searchsorted(scores, rng.random() * scores[-1]), len(points) - 1)]
+        distances = np.minimum(distances, ((points - centers[idx]) ** 2).sum(axis=1))
+
+    for _ in range(KMEANS_ITERATIONS):
+        labels = __nearest(points, centers)
+        totals = np.bincount(labels, weights=weights, minlength=len(centers))
+        filled = totals > 0
+
+        for channel in range(points.shape[1]):
+            sums = np.bincount(labels, weights=weights * points[:, channel], minlength=len(centers))
+            centers[filled, channel] = sums[filled] / totals[filled]
+
+    return centers
+
+
+def __nearest(points: NDArray[Any], centers: NDArray[Any]) -> NDArray[Any]:
+    """Index of the nearest center of each point, computed a chunk of points at a time."""
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    labels = np.empty(len(points), np.intp)
+    center_norms = (centers**2).sum(axis=1)
+
+    for start in range(0, len(points), MAPPING_CHUNK):
+        chunk = points[start : start + MAPPING_CHUNK]
+        # |p - c|² = |p|² - 2p·c + |c|², where |p|² is the same for every center and doesn't change the nearest one
+        labels[start : start + MAPPING_CHUNK] = (center_norms - 2 * chunk @ centers.T).argmin(axis=1)
+
+    return labels
+
+
+def __map_dithered(
+    points: NDArray[Any],
+    inverse: NDArray[Any],
+    centers: NDArray[Any],
+    size: tuple[int, int],
+) -> tuple[NDArray[Any], float]:
+    """
+    Maps every pixel to the palette after offsetting it by its threshold in the Bayer matrix, scaled by the typical
+    distance between entries. Returns the indices and the squared error against the undithered colors.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    width, height = size
+    bayer = (np.array(BAYER_MATRIX, np.float32) + 0.5) / 16 - 0.5
+    positions = ((np.arange(height)[:, None] % 4) * 4 + np.arange(width)[None, :] % 4).ravel()
+
+    center_distances = ((centers[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+    np.fill_diagonal(center_distances, np.inf)
+    spread = float(np.median(np.sqrt(center_distances.min(axis=1))))
+
+    # Only distinct (color, threshold) pairs are mapped, which are still far fewer than pixels in most pictures
+    keys, key_inverse, key_counts = np.unique(inverse * 16 + positions, return_inverse=True, return_counts=True)
+    key_points = points[keys // 16]
+    offsets = bayer.ravel()[keys % 16] * spread
+
+    dithered = key_points.copy()
+    channels = 3 if points.shape[1] == 4 else points.shape[1]
+    # Offsets are premultiplied too, so that transparent pixels stay transparent
+    alpha = key_points[:, 3] / 255 if points.shape[1] == 4 else 1.0
+    dithered[:, :channels] += (offsets * alpha)[:, None]
+
+    labels = __nearest(dithered, centers)
+    squared_error = float(np.dot(((key_points - centers[labels]) ** 2).sum(axis=1), key_counts))
+
+    return labels[key_inverse], squared_error
+
+
+def __premultiply(colors: NDArray[Any]) -> NDArray[Any]:
+    if colors.shape[1] == 4:
+        colors = colors.copy()
+        colors[:, :3] *= colors[:, 3:] / 255
+
+    return colors
+
+
+def __unpremultiply(colors: NDArray[Any]) -> NDArray[Any]:
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    colors = np.clip(np.rint(colors), 0, 255)
+    if colors.shape[1] == 4:
+        alpha = colors[:, 3:]
+        colors[:, :3] = np.where(alpha > 0, np.clip(np.rint(colors[:, :3] * 255 / np.maximum(alpha, 1)), 0, 255), 0)
+
+    return colors.astype(np.uint8)
+
+
+def __to_image(indices: NDArray[Any], palette: NDArray[Any], mode: str, size: tuple[int, int]) -> Image.Image:
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    output = Image.frombytes("P", size, indices.astype(np.uint8).tobytes())
+    output.putpalette(palette.tobytes(), mode)
+
+    return output
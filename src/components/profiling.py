@@ -0,0 +1,182 @@
+"""
+Opt-in CPU and memory profiling of the work done on each file, to find out why some files are much slower or more
+memory-hungry than others without patching the code.
+
+The work on each file (and the scan of the source directory) is profiled through `PROFILER.profile(name)`, which
+returns a shared no-op context manager while profiling is disabled (the default), like METRICS.stage(). When enabled:
+
+- CPU time is profiled with cProfile, which sees every thread of the process. Files (and server jobs) are therefore
+  optimized one at a time, so that the profile of a file only contains its own work (and, at most, some of the
+  background verification), and profiled work is serialized for anything else that runs at the same time.
+- Memory is traced with tracemalloc, which records the peak of the memory allocated through Python (including NumPy
+  arrays, but not Pillow's image buffers) and the lines that allocated the most while the file was being optimized.
+
+Only the profiles of the slowest and most memory-hungry files are kept, along with a profile merged over the whole run
+and the profiles of the latest scans, numbered as they run (e.g. one per server job).
+"""
+
+from __future__ import annotations
+
+import heapq
+import io
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    import cProfile
+    import pstats
+    import tracemalloc
+
+DEFAULT_PROFILE_TOP = 5
+MERGED_PROFILE_NAME = "merged"
+# Frames kept for each traced allocation, which is enough to tell apart the lines that allocated
+TRACEMALLOC_FRAMES = 1
+# Lines of each text profile, for functions (sorted by cumulative time) and for allocation sites
+PROFILE_LINES = 40
+ALLOCATION_LINES = 15
+
+NULL_PROFILE: AbstractContextManager[None] = nullcontext()
+
+
+@dataclass
+class Profile:
+    name: str
+    wall_seconds: float
+    # Peak of the memory traced while profiling, above what was traced when it started
+    peak_bytes: int
+    cpu: cProfile.Profile
+    allocations: list[tracemalloc.StatisticDiff]
+
+    def write(self, path: Path):
+        """Writes the profile in the binary pstats format (for e.g. snakeviz), and as text next to it."""
+        # pylint: disable=import-outside-toplevel
+        import pstats
+
+        self.cpu.dump_stats(f"{path}.prof")
+
+        text = io.StringIO()
+        text.write(f"{self.name}\n- Wall time: {self.wall_seconds:.3f}s\n")
+        text.write(f"- Peak traced memory: {self.peak_bytes / 1024 / 1024:.1f} MiB\n\n")
+        pstats.Stats(self.cpu, stream=text).sort_stats("cumulative").print_stats(PROFILE_LINES)
+
+        text.write(f"Lines that allocated the most (top {ALLOCATION_LINES}):\n")
+        for allocation in self.allocations[:ALLOCATION_LINES]:
+            text.write(f"{allocation}\n")
+
+        Path(f"{path}.txt").write_text(text.getvalue(), encoding="utf-8")
+
+
+class Profiler:
+    """Profiles of the work done on each file, of which only the top ones are kept (see the module docstring)."""
+
+    def __init__(self):
+        self.enabled = False
+        self.directory: Path | None = None
+        self.top = DEFAULT_PROFILE_TOP
+        # Min-heaps of the slowest and most memory-hungry files, as (measure, order, profile)
+        self.__slowest: list[tuple[float, int, Profile]] = []
+        self.__biggest: list[tuple[float, int, Profile]] = []
+        # Latest work that is not a file (e.g. the scan), as (number, profile)
+        self.__sections: deque[tuple[int, Profile]] = deque(maxlen=self.top)
+        self.__section_numbers = itertools.count(1)
+        self.__merged: pstats.Stats | None = None
+        self.__order = itertools.count()
+        self.__lock = threading.Lock()
+
+    def enable(self, directory: Path, top: int = DEFAULT_PROFILE_TOP):
+        # pylint: disable=import-outside-toplevel
+        import pstats
+        import tracemalloc
+
+        self.enabled = True
+        self.directory = directory
+        self.top = top
+        self.__sections = deque(maxlen=top)
+        self.__merged = pstats.Stats()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def profile(self, name: str, is_file: bool = True) -> AbstractContextManager[None]:
+        """Profiles the work done inside the context, which is a file unless `is_file` is False (e.g. the scan)."""
+        if not self.enabled:
+            return NULL_PROFILE
+
+        return self.__profile(name, is_file)
+
+    def dump(self):
+        """Writes the kept profiles to the profiles directory, ranked within their subdirectory."""
+        if not self.enabled or self.directory is None:
+            return
+
+        with self.__lock:
+            ranked = {"slowest": self.__slowest, "biggest": self.__biggest}
+
+            for kind, heap in ranked.items():
+                kind_dir = self.directory.joinpath(kind)
+                kind_dir.mkdir(parents=True, exist_ok=True)
+
+                for rank, (_, _, profile) in enumerate(sorted(heap, reverse=True), start=1):
+                    profile.write(kind_dir.joinpath(f"{rank:02d}_{profile.name}"))
+
+            for number, profile in self.__sections:
+                profile.write(self.directory.joinpath(f"{profile.name}_{number:04d}"))
+
+            if self.__merged is not None and len(self.__merged.stats) > 0:  # type: ignore
+                self.__merged.dump_stats(self.directory.joinpath(f"{MERGED_PROFILE_NAME}.prof"))
+
+                text = io.StringIO()
+                self.__merged.stream = text  # type: ignore
+                self.__merged.sort_stats("cumulative").print_stats(PROFILE_LINES)
+                self.directory.joinpath(f"{MERGED_PROFILE_NAME}.txt").write_text(text.getvalue(), encoding="utf-8")
+
+        print(f"Profiles have been written to {self.directory}\n")
+
+    @contextmanager
+    def __profile(self, name: str, is_file: bool) -> Iterator[None]:
+        # pylint: disable=import-outside-toplevel
+        import cProfile
+        import tracemalloc
+
+        # Only a single cProfile profiler can be active in the process at a time
+        with self.__lock:
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            before = tracemalloc.take_snapshot()
+            cpu = cProfile.Profile()
+            start = time.perf_counter()
+            cpu.enable()
+
+            try:
+                yield
+            finally:
+                cpu.disable()
+                wall_seconds = time.perf_counter() - start
+                peak_bytes = tracemalloc.get_traced_memory()[1] - start_bytes
+                allocations = tracemalloc.take_snapshot().compare_to(before, "lineno")
+
+                profile = Profile(name, wall_seconds, peak_bytes, cpu, allocations)
+                self.__record(profile, is_file)
+
+    def __record(self, profile: Profile, is_file: bool):
+        assert self.__merged is not None
+        self.__merged.add(profile.cpu)
+
+        if not is_file:
+            self.__sections.append((next(self.__section_numbers), profile))
+
+            return
+
+        order = next(self.__order)
+        for heap, measure in ((self.__slowest, profile.wall_seconds), (self.__biggest, profile.peak_bytes)):
+            heapq.heappush(heap, (measure, order, profile))
+            if len(heap) > self.top:
+                heapq.heappop(heap)
+
+
+# Process-wide profiler, enabled once by the entry point
+PROFILER = Profiler()
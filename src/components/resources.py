@@ -0,0 +1,188 @@
+"""
+Limits on the resources a run may take (CPU cores, CPU and I/O priority, and disk bandwidth), for hosts where the
+optimizer shares the machine with other services.
+
+Limits are applied to the process before anything else is started, so that every thread it starts and every child
+process (e.g. FFmpeg) inherits its CPU affinity, niceness and I/O priority. The number of cores is also used to size
+the pools and FFmpeg/x265 threads explicitly, which is the only way of capping them where affinity isn't available.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum
+
+# Niceness from which the process gets the lowest priority class on Windows, instead of just a lower one
+WINDOWS_IDLE_NICENESS = 15
+WINDOWS_BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+WINDOWS_IDLE_PRIORITY_CLASS = 0x40
+
+# ioprio_set() has no wrapper in the C library, so it is called through its syscall number
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314, "ppc64le": 273}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_BEST_EFFORT = 2
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_LOWEST_LEVEL = 7
+
+SIZE_SUFFIXES = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+class IoPriority(str, Enum):
+    NORMAL = "normal"
+    # Lowest priority of the regular (best-effort) class
+    LOW = "low"
+    # Only gets disk time when no other process needs it
+    IDLE = "idle"
+
+
+@dataclass
+class ResourceLimits:
+    # Max CPU cores used by the run, including FFmpeg (0 = every core)
+    max_cores: int = 0
+    # Niceness of the run and of everything it starts (0 = unchanged, 19 = lowest priority)
+    nice: int = 0
+    io_priority: IoPriority = IoPriority.NORMAL
+    # Max bytes read and written per second by the run, including FFmpeg (0 = unlimited)
+    io_bytes_per_second: int = 0
+
+    def __post_init__(self):
+        if self.max_cores < 0 or self.io_bytes_per_second < 0:
+            raise ValueError("Resource limits can't be negative")
+
+        if not 0 <= self.nice <= 19:
+            raise ValueError(f"Niceness must be between 0 and 19, got {self.nice}")
+
+
+class Throttle:
+    """
+    Token bucket shared by every thread of the run, which allows bursts of up to a second worth of bytes. Transfers
+    are reserved in the order they are requested, so the bucket can go into debt and later ones wait longer.
+    """
+
+    def __init__(self, bytes_per_second: int):
+        self.bytes_per_second = bytes_per_second
+        self.__allowance = float(bytes_per_second)
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def reserve(self, size: int) -> float:
+        """Reserves a transfer, and returns how many seconds to wait before (or after) making it."""
+        with self.__lock:
+            now = time.monotonic()
+            self.__allowance = min(
+                self.__allowance + (now - self.__updated_at) * self.bytes_per_second,
+                float(self.bytes_per_second),
+            )
+            self.__updated_at = now
+            self.__allowance -= size
+
+            return max(-self.__allowance / self.bytes_per_second, 0.0)
+
+    def wait(self, size: int):
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Resources:
+    """Limits of the current run, which every optimizer follows (see ResourceLimits)."""
+
+    def __init__(self):
+        self.limits = ResourceLimits()
+        self.throttle: Throttle | None = None
+
+    @property
+    def cores(self) -> int:
+        """Cores the run may use, which is every core available to the process unless capped."""
+        available = os.process_cpu_count() or 1
+
+        return min(available, self.limits.max_cores) if self.limits.max_cores > 0 else available
+
+    def apply(self, limits: ResourceLimits):
+        """
+        Applies limits to the current process. Must be called from the main thread before starting any other thread,
+        as some of them only apply to the calling thread and the threads and processes started after it.
+        """
+        self.limits = limits
+        self.throttle = Throttle(limits.io_bytes_per_second) if limits.io_bytes_per_second > 0 else None
+
+        if limits.max_cores > 0 and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, sorted(os.sched_getaffinity(0))[: limits.max_cores])
+
+        if limits.nice > 0:
+            self.__set_niceness(limits.nice)
+
+        if limits.io_priority != IoPriority.NORMAL:
+            self.__set_io_priority(limits.io_priority)
+
+        if self.throttle is not None and os.name == "nt":
+            print("[WARNING] The I/O limit can't be applied to FFmpeg on Windows, only to pictures")
+
+    def limit_threads(self, threads: int) -> int:
+        """Caps a number of threads (0 = as many as there are cores) to the cores of the run."""
+        if self.limits.max_cores <= 0:
+            return threads
+
+        return min(threads, self.cores) if threads > 0 else self.cores
+
+    def wait_for_io(self, size: int):
+        """Blocks until `size` bytes can be read or written without exceeding the I/O limit."""
+        if self.throttle is not None:
+            self.throttle.wait(size)
+
+    def __set_niceness(self, nice: int):
+        if sys.platform == "win32":
+            # pylint: disable=import-outside-toplevel
+            import ctypes
+
+            kernel32 = ctypes.windll.kernel32
+            priority_class = (
+                WINDOWS_IDLE_PRIORITY_CLASS if nice >= WINDOWS_IDLE_NICENESS else WINDOWS_BELOW_NORMAL_PRIORITY_CLASS
+            )
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), priority_class)
+
+            return
+
+        try:
+            # Niceness can only be raised without privileges, so a higher current niceness is kept
+            os.setpriority(os.PRIO_PROCESS, 0, max(os.getpriority(os.PRIO_PROCESS, 0), nice))
+        except OSError as err:
+            print(f"[WARNING] Could not change the niceness of the process: {err}")
+
+    def __set_io_priority(self, priority: IoPriority):
+        # pylint: disable=import-outside-toplevel
+        import ctypes
+        import platform
+
+        syscall_number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+        if sys.platform != "linux" or syscall_number is None:
+            print("[WARNING] I/O priority can only be changed on Linux, it will be left unchanged")
+
+            return
+
+        value = (
+            IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+            if priority == IoPriority.IDLE
+            else IOPRIO_CLASS_BEST_EFFORT << IOPRIO_CLASS_SHIFT | IOPRIO_LOWEST_LEVEL
+        )
+        libc = ctypes.CDLL(None, use_errno=True)
+
+        if libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, 0, value) != 0:
+            print(f"[WARNING] Could not change the I/O priority of the process: {os.strerror(ctypes.get_errno())}")
+
+
+def parse_size(value: str) -> int:
+    """Parses a number of bytes, optionally followed by a K, M or G suffix (e.g. "20M")."""
+    multiplier = SIZE_SUFFIXES.get(value[-1:].upper())
+    number = value[:-1] if multiplier is not None else value
+
+    return round(float(number) * (multiplier or 1))
+
+
+# Process-wide limits, applied once by the entry point
+RESOURCES = Resources()
@@ -0,0 +1,222 @@
+"""
+Per-file results of an optimization run, and a report that streams them to disk as files complete.
+"""
+
+from __future__ import annotations
+
+import csv
+import dataclasses
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import IO, Any
+
+from src.components.files import File
+
+REPORT_FILE_NAME = "optimization_report"
+
+# CPU time of the child processes that each thread has waited for (see record_child_cpu_time())
+_CHILD_CPU = threading.local()
+
+
+class FileStatus(str, Enum):
+    OPTIMIZED = "optimized"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+
+
+class ReportFormat(str, Enum):
+    JSONL = "jsonl"
+    CSV = "csv"
+
+
+@dataclass
+class FileResult:
+    source: Path
+    # With renditions, the target is the first rendition, and target bytes are the total of every rendition
+    target: Path
+    status: FileStatus
+    source_bytes: int
+    target_bytes: int | None
+    wall_seconds: float
+    cpu_seconds: float
+    stage_seconds: dict[str, float] = field(default_factory=dict)
+    options: dict[str, Any] = field(default_factory=dict)
+    reason: str | None = None
+    # Set once the outputs have been verified (see src.components.verification), along with why they look broken
+    verified: bool = False
+    suspect_reason: str | None = None
+
+    @classmethod
+    def from_file(cls, file: File, options: Any, wall_seconds: float, cpu_seconds: float) -> FileResult:
+        if file.failed:
+            status = FileStatus.FAILED
+        elif file.skipped:
+            status = FileStatus.SKIPPED
+        else:
+            status = FileStatus.OPTIMIZED
+
+        return cls(
+            source=file.source,
+            target=file.outputs[0],
+            status=status,
+            source_bytes=file.source_bytes,
+            target_bytes=file.output_bytes,
+            wall_seconds=wall_seconds,
+            cpu_seconds=cpu_seconds,
+            stage_seconds=dict(file.timings),
+            options=dataclasses.asdict(options) if dataclasses.is_dataclass(options) else {},  # type: ignore
+            reason=file.error if file.failed else file.skip_reason,
+        )
+
+    @property
+    def ratio(self) -> float | None:
+        """Target size as a fraction of the source size (e.g. 0.25 = 75% smaller). Above 1 means it grew."""
+        if self.target_bytes is None or self.source_bytes == 0:
+            return None
+
+        return self.target_bytes / self.source_bytes
+
+    @property
+    def saved_bytes(self) -> int | None:
+        """Bytes saved by the optimization, which is negative if the target is bigger than the source."""
+        if self.target_bytes is None:
+            return None
+
+        return self.source_bytes - self.target_bytes
+
+    @property
+    def decode_seconds(self) -> float | None:
+        return self.__stage_seconds("decode")
+
+    @property
+    def encode_seconds(self) -> float | None:
+        return self.__stage_seconds("encode")
+
+    def to_row(self) -> dict[str, Any]:
+        ratio = self.ratio
+
+        return {
+            "source": str(self.source),
+            "target": str(self.target),
+            "status": self.status.value,
+            "source_bytes": self.source_bytes,
+            "target_bytes": self.target_bytes,
+            "ratio": round(ratio, 4) if ratio is not None else None,
+            "saved_bytes": self.saved_bytes,
+            "wall_seconds": round(self.wall_seconds, 4),
+            "cpu_seconds": round(self.cpu_seconds, 4),
+            "decode_seconds": self.__rounded(self.decode_seconds),
+            "encode_seconds": self.__rounded(self.encode_seconds),
+            "stage_seconds": {name: round(seconds, 4) for name, seconds in self.stage_seconds.items()},
+            "options": self.options,
+            "reason": self.reason,
+            "verified": self.verified,
+            "suspect_reason": self.suspect_reason,
+        }
+
+    def __stage_seconds(self, stage: str) -> float | None:
+        matches = [seconds for name, seconds in self.stage_seconds.items() if name.rsplit(".", 1)[-1] == stage]
+
+        return sum(matches) if len(matches) > 0 else None
+
+    @staticmethod
+    def __rounded(value: float | None) -> float | None:
+        return round(value, 4) if value is not None else None
+
+
+def record_child_cpu_time(seconds: float):
+    """Attributes the CPU time used by a child process (e.g. FFmpeg) to the work of the calling thread."""
+    _CHILD_CPU.seconds = getattr(_CHILD_CPU, "seconds", 0.0) + seconds
+
+
+class ResourceClock:
+    """
+    Measures wall and CPU time of the work done by the calling thread, including the child processes it waits for
+    (e.g. FFmpeg), whose CPU time is collected per process (see record_child_cpu_time()). Child CPU time is not
+    available on Windows.
+    """
+
+    def __init__(self):
+        self.__wall = time.perf_counter()
+        self.__cpu = self.__cpu_time()
+
+    def elapsed(self) -> tuple[float, float]:
+        return time.perf_counter() - self.__wall, self.__cpu_time() - self.__cpu
+
+    @staticmethod
+    def __cpu_time() -> float:
+        # Unlike getrusage(RUSAGE_CHILDREN), this doesn't include the children of other threads running in parallel
+        return time.thread_time() + getattr(_CHILD_CPU, "seconds", 0.0)
+
+
+class ResultsReport:
+    """
+    Writes per-file results to a JSONL or CSV file as soon as each of them is available, so that memory usage does
+    not grow with the size of the batch and partial results survive an interrupted run. Safe to use from several
+    threads.
+    """
+
+    CSV_FIELDS = (
+        "source",
+        "target",
+        "status",
+        "source_bytes",
+        "target_bytes",
+        "ratio",
+        "saved_bytes",
+        "wall_seconds",
+        "cpu_seconds",
+        "decode_seconds",
+        "encode_seconds",
+        "stage_seconds",
+        "options",
+        "reason",
+        "verified",
+        "suspect_reason",
+    )
+
+    def __init__(self, path: Path, report_format: ReportFormat = ReportFormat.JSONL):
+        self.path = path
+        self.format = report_format
+        self.__lock = threading.Lock()
+        self.__file: IO[str] = open(path, "w", encoding="utf-8", newline="")  # pylint: disable=consider-using-with
+        self.__csv_writer: csv.DictWriter[str] | None = None
+
+        if report_format == ReportFormat.CSV:
+            self.__csv_writer = csv.DictWriter(self.__file, fieldnames=self.CSV_FIELDS)
+            self.__csv_writer.writeheader()
+
+    @classmethod
+    def in_directory(cls, directory: Path, report_format: ReportFormat = ReportFormat.JSONL) -> ResultsReport:
+        return cls(directory.joinpath(f"{REPORT_FILE_NAME}.{report_format.value}"), report_format)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_: Any):
+        self.close()
+
+    def write(self, result: FileResult):
+        row = result.to_row()
+
+        with self.__lock:
+            if self.__file.closed:
+                return  # <- e.g. a file verified in the background after an interrupted run
+
+            if self.__csv_writer is not None:
+                row["stage_seconds"] = json.dumps(row["stage_seconds"])
+                row["options"] = json.dumps(row["options"])
+                self.__csv_writer.writerow(row)
+            else:
+                self.__file.write(json.dumps(row) + "\n")
+
+            self.__file.flush()
+
+    def close(self):
+        with self.__lock:
+            if not self.__file.closed:
+                self.__file.close()
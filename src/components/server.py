@@ -0,0 +1,405 @@
+"""
+Long-running server mode that accepts optimization jobs through a local HTTP API, and runs them on a pool of warm
+workers, so that each job doesn't pay for interpreter startup, imports and a cold MediaInfo cache.
+
+    POST   /jobs       {"optimizer": "pictures", "source": "/data/in", "target": "/data/out", "options": {...},
+                        "priority": 10, "report": "jsonl", "order": "largest"}
+                       -> 202, the job (only "optimizer" and "source" are required)
+    GET    /jobs       -> every known job, without per-file results
+    GET    /jobs/<id>  -> the job, with per-file results
+    DELETE /jobs/<id>  -> cancels a job that hasn't started yet
+    GET    /health     -> worker and queue status
+
+Jobs with a higher priority run first, and jobs with the same priority run in submission order.
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import queue
+import signal
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+from src.components.config import ConfigError
+from src.components.files import FileOrder, Files, FilesError
+from src.components.media_optimizer import MediaOptimizer
+from src.components.profiling import PROFILER
+from src.components.results import FileResult, FileStatus, ReportFormat, ResultsReport
+from src.optimizers import OPTIMIZERS, load_optimizer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Finished jobs are kept (with their results) so that clients can poll them, but only the most recent ones
+MAX_FINISHED_JOBS = 1000
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class JobError(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    optimizer: str
+    source_dir: Path
+    target_dir: Path | None
+    options: Any
+    priority: int = 0
+    report_format: ReportFormat | None = None
+    order: FileOrder = FileOrder.LARGEST_FIRST
+    status: JobStatus = JobStatus.QUEUED
+    total_files: int | None = None
+    results: list[FileResult] = field(default_factory=list)
+    error: str | None = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED)
+
+    def to_json(self, include_results: bool = True) -> dict[str, Any]:
+        statuses = [result.status for result in self.results]
+        data: dict[str, Any] = {
+            "id": self.id,
+            "optimizer": self.optimizer,
+            "source": str(self.source_dir),
+            "target": str(self.target_dir) if self.target_dir is not None else None,
+            "priority": self.priority,
+            "status": self.status.value,
+            "error": self.error,
+            "total_files": self.total_files,
+            "processed_files": len(self.results),
+            "optimized_files": statuses.count(FileStatus.OPTIMIZED),
+            "skipped_files": statuses.count(FileStatus.SKIPPED),
+            "failed_files": statuses.count(FileStatus.FAILED),
+            "source_bytes": sum(result.source_bytes for result in self.results),
+            "target_bytes": sum(result.target_bytes or 0 for result in self.results),
+            "submitted_at": self.__isoformat(self.submitted_at),
+            "started_at": self.__isoformat(self.started_at),
+            "finished_at": self.__isoformat(self.finished_at),
+        }
+
+        if include_results:
+            data["results"] = [result.to_row() for result in self.results]
+
+        return data
+
+    @staticmethod
+    def __isoformat(timestamp: float | None) -> str | None:
+        return datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds") if timestamp is not None else None
+
+
+class JobQueue:
+    """
+    Priority queue of jobs, consumed by a fixed pool of worker threads that keep their optimizers warm. Each worker has
+    its own optimizers, as a run holds state (e.g. its archive, its deadline and its pending verifications).
+    """
+
+    def __init__(self, workers: int = 1):
+        # Profiled jobs are run one at a time (see PROFILER)
+        self.workers = 1 if PROFILER.enabled else max(workers, 1)
+        # Only used to validate the jobs, which are run by the optimizers of their worker
+        self.optimizers: dict[str, MediaOptimizer[Any]] = {name: load_optimizer(name) for name in OPTIMIZERS}
+
+        self.__jobs: OrderedDict[str, Job] = OrderedDict()
+        self.__queue: queue.PriorityQueue[tuple[int, int, str]] = queue.PriorityQueue()
+        self.__sequence = itertools.count()
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__threads: list[threading.Thread] = []
+        self.__busy_workers = 0
+
+    def start(self):
+        self.__threads = [
+            threading.Thread(target=self.__work, name=f"job-worker-{idx}", daemon=True) for idx in range(self.workers)
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self):
+        """Stops taking jobs from the queue, and waits for the running ones to finish."""
+        self.__stop.set()
+
+        for thread in self.__threads:
+            thread.join()
+
+    def submit(self, request: dict[str, Any]) -> Job:
+        optimizer_name = request.get("optimizer")
+        if optimizer_name not in self.optimizers:
+            raise JobError(f"'optimizer' must be one of: {', '.join(self.optimizers)}")
+
+        source = request.get("source")
+        if not isinstance(source, str) or not Path(source).is_dir():
+            raise JobError(f"'source' must be an existing directory, got {source!r}")
+
+        target = request.get("target")
+        if target is not None and not isinstance(target, str):
+            raise JobError(f"'target' must be a path, got {target!r}")
+
+        priority = request.get("priority", 0)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise JobError(f"'priority' must be an integer, got {priority!r}")
+
+        try:
+            report_format = ReportFormat(request["report"]) if request.get("report") is not None else None
+        except ValueError as err:
+            raise JobError(f"'report' must be one of: {', '.join(fmt.value for fmt in ReportFormat)}") from err
+
+        try:
+            order = FileOrder(request.get("order", FileOrder.LARGEST_FIRST))
+        except ValueError as err:
+            raise JobError(f"'order' must be one of: {', '.join(order.value for order in FileOrder)}") from err
+
+        try:
+            options = self.optimizers[optimizer_name].options_from_dict(request.get("options") or {})
+        except ConfigError as err:
+            raise JobError(str(err)) from err
+
+        job = Job(
+            id=uuid.uuid4().hex[:12],
+            optimizer=optimizer_name,
+            source_dir=Path(source).resolve(),
+            target_dir=Path(target).resolve() if target is not None else None,
+            options=options,
+            priority=priority,
+            report_format=report_format,
+            order=order,
+        )
+
+        with self.__lock:
+            self.__jobs[job.id] = job
+            self.__evict_finished_jobs()
+
+        # PriorityQueue pops the lowest entry first, so the priority is negated for higher ones to run first
+        self.__queue.put((-priority, next(self.__sequence), job.id))
+
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self.__lock:
+            return self.__jobs.get(job_id)
+
+    def all(self) -> list[Job]:
+        with self.__lock:
+            return list(self.__jobs.values())
+
+    def cancel(self, job_id: str) -> Job:
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            if job is None:
+                raise KeyError(job_id)
+            if job.status != JobStatus.QUEUED:
+                raise JobError(f"Job {job_id} is {job.status.value}, only queued jobs can be cancelled")
+
+            job.status = JobStatus.CANCELLED
+            job.finished_at = time.time()
+
+        return job
+
+    def status(self) -> dict[str, Any]:
+        with self.__lock:
+            statuses = [job.status for job in self.__jobs.values()]
+
+            return {
+                "workers": self.workers,
+                "busy_workers": self.__busy_workers,
+                **{status.value: statuses.count(status) for status in JobStatus},
+            }
+
+    def __work(self):
+        # Created on first use, and kept warm (imports, MediaInfo service) for the next jobs of this worker
+        optimizers: dict[str, MediaOptimizer[Any]] = {}
+
+        while not self.__stop.is_set():
+            try:
+                _, _, job_id = self.__queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            with self.__lock:
+                job = self.__jobs.get(job_id)
+                if job is None or job.status != JobStatus.QUEUED:
+                    continue  # <- cancelled while queued
+
+                job.status = JobStatus.RUNNING
+                job.started_at = time.time()
+                self.__busy_workers += 1
+
+            status, error = JobStatus.FAILED, None
+
+            try:
+                if job.optimizer not in optimizers:
+                    optimizers[job.optimizer] = load_optimizer(job.optimizer)
+
+                self.__run(job, optimizers[job.optimizer])
+            except Exception as err:  # pylint: disable=broad-exception-caught  # <- one bad job must not kill a worker
+                error = str(err) or type(err).__name__
+            else:
+                status = JobStatus.DONE
+            finally:
+                # Read by the request handlers while the job runs, so only written under the lock
+                with self.__lock:
+                    job.status = status
+                    job.error = error
+                    job.finished_at = time.time()
+                    self.__busy_workers -= 1
+
+    def __run(self, job: Job, optimizer: MediaOptimizer[Any]):
+        try:
+            files = Files(
+                job.source_dir,
+                job.target_dir,
+                filter_lambda=optimizer.is_valid_file,
+                create_file_lambda=optimizer.create_file,
+                allow_empty=True,
+            )
+        except FilesError as err:
+            raise JobError(str(err)) from err
+
+        files.sort(job.order, optimizer.estimate_work)
+        job.target_dir = files.target_dir
+        job.total_files = len(files)
+
+        report = ResultsReport.in_directory(files.target_dir, job.report_format) if job.report_format else None
+
+        try:
+            job.results = optimizer.run(files, job.options, report, show_progress=False)
+        finally:
+            # Files might change between jobs, so their info must not outlive the job (unmatched files are probed too)
+            for source in [*(file.source for file in files), *files.unmatched]:
+                optimizer.media_info_service.forget(source)
+
+            # Only waited for by run() when it succeeds, and the verifier writes to the report
+            optimizer.stop_verification()
+
+            if report is not None:
+                report.close()
+
+    def __evict_finished_jobs(self):
+        finished = [job_id for job_id, job in self.__jobs.items() if job.finished]
+
+        for job_id in finished[: max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.__jobs[job_id]
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    server: JobServer
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        parts = self.__path_parts()
+
+        if parts == ["health"]:
+            self.__respond(HTTPStatus.OK, self.server.jobs.status())
+        elif parts == ["jobs"]:
+            self.__respond(HTTPStatus.OK, [job.to_json(include_results=False) for job in self.server.jobs.all()])
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = self.server.jobs.get(parts[1])
+            if job is None:
+                self.__respond(HTTPStatus.NOT_FOUND, {"error": f"Unknown job {parts[1]}"})
+            else:
+                self.__respond(HTTPStatus.OK, job.to_json())
+        else:
+            self.__respond(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        if self.__path_parts() != ["jobs"]:
+            self.__respond(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise JobError("The request body must be a JSON object")
+
+            job = self.server.jobs.submit(request)  # type: ignore
+        except (ValueError, JobError) as err:
+            self.__respond(HTTPStatus.BAD_REQUEST, {"error": str(err)})
+            return
+
+        self.__respond(HTTPStatus.ACCEPTED, job.to_json())
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        parts = self.__path_parts()
+        if len(parts) != 2 or parts[0] != "jobs":
+            self.__respond(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+            return
+
+        try:
+            job = self.server.jobs.cancel(parts[1])
+        except KeyError:
+            self.__respond(HTTPStatus.NOT_FOUND, {"error": f"Unknown job {parts[1]}"})
+            return
+        except JobError as err:
+            self.__respond(HTTPStatus.CONFLICT, {"error": str(err)})
+            return
+
+        self.__respond(HTTPStatus.OK, job.to_json())
+
+    def log_message(self, format: str, *args: Any):  # pylint: disable=redefined-builtin
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def __path_parts(self) -> list[str]:
+        return [part for part in self.path.split("?", 1)[0].split("/") if part != ""]
+
+    def __respond(self, status: HTTPStatus, body: Any):
+        content = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class JobServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, jobs: JobQueue, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, verbose: bool = False):
+        super().__init__((host, port), JobRequestHandler)
+        self.jobs = jobs
+        self.verbose = verbose
+
+    def run(self):
+        """Serves requests until interrupted, then waits for the running jobs to finish."""
+        host, port = self.server_address[:2]
+        self.jobs.start()
+
+        # Stopping the server through SIGTERM (e.g. from a service manager) must also let the running jobs finish
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+        print(
+            f"Listening for jobs on http://{host}:{port} with {self.jobs.workers} worker(s) "
+            "(press Ctrl+C to stop)..."
+        )
+
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            print("\nStopping, waiting for the running jobs to finish...")
+        finally:
+            self.server_close()
+            self.jobs.stop()
@@ -12,3 +12,8 @@ def cli_unprint(lines: int = 1, force_final_clear: bool = False):
 
     if force_final_clear:
         print(CLEAR_LINE)
+
+
+def get_progress_bar_format(completed: int, total: int) -> str:
+    """Progress bar format that shows how many files have been completed, while the bar itself tracks work."""
+    return f"{{l_bar}}{{bar}}| {completed}/{total} [{{elapsed}}<{{remaining}}, {{rate_fmt}}{{postfix}}]"
@@ -0,0 +1,199 @@
+"""
+Sampled verification of optimized files, which catches broken outputs at a fraction of the cost of fully decoding
+them again:
+
+- Container integrity, and consistency of the dimensions and duration reported by MediaInfo.
+- Decoding of a few sampled frames of each video, or of each picture at a reduced resolution when possible.
+- Optionally, the PSNR of those samples against the same samples of the source.
+
+Files are verified in a background thread while the next files are optimized (see MediaOptimizer.process_file()).
+"""
+
+from __future__ import annotations
+
+import io
+import math
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable
+
+from src.components.metrics import METRICS
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from PIL import Image
+    from pymediainfo import MediaInfo
+
+    from src.components.files import File
+    from src.components.results import FileResult, ResultsReport
+
+# Long side of the samples that are compared against the source
+SAMPLE_LONG_SIDE = 512
+# Allowed difference between the dimensions (in pixels) and the duration (in seconds, or relative to it) of an output
+# and the expected ones
+SIZE_TOLERANCE = 2
+DURATION_TOLERANCE = 0.5
+RELATIVE_DURATION_TOLERANCE = 0.01
+
+
+@dataclass
+class VerificationOptions:
+    # Whether optimized files are verified, in the background while the next files are optimized
+    enabled: bool = False
+    # Frames decoded from each video, evenly spread over its duration
+    samples: int = 3
+    # Minimum PSNR (in dB) of the samples against the source, below which an output is suspect (0 = not compared)
+    min_psnr: float = 0.0
+
+
+class Verifier:
+    """Verifies files one at a time in a background thread, and reports their results once they are verified."""
+
+    def __init__(self):
+        # pylint: disable=import-outside-toplevel
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="verifier")
+        self.__pending: list[Future[None]] = []
+        self.__lock = threading.Lock()
+
+    def submit(
+        self,
+        file: File,
+        result: FileResult,
+        verify: Callable[[], str | None],
+        report: ResultsReport | None = None,
+    ):
+        """Runs `verify` (which returns why the file is suspect, if it is) and writes the result to the report."""
+        future = self.__executor.submit(self.__verify, file, result, verify, report)
+
+        with self.__lock:
+            self.__pending = [pending for pending in self.__pending if not pending.done()]
+            self.__pending.append(future)
+
+    def wait(self):
+        """Blocks until every submitted file has been verified."""
+        with self.__lock:
+            pending, self.__pending = self.__pending, []
+
+        for future in pending:
+            future.result()
+
+    def cancel(self):
+        """Drops the files that are still waiting to be verified, and blocks until the one being verified is done."""
+        with self.__lock:
+            pending, self.__pending = self.__pending, []
+
+        for future in pending:
+            future.cancel()
+
+        for future in pending:
+            if not future.cancelled():
+                future.result()
+
+    def __verify(self, file: File, result: FileResult, verify: Callable[[], str | None], report: ResultsReport | None):
+        start = time.perf_counter()
+
+        try:
+            with METRICS.stage("verify"):
+                reason = verify()
+        except Exception as err:  # pylint: disable=broad-exception-caught  # <- anything unexpected makes it suspect
+            reason = f"could not be verified ({str(err) or type(err).__name__})"
+
+        file.suspect_reason = reason
+        result.verified = True
+        result.suspect_reason = reason
+        result.stage_seconds["verify"] = time.perf_counter() - start
+
+        if reason is not None:
+            METRICS.increment("suspect_files")
+
+        if report is not None:
+            report.write(result)
+
+
+def check_media_info(
+    info: MediaInfo | None,
+    expected_size: tuple[int, int] | None = None,
+    expected_duration: float | None = None,
+) -> str | None:
+    """Checks that MediaInfo can read a file, and that its dimensions and duration are the expected ones."""
+    if info is None:
+        return "its container could not be read"
+
+    tracks = info.video_tracks or info.image_tracks
+    if len(tracks) == 0:
+        return "it has no picture or video track"
+
+    track = tracks[0]
+
+    if expected_size is not None and track.width is not None and track.height is not None:
+        width, height = int(track.width), int(track.height)
+        if abs(width - expected_size[0]) > SIZE_TOLERANCE or abs(height - expected_size[1]) > SIZE_TOLERANCE:
+            return f"its size is {width}x{height}, expected {expected_size[0]}x{expected_size[1]}"
+
+    if expected_duration is not None:
+        duration = float(track.duration or 0) / 1000
+        tolerance = max(DURATION_TOLERANCE, expected_duration * RELATIVE_DURATION_TOLERANCE)
+        if abs(duration - expected_duration) > tolerance:
+            return f"its duration is {duration:.2f}s, expected {expected_duration:.2f}s"
+
+    return None
+
+
+def get_sample_size(size: tuple[int, int]) -> tuple[int, int]:
+    """Size of the samples of a picture or video of the provided size, which keeps its aspect ratio."""
+    width, height = size
+    scale = min(SAMPLE_LONG_SIDE / max(width, height), 1.0)
+
+    return max(round(width * scale), 1), max(round(height * scale), 1)
+
+
+def load_sample(path: Path, size: tuple[int, int] | None = None) -> Image.Image:
+    """
+    Fully decodes a picture (at a reduced resolution for JPEG, which is enough to detect corrupt data), raising an
+    exception if it is broken, and downscales it to the provided size (or to the size of its samples).
+    """
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+
+    with Image.open(path) as image:
+        size = size or get_sample_size(image.size)
+        image.draft("RGB", size)
+        image.load()
+        sample = image.convert("RGB")
+
+    return sample.resize(size, Image.Resampling.BILINEAR) if sample.size != size else sample
+
+
+def decode_frame(path: Path, seconds: float, size: tuple[int, int]) -> Image.Image:
+    """Decodes the frame of a video at the provided time, downscaled to the provided size."""
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+
+    from src.components.ffmpeg import FFmpeg
+
+    frame = (
+        FFmpeg()
+        .input(str(path), ss=str(round(seconds, 3)))
+        .output("-", vf=f"scale={size[0]}:{size[1]}", f="image2pipe", vcodec="png", frames="1")
+        .execute()
+    )
+    if len(frame) == 0:
+        raise ValueError(f"no frame could be decoded at {seconds:.2f}s")
+
+    return Image.open(io.BytesIO(frame)).convert("RGB")
+
+
+def get_psnr(reference: Image.Image, sample: Image.Image) -> float:
+    """Peak signal-to-noise ratio (in dB) of a sample against a reference of the same size and mode."""
+    # pylint: disable=import-outside-toplevel
+    from PIL import ImageChops, ImageStat
+
+    band_rms = ImageStat.Stat(ImageChops.difference(reference, sample)).rms
+    mean_squared_error = sum(rms**2 for rms in band_rms) / len(band_rms)
+
+    return math.inf if mean_squared_error == 0 else 10 * math.log10(255**2 / mean_squared_error)
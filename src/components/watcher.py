@@ -0,0 +1,211 @@
+"""
+Watchers that detect new files in a directory, reporting them only once they have been fully written.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+# inotify constants, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+@dataclass
+class WatchEvent:
+    path: Path
+    detected_at: float  # <- time.monotonic() value of the moment the file was first noticed
+
+
+class Watcher(ABC):
+    """Watches a directory (non-recursively) and yields files once they are complete."""
+
+    def __init__(self, directory: Path, poll_interval: float = 1.0):
+        self.directory = directory
+        self.poll_interval = poll_interval
+
+    @abstractmethod
+    def watch(self, stop: threading.Event) -> Iterator[WatchEvent]:
+        """Yields complete files until the provided event is set. Files already present are yielded first."""
+        raise NotImplementedError
+
+    def _existing_files(self) -> Iterator[Path]:
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield Path(entry.path)
+
+
+class PollingWatcher(Watcher):
+    """Portable watcher that rescans the directory periodically, and considers files complete once their size
+    and modification time have not changed for a while."""
+
+    def __init__(self, directory: Path, poll_interval: float = 1.0, settle_time: float = 3.0):
+        super().__init__(directory, poll_interval)
+        self.settle_time = settle_time
+
+    def watch(self, stop: threading.Event) -> Iterator[WatchEvent]:
+        # path => (size, mtime, first seen at, last changed at)
+        pending: dict[Path, tuple[int, int, float, float]] = {}
+        # path => (size, mtime) of the files that have already been reported
+        reported: dict[Path, tuple[int, int]] = {}
+
+        while not stop.is_set():
+            now = time.monotonic()
+            present: set[Path] = set()
+
+            for path in self._existing_files():
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+
+                present.add(path)
+                signature = (stat.st_size, stat.st_mtime_ns)
+
+                if reported.get(path) == signature:
+                    continue
+
+                previous = pending.get(path)
+                if previous is None or previous[:2] != signature:
+                    first_seen = previous[2] if previous is not None else now
+                    pending[path] = (*signature, first_seen, now)
+                elif now - previous[3] >= self.settle_time:
+                    del pending[path]
+                    reported[path] = signature
+
+                    yield WatchEvent(path, previous[2])
+
+            # Forget files that have disappeared, so that memory usage stays stable
+            for path in pending.keys() - present:
+                del pending[path]
+            for path in reported.keys() - present:
+                del reported[path]
+
+            stop.wait(self.poll_interval)
+
+
+class InotifyWatcher(Watcher):
+    """Linux-only watcher that relies on inotify's close-write and moved-to events, so that files are reported as
+    soon as the writer closes them. Files that were already there (which might still be being written) are reported
+    once they have settled, like PollingWatcher does, unless an event reports them first."""
+
+    def __init__(self, directory: Path, poll_interval: float = 1.0, settle_time: float = 3.0):
+        super().__init__(directory, poll_interval)
+        self.settle_time = settle_time
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.__inotify_init1 = libc.inotify_init1
+        self.__inotify_add_watch = libc.inotify_add_watch
+
+    @classmethod
+    def is_supported(cls) -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+
+        try:
+            libc = ctypes.CDLL(None)
+        except OSError:
+            return False
+
+        return hasattr(libc, "inotify_init1")
+
+    def watch(self, stop: threading.Event) -> Iterator[WatchEvent]:
+        fd = self.__inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        try:
+            if self.__inotify_add_watch(fd, bytes(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {self.directory}")
+
+            # Anything written before the watch was set up will only trigger an event if it is still being written
+            # path => (size, mtime, first seen at, last changed at)
+            pending = self.__scan(time.monotonic())
+
+            while not stop.is_set():
+                readable, _, _ = select.select([fd], [], [], self.poll_interval)
+                detected_at = time.monotonic()
+
+                if readable:
+                    for mask, name in self.__read_events(fd):
+                        if mask & IN_Q_OVERFLOW:
+                            # The kernel dropped events, so fall back to rescanning the directory
+                            pending = {**self.__scan(detected_at), **pending}
+                        elif name and not mask & IN_ISDIR:
+                            path = Path(self.directory, name)
+                            pending.pop(path, None)  # <- closed by its writer, so complete
+
+                            yield WatchEvent(path, detected_at)
+
+                yield from self.__settle(pending, detected_at)
+        finally:
+            os.close(fd)
+
+    def __scan(self, now: float) -> dict[Path, tuple[int, int, float, float]]:
+        pending: dict[Path, tuple[int, int, float, float]] = {}
+
+        for path in self._existing_files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+
+            pending[path] = (stat.st_size, stat.st_mtime_ns, now, now)
+
+        return pending
+
+    def __settle(self, pending: dict[Path, tuple[int, int, float, float]], now: float) -> Iterator[WatchEvent]:
+        """Yields (and stops tracking) the pending files that haven't changed for a while."""
+        for path, (size, mtime, first_seen, last_changed) in list(pending.items()):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                del pending[path]
+                continue
+
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                pending[path] = (stat.st_size, stat.st_mtime_ns, first_seen, now)
+            elif now - last_changed >= self.settle_time:
+                del pending[path]
+
+                yield WatchEvent(path, first_seen)
+
+    def __read_events(self, fd: int) -> Iterator[tuple[int, str]]:
+        try:
+            buffer = os.read(fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(buffer):
+            _, mask, _, name_length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT.size
+            name = buffer[offset : offset + name_length].rstrip(b"\0").decode(errors="surrogateescape")
+            offset += name_length
+
+            yield mask, name
+
+
+def create_watcher(directory: Path, poll_interval: float = 1.0, settle_time: float = 3.0) -> Watcher:
+    if InotifyWatcher.is_supported():
+        return InotifyWatcher(directory, poll_interval, settle_time)
+
+    return PollingWatcher(directory, poll_interval, settle_time)
@@ -0,0 +1,428 @@
+"""
+Benchmark suite for the optimizers, run against a deterministic synthetic corpus that is generated offline.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, replace
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from src._version import __VERSION__
+
+ROOT = Path(__file__).parent.parent.parent
+
+DEFAULT_CORPUS_DIR = ROOT.joinpath("build", "benchmark_corpus")
+DEFAULT_RESULTS_FILE = ROOT.joinpath("build", "benchmark_results.json")
+DEFAULT_BASELINE_FILE = ROOT.joinpath("benchmarks", "baseline.json")
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+DEFAULT_REPEAT = 3
+
+PICTURES_DIR = "pictures"
+VIDEOS_DIR = "videos"
+MANIFEST_FILE = "manifest.json"
+
+
+@dataclass(frozen=True)
+class PictureSpec:
+    name: str
+    width: int
+    height: int
+    quality: int = 95
+
+
+@dataclass(frozen=True)
+class VideoSpec:
+    name: str
+    width: int
+    height: int
+    duration: int = 3
+    rate: int = 30
+
+
+PICTURE_SPECS = [
+    PictureSpec("small.jpg", 1024, 768),
+    PictureSpec("medium.jpg", 2048, 1536),
+    PictureSpec("large.jpg", 4000, 3000),
+    PictureSpec("portrait.jpg", 3000, 4000),
+    PictureSpec("small.png", 1024, 768),
+    PictureSpec("large.png", 2560, 1440),
+]
+
+VIDEO_SPECS = [
+    VideoSpec("720p.mp4", 1280, 720),
+    VideoSpec("1080p.mp4", 1920, 1080),
+]
+
+
+@dataclass
+class StageResult:
+    seconds: float
+    files: int
+    bytes: int = 0
+
+    @property
+    def per_file(self) -> float:
+        return self.seconds / self.files if self.files > 0 else 0.0
+
+
+@dataclass
+class BenchmarkResults:
+    version: str = __VERSION__
+    python: str = platform.python_version()
+    machine: str = f"{platform.system()} {platform.machine()}"
+    stages: dict[str, StageResult] = field(default_factory=dict)
+
+    def to_json(self) -> dict[str, Any]:
+        data = asdict(self)
+        for name, stage in self.stages.items():
+            data["stages"][name]["per_file"] = stage.per_file
+
+        return data
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> BenchmarkResults:
+        stages = {
+            name: StageResult(stage["seconds"], stage["files"], stage.get("bytes", 0))
+            for name, stage in data["stages"].items()
+        }
+
+        return cls(data["version"], data["python"], data["machine"], stages)
+
+
+class BenchmarkRegression(Exception):
+    pass
+
+
+def run_benchmarks(
+    corpus_dir: Path = DEFAULT_CORPUS_DIR,
+    results_file: Path = DEFAULT_RESULTS_FILE,
+    baseline_file: Path = DEFAULT_BASELINE_FILE,
+    threshold: float = DEFAULT_REGRESSION_THRESHOLD,
+    repeat: int = DEFAULT_REPEAT,
+    save_baseline: bool = False,
+):
+    """
+    Generates the corpus if needed, times every stage of both optimizers, and writes the results as JSON.
+
+    Every stage is run several times and the fastest run is kept, as it is the least affected by noise.
+    If a baseline exists, the results are compared against it and BenchmarkRegression is raised when any stage
+    is slower than the baseline by more than the provided threshold (e.g. 0.1 = 10%).
+    """
+    generate_corpus(corpus_dir)
+
+    results = BenchmarkResults()
+    __benchmark_pictures(corpus_dir.joinpath(PICTURES_DIR), results, repeat)
+
+    if shutil.which("ffmpeg") is not None:
+        __benchmark_videos(corpus_dir.joinpath(VIDEOS_DIR), results, repeat)
+    else:
+        print("[WARNING] FFmpeg not found, skipping video benchmarks")
+
+    __print_results(results)
+
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    results_file.write_text(json.dumps(results.to_json(), indent=2), encoding="utf-8")
+    print(f"\nResults written to {results_file}")
+
+    if save_baseline:
+        baseline_file.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(results_file, baseline_file)
+        print(f"Baseline saved to {baseline_file}")
+    elif baseline_file.is_file():
+        baseline = BenchmarkResults.from_json(json.loads(baseline_file.read_text("utf-8")))
+        compare_results(results, baseline, threshold)
+
+
+def compare_results(results: BenchmarkResults, baseline: BenchmarkResults, threshold: float):
+    print(f"\nComparison against baseline (v{baseline.version}, {baseline.machine}, threshold {threshold:.0%}):")
+
+    regressions: list[str] = []
+
+    for name, stage in results.stages.items():
+        baseline_stage = baseline.stages.get(name)
+        if baseline_stage is None or baseline_stage.per_file == 0:
+            print(f"  {name:<28} (no baseline)")
+            continue
+
+        change = stage.per_file / baseline_stage.per_file - 1
+        is_regression = change > threshold
+
+        if is_regression:
+            regressions.append(name)
+
+        print(f"  {name:<28} {change:+8.1%}{'  <- REGRESSION' if is_regression else ''}")
+
+    if len(regressions) > 0:
+        raise BenchmarkRegression(f"Stages slower than baseline by more than {threshold:.0%}: {', '.join(regressions)}")
+
+
+def generate_corpus(corpus_dir: Path):
+    """Generates the synthetic corpus, unless an identical one (according to its manifest) already exists."""
+    manifest = {
+        "pictures": [asdict(spec) for spec in PICTURE_SPECS],
+        "videos": [asdict(spec) for spec in VIDEO_SPECS],
+    }
+    manifest_hash = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+    manifest_file = corpus_dir.joinpath(MANIFEST_FILE)
+
+    if manifest_file.is_file() and json.loads(manifest_file.read_text("utf-8")).get("hash") == manifest_hash:
+        return
+
+    print(f"Generating synthetic corpus in {corpus_dir}...")
+
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    corpus_dir.joinpath(PICTURES_DIR).mkdir(parents=True)
+    corpus_dir.joinpath(VIDEOS_DIR).mkdir(parents=True)
+
+    for picture_spec in PICTURE_SPECS:
+        __generate_picture(picture_spec, corpus_dir.joinpath(PICTURES_DIR, picture_spec.name))
+
+    if shutil.which("ffmpeg") is not None:
+        for video_spec in VIDEO_SPECS:
+            __generate_video(video_spec, corpus_dir.joinpath(VIDEOS_DIR, video_spec.name))
+    else:
+        print("[WARNING] FFmpeg not found, the corpus will not contain videos")
+        manifest_hash = ""  # <- make sure the corpus is regenerated once FFmpeg is available
+
+    manifest_file.write_text(json.dumps({"hash": manifest_hash, **manifest}, indent=2), encoding="utf-8")
+
+
+def __generate_picture(spec: PictureSpec, path: Path):
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+
+    # Only deterministic generators are used, so the corpus is identical on every machine and run.
+    # The fractal gives the encoders some detail to work with, while the gradients add smooth areas.
+    size = (spec.width, spec.height)
+    red = Image.effect_mandelbrot(size, (-2.0, -1.25, 0.75, 1.25), 100)
+    green = Image.linear_gradient("L").resize(size)
+    blue = Image.radial_gradient("L").resize(size)
+
+    image = Image.merge("RGB", (red, green, blue))
+    image.save(path, quality=spec.quality)
+
+
+def __generate_video(spec: VideoSpec, path: Path):
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc2=size={spec.width}x{spec.height}:rate={spec.rate}:duration={spec.duration}",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency=440:duration={spec.duration}",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-crf",
+            "18",
+            "-pix_fmt",
+            "yuv420p",
+            "-threads",
+            "1",  # <- a single thread keeps the output bit-exact across machines
+            "-c:a",
+            "aac",
+            "-shortest",
+            str(path),
+        ],
+        check=True,
+    )
+
+
+@contextmanager
+def __timer(results: BenchmarkResults, stage: str, files: int) -> Iterator[None]:
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+
+    current = results.stages.get(stage)
+    if current is None or elapsed < current.seconds:
+        results.stages[stage] = StageResult(elapsed, files)
+
+
+def __repeat(repeat: int, results: BenchmarkResults, stage: str, files: int, fn: Callable[[], Any]):
+    for _ in range(repeat):
+        with __timer(results, stage, files):
+            fn()
+
+
+def __benchmark_pictures(source_dir: Path, results: BenchmarkResults, repeat: int):
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+
+    from src.components.files import Files, MediaInfoService
+    from src.components.options import Resolution
+    from src.optimizers.pictures import JpegQuality, PictureOptimizer, PictureOptions, PictureRendition
+
+    print("Benchmarking pictures...")
+
+    paths = sorted(path for path in source_dir.iterdir() if path.is_file())
+    count = len(paths)
+    options = PictureOptions(short_side_limit=Resolution.R_1080P, jpeg_quality=JpegQuality.MEDIUM)
+
+    with tempfile.TemporaryDirectory() as target_dir:
+
+        def scan():
+            optimizer = PictureOptimizer()
+            Files(str(source_dir), target_dir, optimizer.is_valid_file, optimizer.create_file)
+
+        def probe():
+            service = MediaInfoService()
+            for path in paths:
+                service.get(path)
+
+        __repeat(repeat, results, "pictures.scan", count, scan)
+        __repeat(repeat, results, "pictures.probe", count, probe)
+
+        # Individual stages, mirroring what PictureOptimizer._optimize_image does
+        optimizer = PictureOptimizer()
+        decoded: list[Image.Image] = []
+        resized: list[Image.Image] = []
+        encoded: list[bytes] = []
+
+        def decode():
+            decoded.clear()
+            for path in paths:
+                image = Image.open(path)
+                image.load()
+                decoded.append(image)
+
+        def resize():
+            resized[:] = [
+                optimizer._resize_image(image, options.short_side_limit)  # pylint: disable=protected-access
+                for image in decoded
+            ]
+
+        def encode():
+            encoded.clear()
+            for path, image in zip(paths, resized):
+                buffer = io.BytesIO()
+                image.save(buffer, format=Image.registered_extensions()[path.suffix], quality=options.jpeg_quality)
+                encoded.append(buffer.getvalue())
+
+        def write():
+            for path, data in zip(paths, encoded):
+                Path(target_dir, path.name).write_bytes(data)
+
+        __repeat(repeat, results, "pictures.decode", count, decode)
+        __repeat(repeat, results, "pictures.resize", count, resize)
+        __repeat(repeat, results, "pictures.encode", count, encode)
+        __repeat(repeat, results, "pictures.write", count, write)
+        results.stages["pictures.write"].bytes = sum(len(data) for data in encoded)
+
+        # End-to-end run of the real optimizer
+        def optimize():
+            for file in Files(str(source_dir), target_dir, optimizer.is_valid_file, optimizer.create_file):
+                optimizer.optimize_file(file, options)
+
+        __repeat(repeat, results, "pictures.total", count, optimize)
+
+        # Full, web and thumbnail sizes from a single decode, against a separate run for each size
+        renditions = [PictureRendition(), PictureRendition(1080), PictureRendition(200)]
+
+        def optimize_renditions():
+            rendition_options = replace(options, renditions=renditions)
+            for file in Files(str(source_dir), target_dir, optimizer.is_valid_file, optimizer.create_file):
+                optimizer.optimize_file(file, rendition_options)
+
+        def optimize_renditions_separately():
+            for rendition in renditions:
+                rendition_options = replace(options, renditions=[rendition])
+                for file in Files(str(source_dir), target_dir, optimizer.is_valid_file, optimizer.create_file):
+                    optimizer.optimize_file(file, rendition_options)
+
+        __repeat(repeat, results, "pictures.renditions", count, optimize_renditions)
+        __repeat(repeat, results, "pictures.renditions_separate", count, optimize_renditions_separately)
+
+
+def __benchmark_videos(source_dir: Path, results: BenchmarkResults, repeat: int):
+    # pylint: disable=import-outside-toplevel
+    from src.components.ffmpeg import FFmpeg
+    from src.components.files import Files, MediaInfoService
+    from src.components.options import Resolution
+    from src.optimizers.videos import EncodingPreset, VideoOptimizer, VideoOptions, VideoRendition
+
+    print("Benchmarking videos...")
+
+    paths = sorted(path for path in source_dir.iterdir() if path.is_file())
+    count = len(paths)
+    options = VideoOptions(short_side_limit=Resolution.R_720P, preset=EncodingPreset.FAST)
+
+    with tempfile.TemporaryDirectory() as target_dir:
+
+        def scan():
+            optimizer = VideoOptimizer()
+            Files(str(source_dir), target_dir, optimizer.is_valid_file, optimizer.create_file)
+
+        def probe():
+            service = MediaInfoService()
+            for path in paths:
+                service.get(path)
+
+        def decode():
+            for path in paths:
+                FFmpeg().input(str(path)).output("-", f="null").execute()
+
+        def resize():
+            # Decoding plus scaling, so the cost of scaling is the difference with the decode stage
+            for path in paths:
+                FFmpeg().input(str(path)).output("-", f="null", vf="scale=-2:720").execute()
+
+        __repeat(repeat, results, "videos.scan", count, scan)
+        __repeat(repeat, results, "videos.probe", count, probe)
+        __repeat(repeat, results, "videos.decode", count, decode)
+        __repeat(repeat, results, "videos.decode_resize", count, resize)
+
+        # End-to-end run of the real optimizer (decode, resize, encode and write)
+        def optimize():
+            optimizer = VideoOptimizer()
+            for file in Files(str(source_dir), target_dir, optimizer.is_valid_file, optimizer.create_file):
+                optimizer.optimize_file(file, options)
+
+        __repeat(repeat, results, "videos.total", count, optimize)
+
+        # A ladder of renditions from a single decode, against a separate run for each rendition
+        renditions = [VideoRendition(720), VideoRendition(540), VideoRendition(360)]
+
+        def optimize_renditions():
+            optimizer = VideoOptimizer()
+            rendition_options = replace(options, renditions=renditions)
+            for file in Files(str(source_dir), target_dir, optimizer.is_valid_file, optimizer.create_file):
+                optimizer.optimize_file(file, rendition_options)
+
+        def optimize_renditions_separately():
+            optimizer = VideoOptimizer()
+            for rendition in renditions:
+                rendition_options = replace(options, renditions=[rendition])
+                for file in Files(str(source_dir), target_dir, optimizer.is_valid_file, optimizer.create_file):
+                    optimizer.optimize_file(file, rendition_options)
+
+        __repeat(repeat, results, "videos.renditions", count, optimize_renditions)
+        __repeat(repeat, results, "videos.renditions_separate", count, optimize_renditions_separately)
+
+
+def __print_results(results: BenchmarkResults):
+    print(f"\n{'Stage':<28} {'Files':>6} {'Total (s)':>10} {'Per file (ms)':>14}")
+
+    for name, stage in results.stages.items():
+        print(f"{name:<28} {stage.files:>6} {stage.seconds:>10.3f} {stage.per_file * 1000:>14.1f}")
+
+    sys.stdout.flush()
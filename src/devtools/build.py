@@ -25,6 +25,8 @@ AUTO_THIRD_PARTY_LICENSES_FILE = ROOT.joinpath("build", "third_party_licenses.tx
 MANUAL_THIRD_PARTY_LICENSES_FILE = RELEASE_FILES_DIR.joinpath("third_party_lib_licenses.txt")
 
 EXE_NAME = "media_optimizer"
+# Directory of the onedir build, which contains the executable along with its unpacked dependencies
+ONEDIR_NAME = f"{EXE_NAME}-onedir"
 
 ARCH_X86_64 = "x86_64"
 ARCH_ARM64 = "arm64"
@@ -88,14 +90,18 @@ class BuildError(Exception):
     pass
 
 
-def build(is_for_release: bool = False, is_building_for_macos: bool = False):
+def build(is_for_release: bool = False, is_building_for_macos: bool = False, is_onedir: bool = False):
+    """
+    Builds a single-file executable, or with `is_onedir`, a directory with the executable and its dependencies, which
+    starts faster as nothing has to be unpacked to a temporary directory on every launch.
+    """
     system = platform.system()
     arch = platform.machine()
 
     if system == OS_MACOS and not is_building_for_macos:
         # If system is MacOS but the build command is not already running in MacOS build mode,
         # then re-run it in MacOS build mode to build both x86_64 and arm64 at once.
-        __macos_build(arch, is_for_release)
+        __macos_build(arch, is_for_release, is_onedir)
 
         return
 
@@ -115,24 +121,30 @@ def build(is_for_release: bool = False, is_building_for_macos: bool = False):
             *pyinstaller_args,
         ]
 
+    if is_onedir:
+        # Arguments after "--" are passed to the spec file
+        pyinstaller_args += ["--", "--onedir"]
+
     PyInstaller.__main__.run(pyinstaller_args)
 
     if is_for_release:
         __gather_licenses()
-        __pack_for_release(system, arch)
+        __pack_for_release(system, arch, is_onedir)
 
 
-def __macos_build(arch: str, is_for_release: bool = False):
-    subprocess.run(__macos_get_build_command(MACOS_CPYTHON_X64, is_for_release), check=True)
+def __macos_build(arch: str, is_for_release: bool = False, is_onedir: bool = False):
+    subprocess.run(__macos_get_build_command(MACOS_CPYTHON_X64, is_for_release, is_onedir), check=True)
 
     if arch == ARCH_ARM64:
-        subprocess.run(__macos_get_build_command(MACOS_CPYTHON_ARM64, is_for_release), check=True)
+        subprocess.run(__macos_get_build_command(MACOS_CPYTHON_ARM64, is_for_release, is_onedir), check=True)
 
 
-def __macos_get_build_command(python: str, is_for_release: bool):
+def __macos_get_build_command(python: str, is_for_release: bool, is_onedir: bool):
     args = ["uv", "run", "--python", python, "devtools.py", "build", "--macos"]
     if is_for_release:
         args.append("-r")
+    if is_onedir:
+        args.append("--onedir")
 
     return args
 
@@ -161,7 +173,7 @@ def __gather_licenses():
         output_file.write(manual_licenses_file.read())
 
 
-def __pack_for_release(system: str, arch: str):
+def __pack_for_release(system: str, arch: str, is_onedir: bool = False):
     print("Packing for release...")
 
     suffix_data = RELEASE_SUFFIXES.get(system)
@@ -172,12 +184,12 @@ def __pack_for_release(system: str, arch: str):
     if suffix is None:
         raise BuildError(f"Not prepared to build a release for the current architecture: {arch}")
 
-    zip_name = f"media-optimizer-{__VERSION__}-{suffix}.zip"
-    exe_source_name = EXE_NAME
+    zip_name = f"media-optimizer-{__VERSION__}-{suffix}{"-onedir" if is_onedir else ""}.zip"
+    exe_source_name = ONEDIR_NAME if is_onedir else EXE_NAME
     exe_target_name = EXE_NAME
     if system == OS_MACOS:
         exe_source_name = f"{arch}/{exe_source_name}"
-    elif system == OS_WINDOWS:
+    elif system == OS_WINDOWS and not is_onedir:
         exe_source_name += ".exe"
         exe_target_name += ".exe"
 
@@ -185,7 +197,13 @@ def __pack_for_release(system: str, arch: str):
 
     zf = zipfile.ZipFile(ROOT.joinpath("dist", zip_name), "w", zipfile.ZIP_DEFLATED)
 
-    zf.write(ROOT.joinpath("dist", exe_source_name), exe_target_name)
+    exe_source = ROOT.joinpath("dist", exe_source_name)
+    if is_onedir:
+        # The whole directory is packed, under a directory named after the executable
+        for path in sorted(exe_source.rglob("*")):
+            zf.write(path, Path(exe_target_name, path.relative_to(exe_source)))
+    else:
+        zf.write(exe_source, exe_target_name)
 
     for packed_file in RELEASE_PACKED_FILES:
         try:
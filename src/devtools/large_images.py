@@ -0,0 +1,267 @@
+"""
+Benchmark of the bounded-memory path for very large pictures, run against synthetic inputs that are written a few rows
+at a time, so that generating them doesn't need the memory that is being benchmarked.
+"""
+
+from __future__ import annotations
+
+import json
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator
+
+ROOT = Path(__file__).parent.parent.parent
+
+DEFAULT_LARGE_IMAGES_DIR = ROOT.joinpath("build", "large_images_corpus")
+DEFAULT_SIZE = 20000
+DEFAULT_MEMORY_MB = 256
+DEFAULT_SHORT_SIDE = 1080
+
+TILE_SIZE = 2000
+ROWS_PER_STRIP = 64
+LARGE_IMAGE_FORMATS = ("tif", "bmp", "jpg", "png")
+
+
+class LargeImageBenchmarkFailed(Exception):
+    pass
+
+
+@dataclass
+class LargeImageResult:
+    name: str
+    seconds: float
+    # Peak resident memory of the process, and the part of it that was used while optimizing the picture
+    peak_mb: float
+    used_mb: float
+    skip_reason: str | None
+
+
+def run_large_image_benchmarks(
+    corpus_dir: Path = DEFAULT_LARGE_IMAGES_DIR,
+    size: int = DEFAULT_SIZE,
+    memory_mb: int = DEFAULT_MEMORY_MB,
+    short_side: int = DEFAULT_SHORT_SIDE,
+):
+    """
+    Generates square pictures of the provided size if needed, and optimizes each of them in its own process with the
+    provided memory cap. Raises LargeImageBenchmarkFailed if the memory used by any of them exceeds the cap.
+    """
+    paths = generate_large_images(corpus_dir, size)
+    results: list[LargeImageResult] = []
+
+    for path in paths:
+        print(f"Optimizing {path.name}...")
+
+        with tempfile.TemporaryDirectory() as target_dir:
+            process = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "src.devtools.large_images",
+                    str(path),
+                    str(Path(target_dir, path.name)),
+                    str(memory_mb),
+                    str(short_side),
+                ],
+                cwd=ROOT,
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+
+        results.append(LargeImageResult(**json.loads(process.stdout.splitlines()[-1])))
+
+    print(f"\n{'Picture':<16} {'Time (s)':>9} {'Peak (MiB)':>11} {'Used (MiB)':>11}  Result (cap: {memory_mb} MiB)")
+
+    for result in results:
+        outcome = f"skipped, {result.skip_reason}" if result.skip_reason is not None else "optimized"
+        print(f"{result.name:<16} {result.seconds:>9.2f} {result.peak_mb:>11.1f} {result.used_mb:>11.1f}  {outcome}")
+
+    over_cap = [result.name for result in results if result.used_mb > memory_mb]
+    if len(over_cap) > 0:
+        raise LargeImageBenchmarkFailed(f"Pictures that used more than {memory_mb} MiB: {', '.join(over_cap)}")
+
+
+def generate_large_images(corpus_dir: Path, size: int) -> list[Path]:
+    """Generates the benchmark pictures that don't exist yet, and returns their paths."""
+    writers: dict[str, Callable[[Path, int, Iterator[bytes]], None]] = {
+        "tif": __write_tiff,
+        "bmp": __write_bmp,
+        "jpg": __write_jpeg,
+        "png": __write_png,
+    }
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    paths: list[Path] = []
+
+    for extension in LARGE_IMAGE_FORMATS:
+        path = corpus_dir.joinpath(f"{size}x{size}.{extension}")
+
+        if not path.is_file():
+            print(f"Generating {path}...")
+
+            partial_path = path.with_name(f"{path.name}.partial")
+            writers[extension](partial_path, size, __generate_rows(size))
+            partial_path.replace(path)
+
+        paths.append(path)
+
+    return paths
+
+
+def __generate_rows(size: int) -> Iterator[bytes]:
+    """Yields the RGB rows of a square picture, made by repeating a deterministic tile (see benchmark.py)."""
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+
+    tile_size = (TILE_SIZE, TILE_SIZE)
+    tile = Image.merge(
+        "RGB",
+        (
+            Image.effect_mandelbrot(tile_size, (-2.0, -1.25, 0.75, 1.25), 100),
+            Image.linear_gradient("L").resize(tile_size),
+            Image.radial_gradient("L").resize(tile_size),
+        ),
+    ).tobytes()
+    tile_row_bytes = TILE_SIZE * 3
+    repeats = -(-size // TILE_SIZE)
+
+    for y in range(size):
+        start = (y % TILE_SIZE) * tile_row_bytes
+        yield (tile[start : start + tile_row_bytes] * repeats)[: size * 3]
+
+
+def __write_tiff(path: Path, size: int, rows: Iterator[bytes]):
+    """Writes an uncompressed RGB TIFF, split in strips of ROWS_PER_STRIP rows."""
+    strip_count = -(-size // ROWS_PER_STRIP)
+    strip_bytes = [min(ROWS_PER_STRIP, size - top) * size * 3 for top in range(0, size, ROWS_PER_STRIP)]
+
+    tags = 10
+    ifd_offset = 8
+    bits_offset = ifd_offset + 2 + tags * 12 + 4
+    offsets_offset = bits_offset + 6
+    byte_counts_offset = offsets_offset + 4 * strip_count
+    data_offset = byte_counts_offset + 4 * strip_count
+
+    strip_offsets = [data_offset + sum(strip_bytes[:index]) for index in range(strip_count)]
+
+    def tag(code: int, kind: int, count: int, value: int) -> bytes:
+        # Kind 3 is SHORT and 4 is LONG. Single SHORT values are stored left-aligned in the 4-byte value field.
+        packed = struct.pack("<HI", value, 0)[:4] if kind == 3 and count == 1 else struct.pack("<I", value)
+        return struct.pack("<HHI", code, kind, count) + packed
+
+    with open(path, "wb") as file:
+        file.write(b"II*\x00" + struct.pack("<I", ifd_offset))
+        file.write(struct.pack("<H", tags))
+        file.write(tag(256, 4, 1, size))  # <- ImageWidth
+        file.write(tag(257, 4, 1, size))  # <- ImageLength
+        file.write(tag(258, 3, 3, bits_offset))  # <- BitsPerSample
+        file.write(tag(259, 3, 1, 1))  # <- Compression: none
+        file.write(tag(262, 3, 1, 2))  # <- PhotometricInterpretation: RGB
+        file.write(tag(273, 4, strip_count, offsets_offset))  # <- StripOffsets
+        file.write(tag(277, 3, 1, 3))  # <- SamplesPerPixel
+        file.write(tag(278, 4, 1, ROWS_PER_STRIP))  # <- RowsPerStrip
+        file.write(tag(279, 4, strip_count, byte_counts_offset))  # <- StripByteCounts
+        file.write(tag(284, 3, 1, 1))  # <- PlanarConfiguration: contiguous
+        file.write(struct.pack("<I", 0))
+        file.write(struct.pack("<3H", 8, 8, 8))
+        file.write(struct.pack(f"<{strip_count}I", *strip_offsets))
+        file.write(struct.pack(f"<{strip_count}I", *strip_bytes))
+
+        for row in rows:
+            file.write(row)
+
+
+def __write_bmp(path: Path, size: int, rows: Iterator[bytes]):
+    """Writes a 24-bit BMP, stored top-down (negative height) so that rows can be written as they are generated."""
+    padding = b"\x00" * (-size * 3 % 4)
+    data_offset = 14 + 40
+    file_size = data_offset + (size * 3 + len(padding)) * size
+
+    with open(path, "wb") as file:
+        file.write(b"BM" + struct.pack("<IHHI", file_size, 0, 0, data_offset))
+        file.write(struct.pack("<IiiHHIIiiII", 40, size, -size, 1, 24, 0, 0, 2835, 2835, 0, 0))
+
+        for row in rows:
+            # BMP stores pixels as BGR
+            pixels = bytearray(len(row))
+            pixels[0::3], pixels[1::3], pixels[2::3] = row[2::3], row[1::3], row[0::3]
+            file.write(pixels + padding)
+
+
+def __write_png(path: Path, size: int, rows: Iterator[bytes]):
+    """Writes an RGB PNG whose compressed data is streamed into consecutive IDAT chunks."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    compressor = zlib.compressobj(6)
+
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)))
+
+        for row in rows:
+            data = compressor.compress(b"\x00" + row)  # <- each row starts with its filter type (none)
+            if len(data) > 0:
+                file.write(chunk(b"IDAT", data))
+
+        file.write(chunk(b"IDAT", compressor.flush()))
+        file.write(chunk(b"IEND", b""))
+
+
+def __write_jpeg(path: Path, size: int, rows: Iterator[bytes]):
+    """JPEG can't be encoded in parts with Pillow, so this is the only input that needs the full picture in memory."""
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+
+    image = Image.frombytes("RGB", (size, size), b"".join(rows))
+    image.save(path, format="JPEG", quality=90)
+
+
+def __optimize(source: Path, target: Path, memory_mb: int, short_side: int) -> LargeImageResult:
+    """Optimizes a single picture in the current process, which must not have done anything else before."""
+    # pylint: disable=import-outside-toplevel
+    from src.components.options import Resolution
+    from src.optimizers.pictures import ImageFormat, PictureOptimizer, PictureOptions
+
+    optimizer = PictureOptimizer()
+    options = PictureOptions(
+        short_side_limit=Resolution(short_side),
+        output_format=ImageFormat.JPEG,
+        max_memory_mb=memory_mb,
+    )
+    file = optimizer.create_file(source, target)
+
+    baseline_mb = __get_peak_rss_mb()
+    start = time.perf_counter()
+    optimizer.optimize_file(file, options)
+    seconds = time.perf_counter() - start
+    peak_mb = __get_peak_rss_mb()
+
+    return LargeImageResult(source.name, seconds, peak_mb, peak_mb - baseline_mb, file.skip_reason)
+
+
+def __get_peak_rss_mb() -> float:
+    # On Linux, the peak memory of getrusage() carries over from the parent process when it is bigger
+    status = Path("/proc/self/status")
+    if status.is_file():
+        for line in status.read_text("utf-8").splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+
+    # pylint: disable=import-outside-toplevel
+    import resource  # <- Only available on Unix, where the benchmark is meant to be run
+
+    # Reported in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 / 1024
+
+
+if __name__ == "__main__":
+    result = __optimize(Path(sys.argv[1]), Path(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+    print(json.dumps(result.__dict__))
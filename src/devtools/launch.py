@@ -0,0 +1,128 @@
+"""
+Launch time of the built executables (see build.py), which unlike the startup time of the source (see startup.py)
+includes unpacking the single-file executable on every launch and loading the bundled libraries.
+"""
+
+from __future__ import annotations
+
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from src.devtools.build import EXE_NAME, ONEDIR_NAME, OS_MACOS, OS_WINDOWS, ROOT
+
+DEFAULT_LAUNCH_RUNS = 5
+TINY_BATCH_SIZE = 3
+
+
+class LaunchBenchmarkFailed(Exception):
+    pass
+
+
+@dataclass
+class LaunchResult:
+    artifact: str
+    command: str
+    cold_ms: float
+    warm_ms: float
+
+
+def measure_launch(artifacts: list[Path] | None = None, runs: int = DEFAULT_LAUNCH_RUNS):
+    """
+    Measures the cold and warm launch time of the built executables (every one found in dist/ unless provided), for
+    `--version` and for a tiny batch of pictures.
+
+    Cold launches are measured after evicting the files of the executable from the OS file cache, which is only
+    possible on Linux. Elsewhere, the first launch is reported as cold. Warm launches are the median of several runs.
+    """
+    artifacts = artifacts or get_built_artifacts()
+    if len(artifacts) == 0:
+        raise LaunchBenchmarkFailed("No built executable found in dist/, build one with: uv run devtools.py build")
+
+    if not hasattr(os, "posix_fadvise"):
+        print("[WARNING] Files can't be evicted from the file cache on this system, so cold launches may be warm")
+
+    results: list[LaunchResult] = []
+
+    with tempfile.TemporaryDirectory() as batch_dir:
+        source_dir = __generate_tiny_batch(Path(batch_dir, "source"))
+        commands = {
+            "--version": ["--version"],
+            f"{TINY_BATCH_SIZE} pictures": ["-o", "pictures", "-s", str(source_dir), "-t", str(Path(batch_dir, "out"))],
+        }
+
+        for artifact in artifacts:
+            print(f"Launching {artifact.relative_to(ROOT) if artifact.is_relative_to(ROOT) else artifact}...")
+
+            for command, args in commands.items():
+                __evict_from_file_cache(artifact)
+                cold_ms = __launch(artifact, args)
+                warm_ms = statistics.median(__launch(artifact, args) for _ in range(runs))
+
+                results.append(LaunchResult(__get_artifact_kind(artifact), command, cold_ms, warm_ms))
+
+    print(f"\n{'Executable':<12} {'Command':<12} {'Cold (ms)':>10} {f'Warm (ms, median of {runs})':>26}")
+
+    for result in results:
+        print(f"{result.artifact:<12} {result.command:<12} {result.cold_ms:>10.1f} {result.warm_ms:>26.1f}")
+
+
+def get_built_artifacts() -> list[Path]:
+    """Returns the single-file and onedir executables that have been built for the current system."""
+    system = platform.system()
+    dist_dir = ROOT.joinpath("dist", platform.machine()) if system == OS_MACOS else ROOT.joinpath("dist")
+    exe_name = f"{EXE_NAME}.exe" if system == OS_WINDOWS else EXE_NAME
+
+    candidates = [dist_dir.joinpath(exe_name), dist_dir.joinpath(ONEDIR_NAME, exe_name)]
+
+    return [path for path in candidates if path.is_file()]
+
+
+def __get_artifact_kind(artifact: Path) -> str:
+    return "onedir" if artifact.parent.name == ONEDIR_NAME else "onefile"
+
+
+def __launch(artifact: Path, args: list[str]) -> float:
+    """Runs the executable with the provided arguments, and returns its wall time in milliseconds."""
+    start = time.perf_counter()
+    subprocess.run([str(artifact), *args], check=True, capture_output=True, stdin=subprocess.DEVNULL)
+
+    return (time.perf_counter() - start) * 1000
+
+
+def __evict_from_file_cache(artifact: Path):
+    """Drops the files of an executable (and of its directory, if it is a onedir build) from the OS file cache."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+
+    paths = artifact.parent.rglob("*") if __get_artifact_kind(artifact) == "onedir" else [artifact]
+    # Only pages that have been written to disk can be dropped
+    os.sync()
+
+    for path in paths:
+        if not path.is_file():
+            continue
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def __generate_tiny_batch(source_dir: Path) -> Path:
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+
+    source_dir.mkdir(parents=True)
+
+    for idx in range(TINY_BATCH_SIZE):
+        image = Image.effect_mandelbrot((640, 480), (-2.0 + idx * 0.1, -1.25, 0.75, 1.25), 50).convert("RGB")
+        image.save(source_dir.joinpath(f"{idx}.jpg"), quality=95)
+
+    return source_dir
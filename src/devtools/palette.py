@@ -0,0 +1,147 @@
+"""
+Benchmark of lossy PNG palettes against truecolor PNG saved with `optimize=True`, run against synthetic pictures that
+cover the cases palettes are meant for (screenshots, graphics with transparency) and the ones they aren't (photos).
+"""
+
+from __future__ import annotations
+
+import io
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+DEFAULT_PALETTE_REPEAT = 3
+PALETTE_PICTURE_SIZE = (1920, 1080)
+
+
+class PaletteBenchmarkFailed(Exception):
+    pass
+
+
+@dataclass
+class PaletteResult:
+    name: str
+    megapixels: float
+    truecolor_bytes: int
+    palette_bytes: int
+    # Fastest quantization out of every run
+    quantize_seconds: float
+    psnr: float
+
+    @property
+    def savings(self) -> float:
+        return 1 - self.palette_bytes / self.truecolor_bytes
+
+
+def run_palette_benchmarks(repeat: int = DEFAULT_PALETTE_REPEAT):
+    """Quantizes every synthetic picture, with and without dithering, and prints time per megapixel and size savings."""
+    # pylint: disable=import-outside-toplevel
+    from src.components.palette import PaletteOptions, quantize
+
+    try:
+        options = PaletteOptions(enabled=True)
+    except ValueError as err:
+        raise PaletteBenchmarkFailed(str(err)) from err
+
+    generators: dict[str, Callable[[tuple[int, int]], Image.Image]] = {
+        "screenshot": __generate_screenshot,
+        "chart (alpha)": __generate_chart,
+        "photo": __generate_photo,
+    }
+    results: list[PaletteResult] = []
+
+    for name, generate in generators.items():
+        image = generate(PALETTE_PICTURE_SIZE)
+        truecolor_bytes = len(__encode(image))
+
+        for dither in (False, True):
+            seconds = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                quantized, psnr = quantize(image, options.colors, dither)
+                seconds = min(seconds, time.perf_counter() - start)
+
+            results.append(
+                PaletteResult(
+                    f"{name}{', dithered' if dither else ''}",
+                    image.width * image.height / 1_000_000,
+                    truecolor_bytes,
+                    len(__encode(quantized)),
+                    seconds,
+                    psnr,
+                )
+            )
+
+    print(f"\n{'Picture':<26} {'ms/Mpx':>8} {'Truecolor (KiB)':>16} {'Palette (KiB)':>14} {'Savings':>8} {'PSNR':>7}")
+
+    for result in results:
+        outcome = "  <- kept as truecolor" if result.psnr < options.min_psnr else ""
+        print(
+            f"{result.name:<26} {result.quantize_seconds * 1000 / result.megapixels:>8.1f} "
+            f"{result.truecolor_bytes / 1024:>16.1f} {result.palette_bytes / 1024:>14.1f} {result.savings:>8.1%} "
+            f"{result.psnr:>7.1f}{outcome}"
+        )
+
+
+def __encode(image: Image.Image) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format="PNG", optimize=True)
+
+    return output.getvalue()
+
+
+def __generate_screenshot(size: tuple[int, int]) -> Image.Image:
+    """Flat UI panels with text, which have few colors besides the anti-aliased edges of the text."""
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", size, (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    width, height = size
+
+    draw.rectangle((0, 0, width, 48), fill=(32, 33, 36))
+    draw.rectangle((0, 48, 280, height), fill=(230, 232, 236))
+
+    for row in range(0, height - 60, 24):
+        draw.text((16, 60 + row), f"Item {row // 24}", fill=(60, 64, 67))
+        draw.text((300, 60 + row), f"Lorem ipsum dolor sit amet, line {row // 24} " * 4, fill=(32, 33, 36))
+
+    # Rendering at twice the size and downscaling anti-aliases everything, as a real screen would
+    return image.resize((width * 2, height * 2), Image.Resampling.NEAREST).resize(size, Image.Resampling.BOX)
+
+
+def __generate_chart(size: tuple[int, int]) -> Image.Image:
+    """Anti-aliased shapes and lines over a soft shadow, on a transparent background."""
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image, ImageDraw
+
+    width, height = size
+    image = Image.new("RGBA", (width * 2, height * 2), (20, 60, 140, 0))
+    image.putalpha(Image.radial_gradient("L").resize(image.size).point(lambda value: (255 - value) // 2))
+    draw = ImageDraw.Draw(image)
+
+    for idx in range(12):
+        color = (40 + idx * 17, 200 - idx * 13, 90 + idx * 11, 255 - idx * 12)
+        draw.pieslice((200, 200, 1400, 1400), idx * 30, idx * 30 + 30, fill=color)
+        draw.rectangle((1800 + idx * 160, 2000 - idx * 120, 1900 + idx * 160, 2000), fill=color)
+        draw.line([(1800, 1900 - idx * 140), (3700, 200 + idx * 90)], fill=color, width=6)
+
+    return image.resize(size, Image.Resampling.BOX)
+
+
+def __generate_photo(size: tuple[int, int]) -> Image.Image:
+    """The same smooth gradients and fractal detail as the benchmark corpus, which need far more than 256 colors."""
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+
+    return Image.merge(
+        "RGB",
+        (
+            Image.effect_mandelbrot(size, (-2.0, -1.25, 0.75, 1.25), 100),
+            Image.linear_gradient("L").resize(size),
+            Image.radial_gradient("L").resize(size),
+        ),
+    )
@@ -0,0 +1,86 @@
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent.parent
+
+DEFAULT_STARTUP_BUDGET_MS = 150
+DEFAULT_RUNS = 5
+
+# Dependencies that must only be imported once an optimizer has been chosen
+LAZY_MODULES = ("PIL", "pymediainfo", "ffmpeg", "tqdm", "questionary", "prompt_toolkit")
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*(\S+)$")
+
+
+class StartupBudgetExceeded(Exception):
+    pass
+
+
+def measure_startup(runs: int = DEFAULT_RUNS, budget_ms: float = DEFAULT_STARTUP_BUDGET_MS):
+    """
+    Measures the import time of the entry point with `-X importtime`, and the wall time of `--version`.
+
+    Each measurement is repeated several times and the median is reported, after a discarded warm-up run that
+    makes sure bytecode caches exist. Raises StartupBudgetExceeded if the median import time is over budget,
+    or if any of the heavy dependencies is imported eagerly.
+    """
+    __run_import_time()
+
+    import_times: list[float] = []
+    imports: dict[str, int] = {}
+
+    for _ in range(runs):
+        imports = __run_import_time()
+        import_times.append(imports.get("media_optimizer", 0) / 1000)
+
+    version_times: list[float] = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "media_optimizer.py", "--version"], cwd=ROOT, check=True, capture_output=True)
+        version_times.append((time.perf_counter() - start) * 1000)
+
+    import_median = statistics.median(import_times)
+    version_median = statistics.median(version_times)
+
+    print(f"Import time of media_optimizer (median of {runs}): {import_median:.1f} ms (budget: {budget_ms} ms)")
+    print(f"Wall time of --version (median of {runs}): {version_median:.1f} ms")
+
+    print("\nSlowest imports (cumulative):")
+    for name, microseconds in sorted(imports.items(), key=lambda item: item[1], reverse=True)[1:11]:
+        print(f"  {microseconds / 1000:8.1f} ms  {name}")
+
+    eager_modules = sorted(
+        {name.split(".")[0] for name in imports if name.split(".")[0] in LAZY_MODULES}
+    )  # fmt: skip
+    if len(eager_modules) > 0:
+        raise StartupBudgetExceeded(f"Heavy dependencies imported at startup: {', '.join(eager_modules)}")
+
+    if import_median > budget_ms:
+        raise StartupBudgetExceeded(f"Startup import time {import_median:.1f} ms exceeds budget of {budget_ms} ms")
+
+    print("\nStartup time is within budget")
+
+
+def __run_import_time() -> dict[str, int]:
+    """Returns the cumulative import time, in microseconds, of every module imported by the entry point."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import media_optimizer"],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    imports: dict[str, int] = {}
+
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is not None:
+            imports[match.group(2)] = int(match.group(1))
+
+    return imports
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from src.components.media_optimizer import MediaOptimizer
+
+# Optimizers are referenced by import path, so that their heavy dependencies (PIL, python-ffmpeg, tqdm...)
+# are only loaded once an optimizer has actually been chosen.
+# Remember to declare them as hidden imports in the PyInstaller spec files (build/*.spec).
+OPTIMIZERS = {
+    "pictures": "src.optimizers.pictures.PictureOptimizer",
+    "videos": "src.optimizers.videos.VideoOptimizer",
+    "mixed": "src.optimizers.mixed.MixedOptimizer",
+}
+
+
+def load_optimizer(name: str) -> MediaOptimizer[Any]:
+    if name not in OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer '{name}', valid optimizers are: {', '.join(OPTIMIZERS)}")
+
+    module_name, class_name = OPTIMIZERS[name].rsplit(".", 1)
+    optimizer_class: type[MediaOptimizer[Any]] = getattr(importlib.import_module(module_name), class_name)
+
+    return optimizer_class()
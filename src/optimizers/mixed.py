@@ -0,0 +1,244 @@
+"""
+An optimizer for folders that contain both pictures and videos (e.g. camera dumps), which are scanned once and routed
+to the picture or the video optimizer.
+
+Both kinds of files are optimized at the same time under a single CPU budget: videos go through a single lane, as each
+encode is long and already uses several cores, while pictures are short and fill the remaining cores in parallel.
+Once there are no pictures left, videos get the whole budget.
+"""
+
+from __future__ import annotations
+
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import override
+
+from tqdm import tqdm
+
+from src.components.cpu_budget import CpuBudget
+from src.components.estimator import EstimateSample
+from src.components.files import File, Files
+from src.components.media_optimizer import MediaOptimizer
+from src.components.profiling import PROFILER
+from src.components.resources import RESOURCES
+from src.components.results import FileResult, ResultsReport
+from src.components.stdout import cli_unprint, get_progress_bar_format
+from src.optimizers.pictures import PictureFile, PictureOptimizer, PictureOptions
+from src.optimizers.videos import VideoFile, VideoOptimizer, VideoOptions
+
+
+@dataclass
+class MixedOptions:
+    pictures: PictureOptions = field(default_factory=PictureOptions)
+    videos: VideoOptions = field(default_factory=VideoOptions)
+
+
+class MixedOptimizer(MediaOptimizer[File, MixedOptions]):
+    parallelizable = True
+    options_class = MixedOptions
+
+    def __init__(self):
+        self.pictures = PictureOptimizer()
+        self.videos = VideoOptimizer()
+        self.cpu_budget = CpuBudget(RESOURCES.cores)
+
+        # Files are probed once, whichever optimizer asks first
+        self.pictures.media_info_service = self.media_info_service
+        self.videos.media_info_service = self.media_info_service
+
+        self.__pending_pictures = 0
+        self.__lock = threading.Lock()
+
+    @property
+    @override
+    def workers(self) -> int:
+        # Every core the run may use (see ResourceLimits.max_cores), or one when profiling (see PROFILER)
+        return 1 if PROFILER.enabled else RESOURCES.cores
+
+    @override
+    def is_valid_file(self, path: Path) -> bool:
+        return self.videos.is_valid_file(path) or self.pictures.is_valid_file(path)
+
+    @override
+    def create_file(self, source: Path, target: Path) -> File:
+        if self.videos.is_valid_file(source):
+            return self.videos.create_file(source, target)
+
+        return self.pictures.create_file(source, target)
+
+    @override
+    def estimate_work(self, file: File) -> float:
+        if isinstance(file, VideoFile):
+            return self.videos.estimate_work(file)
+        if isinstance(file, PictureFile):
+            return self.pictures.estimate_work(file)
+
+        return super().estimate_work(file)
+
+    @override
+    def get_lane(self, file: File) -> tuple[str, int]:
+        # See run()
+        if isinstance(file, VideoFile):
+            return "videos", 1
+
+        return "pictures", self.cpu_budget.cores
+
+    @override
+    def sample_file(self, file: File, options: MixedOptions, target_dir: Path) -> EstimateSample:
+        if isinstance(file, VideoFile):
+            return self.videos.sample_file(file, options.videos, target_dir)
+
+        assert isinstance(file, PictureFile)
+
+        return self.pictures.sample_file(file, options.pictures, target_dir)
+
+    @override
+    def get_run_only_options(self, options: MixedOptions) -> list[str]:
+        return [
+            *(f"pictures.{name}" for name in self.pictures.get_run_only_options(options.pictures)),
+            *(f"videos.{name}" for name in self.videos.get_run_only_options(options.videos)),
+        ]
+
+    @override
+    def should_verify(self, file: File, options: MixedOptions) -> bool:
+        if isinstance(file, VideoFile):
+            return self.videos.should_verify(file, options.videos)
+
+        return self.pictures.should_verify(file, options.pictures)  # type: ignore
+
+    @override
+    def verify_file(self, file: File, options: MixedOptions) -> str | None:
+        if isinstance(file, VideoFile):
+            return self.videos.verify_file(file, options.videos)
+
+        assert isinstance(file, PictureFile)
+
+        return self.pictures.verify_file(file, options.pictures)
+
+    @override
+    def ask_for_options(self, files: Files[File]) -> MixedOptions:
+        print("\nOptions for pictures:")
+        pictures = self.pictures.ask_for_options(files)
+
+        print("\nOptions for videos:")
+        videos = self.videos.ask_for_options(files)
+
+        return MixedOptions(pictures, videos)
+
+    @override
+    def optimize_file(self, file: File, options: MixedOptions):
+        if isinstance(file, VideoFile):
+            with self.cpu_budget.reserve(self.__video_cores(options.videos)) as cores:
+                self.videos.optimize_file(file, replace(options.videos, threads=cores))
+        else:
+            assert isinstance(file, PictureFile)
+
+            with self.cpu_budget.reserve(1):
+                self.pictures.optimize_file(file, options.pictures)
+
+    @override
+    def run(
+        self,
+        files: Files[File],
+        options: MixedOptions,
+        report: ResultsReport | None = None,
+        show_progress: bool = True,
+    ) -> list[FileResult]:
+        pictures = [file for file in files if isinstance(file, PictureFile)]
+        videos = [file for file in files if isinstance(file, VideoFile)]
+
+        with self.__lock:
+            self.__pending_pictures = len(pictures)
+
+        # Videos are encoded one at a time in their own lane, so the deadline is planned over their work only, and the
+        # throughput measured while sharing the cores with pictures is what the remaining videos get
+        video_works = [self.videos.estimate_work(file) for file in videos]
+        self.videos.start_deadline(options.videos)
+
+        # Per-frame video progress would garble the output while pictures complete, so only files are tracked
+        self.videos.progress_tracker = None
+
+        if show_progress:
+            print(f"\nOptimizing {len(pictures)} picture(s) and {len(videos)} video(s)...\n")
+
+        progress_tracker = (
+            tqdm(total=len(files), file=sys.stdout, unit="file", bar_format=get_progress_bar_format(0, len(files)))
+            if show_progress
+            else None
+        )
+
+        results: list[FileResult] = []
+        video_lane = ThreadPoolExecutor(max_workers=1, thread_name_prefix="video-worker")
+        # Profiled files share the video lane, so that they are optimized one at a time
+        picture_lanes = (
+            video_lane
+            if PROFILER.enabled
+            else ThreadPoolExecutor(max_workers=self.cpu_budget.cores, thread_name_prefix="picture-worker")
+        )
+
+        self.pictures.open_archive(files.target_dir, options.pictures)
+
+        try:
+            futures: dict[Future[FileResult], File] = {
+                **{
+                    video_lane.submit(self.__process_video, file, options, video_works, idx, report): file
+                    for idx, file in enumerate(videos)
+                },
+                **{picture_lanes.submit(self.__process_picture, file, options, report): file for file in pictures},
+            }
+
+            for future in as_completed(futures):
+                results.append(future.result())
+
+                if progress_tracker is not None:
+                    progress_tracker.write(f'Processed "{futures[future].source.name}"')
+                    progress_tracker.bar_format = get_progress_bar_format(len(results), len(files))
+                    progress_tracker.update(1)
+
+                    cli_unprint(2)
+        finally:
+            # Pending files must not keep being optimized after an error or an interruption
+            video_lane.shutdown(cancel_futures=True)
+            picture_lanes.shutdown(cancel_futures=True)
+            self.pictures.close_archive()
+
+            with self.__lock:
+                self.__pending_pictures = 0
+
+        if progress_tracker is not None:
+            cli_unprint(2)
+            progress_tracker.display()
+            progress_tracker.close()
+
+        self.wait_for_verification()
+
+        return results
+
+    def __process_video(
+        self,
+        file: VideoFile,
+        options: MixedOptions,
+        works: list[float],
+        idx: int,
+        report: ResultsReport | None,
+    ) -> FileResult:
+        return self.process_file(file, replace(options, videos=self.videos.plan(options.videos, works, idx)), report)
+
+    def __process_picture(self, file: File, options: MixedOptions, report: ResultsReport | None) -> FileResult:
+        try:
+            return self.process_file(file, options, report)
+        finally:
+            with self.__lock:
+                self.__pending_pictures -= 1
+
+    def __video_cores(self, options: VideoOptions) -> int:
+        with self.__lock:
+            pending_pictures = self.__pending_pictures
+
+        # While there are pictures left, half of the budget is left for them
+        cores = self.cpu_budget.cores if pending_pictures == 0 else max(self.cpu_budget.cores // 2, 1)
+
+        return min(cores, options.threads) if options.threads > 0 else cores
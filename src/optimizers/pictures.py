@@ -6,18 +6,45 @@ changing the output quality.
 
 from __future__ import annotations
 
+import io
+import math
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from enum import Enum, auto
 from pathlib import Path
-from typing import override
+from typing import Iterator, override
 
-from PIL import Image
+from PIL import Image, ImageFile, ImageSequence
+from pymediainfo import MediaInfo
 from tqdm import tqdm
 
+from src.components.archive import ArchiveOptions, ArchiveWriter
 from src.components.files import File, Files
+from src.components.jpeg_quality import estimate_jpeg_quality
+from src.components.large_images import (
+    LargeImageError,
+    allow_large_images,
+    get_decoded_size,
+    load_reduced,
+    resize_in_strips,
+)
 from src.components.media_optimizer import MediaOptimizer
+from src.components.metrics import METRICS
+from src.components.mirror import mirror_file
 from src.components.options import MenuOption, Resolution, ask_for_overwrite_permission, ask_for_short_side_limit
-from src.components.stdout import cli_unprint
+from src.components.palette import BYTES_PER_PIXEL, PaletteOptions, quantize
+from src.components.profiling import PROFILER
+from src.components.resources import RESOURCES
+from src.components.results import FileResult, ResultsReport
+from src.components.stdout import cli_unprint, get_progress_bar_format
+from src.components.verification import (
+    SIZE_TOLERANCE,
+    VerificationOptions,
+    check_media_info,
+    get_psnr,
+    load_sample,
+)
 
 
 class ImageFormat(str, MenuOption):
@@ -60,6 +87,17 @@ class JpegQuality(int, MenuOption):
         self._name_ = name
 
 
+class AnimationFormat(str, Enum):
+    WEBP = "webp"
+    # MP4 videos, which are the smallest but lose transparency, and loop forever only if the player is told to
+    H264 = "h264"
+    HEVC = "hevc"
+
+    @property
+    def extension(self) -> str:
+        return ".webp" if self == AnimationFormat.WEBP else ".mp4"
+
+
 class Orientation(Enum):
     HORIZONTAL = auto()
     VERTICAL = auto()
@@ -69,7 +107,79 @@ class Orientation(Enum):
         return cls.HORIZONTAL if w > h else cls.VERTICAL
 
 
-class PictureOptimizer(MediaOptimizer):
+class PictureFile(File):
+    def __init__(self, source: Path, target: Path, media_info: MediaInfo):
+        super().__init__(source, target)
+
+        track = media_info.image_tracks[0]
+
+        # Some formats don't report their dimensions to MediaInfo, which only makes work estimates less precise
+        self.width = int(track.width or 0)
+        self.height = int(track.height or 0)
+
+
+@dataclass
+class PictureRendition:
+    """An additional size and format of each picture, written to its own subdirectory of the target directory."""
+
+    short_side_limit: int = Resolution.KEEP.value
+    output_format: ImageFormat = ImageFormat.KEEP
+    jpeg_quality: int = JpegQuality.MEDIUM.value
+    # Name of the subdirectory, which defaults to the size (e.g. "720p")
+    name: str = ""
+
+    @property
+    def dir_name(self) -> str:
+        if self.name != "":
+            return self.name
+
+        return "original" if self.short_side_limit == Resolution.KEEP.value else f"{self.short_side_limit}p"
+
+
+@dataclass
+class PictureOptions:
+    short_side_limit: int = Resolution.KEEP.value
+    output_format: ImageFormat = ImageFormat.KEEP
+    jpeg_quality: int = JpegQuality.MEDIUM.value
+    should_overwrite: bool = True
+    # Memory that decoding and resizing a single picture may use. Larger pictures are decoded in parts or at a reduced
+    # resolution when possible, and skipped otherwise.
+    max_memory_mb: int = 1024
+    # Whether JPEGs already saved at (or below) the target quality are copied as is when they don't need to be resized,
+    # as re-encoding them would only lose quality and often make them bigger
+    copy_low_quality_jpegs: bool = True
+    # Lossy reduction of PNG outputs to a palette, for much smaller screenshots and graphics
+    png_palette: PaletteOptions = field(default_factory=PaletteOptions)
+    # Format animated GIFs are converted to, keeping the timing of their frames and how many times they loop
+    animation_format: AnimationFormat = AnimationFormat.WEBP
+    # Quality of animated WebP outputs (0-100), and CRF of MP4 outputs (lower is better)
+    animation_webp_quality: int = 80
+    animation_crf: int = 23
+    verification: VerificationOptions = field(default_factory=VerificationOptions)
+    # Streaming of the outputs into archives instead of separate files, for huge sets of small pictures
+    archive: ArchiveOptions = field(default_factory=ArchiveOptions)
+    # When set, each picture is decoded once and written to every rendition, instead of to a single output with the
+    # size and format above
+    renditions: list[PictureRendition] = field(default_factory=list)
+
+    def __post_init__(self):
+        names = [rendition.dir_name for rendition in self.renditions]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Picture renditions must be written to different directories, got: {', '.join(names)}")
+
+
+class PictureOptimizer(MediaOptimizer[PictureFile, PictureOptions]):
+    parallelizable = True
+    options_class = PictureOptions
+    # Archive the outputs are streamed into during a run with archives enabled (see open_archive())
+    archive: ArchiveWriter | None = None
+
+    @property
+    @override
+    def workers(self) -> int:
+        # Every core the run may use (see ResourceLimits.max_cores), or one when profiling (see PROFILER)
+        return 1 if PROFILER.enabled else RESOURCES.cores
+
     @override
     def is_valid_file(self, path: Path) -> bool:
         info = self.media_info_service.get(path)
@@ -77,11 +187,20 @@ class PictureOptimizer(MediaOptimizer):
         return info is not None and len(info.image_tracks) > 0
 
     @override
-    def create_file(self, source: Path, target: Path) -> File:
-        return File(source, target)
+    def create_file(self, source: Path, target: Path) -> PictureFile:
+        media_info = self.media_info_service.get(source)
+        assert isinstance(media_info, MediaInfo)
+
+        return PictureFile(source, target, media_info)
+
+    @override
+    def estimate_work(self, file: PictureFile) -> float:
+        megapixels = file.width * file.height / 1_000_000
+
+        return megapixels if megapixels > 0 else super().estimate_work(file)
 
     @override
-    def run(self, files: Files[File]):
+    def ask_for_options(self, files: Files[PictureFile]) -> PictureOptions:
         # Ask for output resolution limit
         short_side_limit = ask_for_short_side_limit()
 
@@ -92,7 +211,8 @@ class PictureOptimizer(MediaOptimizer):
         jpeg_quality = JpegQuality.HIGHEST
 
         if output_format == ImageFormat.JPEG or (
-            output_format == ImageFormat.KEEP and files.is_extension_present(ImageFormat.JPEG.extension)
+            output_format == ImageFormat.KEEP
+            and (len(files) == 0 or files.is_extension_present(ImageFormat.JPEG.extension))
         ):
             jpeg_quality = JpegQuality.choose(
                 "What quality level would you like to set for JPEG output files?",
@@ -102,50 +222,551 @@ class PictureOptimizer(MediaOptimizer):
         # Ask if existing optimized pictures should be overwritten
         should_overwrite = ask_for_overwrite_permission(files)
 
+        return PictureOptions(short_side_limit, output_format, jpeg_quality, should_overwrite)
+
+    @override
+    def optimize_file(self, file: PictureFile, options: PictureOptions):
+        self._optimize_image(file, options)
+
+    @override
+    def run(
+        self,
+        files: Files[PictureFile],
+        options: PictureOptions,
+        report: ResultsReport | None = None,
+        show_progress: bool = True,
+    ) -> list[FileResult]:
+        self.open_archive(files.target_dir, options)
+
+        try:
+            return self.__run(files, options, report, show_progress)
+        finally:
+            self.close_archive()
+
+    def open_archive(self, target_dir: Path, options: PictureOptions):
+        """Streams the outputs of the next files into an archive in the target directory, if enabled."""
+        if options.archive.enabled:
+            self.archive = ArchiveWriter(target_dir, options.archive)
+
+    def close_archive(self):
+        if self.archive is None:
+            return
+
+        self.archive.close()
+        parts = len(self.archive.parts)
+        print(f"Outputs have been archived into {parts} part(s), indexed in {self.archive.index_path}")
+        self.archive = None
+
+    @override
+    def get_run_only_options(self, options: PictureOptions) -> list[str]:
+        # Archives are only closed (and indexed) once every file of the run is done
+        return ["archive.enabled"] if options.archive.enabled else []
+
+    @override
+    def should_verify(self, file: PictureFile, options: PictureOptions) -> bool:
+        # Archived outputs are not files that could be probed and decoded
+        return self.archive is None and super().should_verify(file, options)
+
+    def __run(
+        self,
+        files: Files[PictureFile],
+        options: PictureOptions,
+        report: ResultsReport | None,
+        show_progress: bool,
+    ) -> list[FileResult]:
+        if not show_progress:
+            results = [result for _, result in self.__process_in_parallel(files, options, report)]
+            self.wait_for_verification()
+
+            return results
+
         # Process the list of files
         print("\nOptimizing pictures...\n")
 
-        iterator_progress_tracker = tqdm(files, file=sys.stdout, unit="pic")
+        results: list[FileResult] = []
+        total_count = len(files)
 
-        for file in iterator_progress_tracker:
-            iterator_progress_tracker.write(f'Processing "{file.source.name}"')
+        # Progress is weighted by work (megapixels) rather than by file count, so that the ETA holds up when sizes vary
+        progress_tracker = tqdm(
+            total=sum(self.estimate_work(file) for file in files),
+            file=sys.stdout,
+            unit="Mpx",
+            bar_format=get_progress_bar_format(0, total_count),
+        )
+
+        for file, result in self.__process_in_parallel(files, options, report):
+            results.append(result)
 
-            self._optimize_image(file, short_side_limit, output_format, jpeg_quality, should_overwrite)
+            progress_tracker.write(f'Processed "{file.source.name}"')
+            progress_tracker.bar_format = get_progress_bar_format(len(results), total_count)
+            progress_tracker.update(self.estimate_work(file))
 
             cli_unprint(2)
 
         cli_unprint(2)
-        iterator_progress_tracker.display()
+        progress_tracker.display()
+        progress_tracker.close()
+
+        self.wait_for_verification()
+
+        return results
+
+    def __process_in_parallel(
+        self,
+        files: Files[PictureFile],
+        options: PictureOptions,
+        report: ResultsReport | None = None,
+    ) -> Iterator[tuple[PictureFile, FileResult]]:
+        """
+        Optimizes the files in a pool of threads (Pillow releases the GIL while decoding, resizing and encoding),
+        starting them in the order of the files, and yields each result as soon as it is available.
+        """
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="picture-worker")
+
+        try:
+            futures = {executor.submit(self.process_file, file, options, report): file for file in files}
+
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # Pending files must not keep being optimized after an error or an interruption
+            executor.shutdown(cancel_futures=True)
+
+    @override
+    def verify_file(self, file: PictureFile, options: PictureOptions) -> str | None:
+        for target in file.outputs:
+            prefix = f"{target.parent.name}/{target.name}: " if len(file.renditions) > 0 else ""
+
+            try:
+                info = self.media_info_service.get(target)
+            finally:
+                self.media_info_service.forget(target)
+
+            if target.suffix == ".mp4":
+                # Animations converted to videos can't be decoded by Pillow, so only their container is checked
+                reason = check_media_info(info)
+                if reason is not None:
+                    return prefix + reason
+
+                continue
+
+            with Image.open(target) as image:
+                size = image.size
+
+            # The container, the decoder and the source must agree on the dimensions
+            reason = check_media_info(info, expected_size=size)
+            if reason is None and file.width > 0 and abs(size[1] - size[0] * file.height / file.width) > SIZE_TOLERANCE:
+                reason = f"its aspect ratio ({size[0]}x{size[1]}) doesn't match the source ({file.width}x{file.height})"
+            if reason is not None:
+                return prefix + reason
+
+            try:
+                RESOURCES.wait_for_io(target.stat().st_size)
+                sample = load_sample(target)
+            except OSError as err:
+                return prefix + f"it could not be decoded ({err})"
+
+            min_psnr = options.verification.min_psnr
+
+            # Comparing against the source means decoding it again, which must not exceed the memory limit either
+            source_bytes = get_decoded_size((file.width, file.height), "RGB")
+            if min_psnr > 0 and source_bytes <= options.max_memory_mb * 1024 * 1024:
+                psnr = get_psnr(load_sample(file.source, sample.size), sample)
+                if psnr < min_psnr:
+                    return prefix + f"its PSNR against the source is {psnr:.1f} dB (minimum: {min_psnr} dB)"
+
+        return None
+
+    def _optimize_image(self, file: PictureFile, options: PictureOptions):
+        outputs = self.__get_outputs(file, options)
+
+        # Pillow's decompression bomb check is superseded by PictureOptions.max_memory_mb, which bounds the memory used
+        # by each picture without rejecting large ones
+        with allow_large_images():
+            image = Image.open(file.source)
+        # Only the first frame of an animation would be kept by the path below
+        is_animated = image.format == "GIF" and getattr(image, "is_animated", False)
+        if is_animated:
+            outputs = self.__get_animation_outputs(file, outputs, options.animation_format)
+
+        # Archives are always written from scratch, so existing files are not outputs of this run
+        if self.archive is None and all(target.is_file() for _, target in outputs) and not options.should_overwrite:
+            file.skip_reason = "target already exists"
+
+            return
+
+        if is_animated:
+            self.__convert_animation(file, image, outputs, options)
+
+            return
+
+        source_quality = estimate_jpeg_quality(image) if options.copy_low_quality_jpegs else None
+        copies = [self.__can_copy(image, source_quality, rendition, target) for rendition, target in outputs]
+
+        source_size = file.source.stat().st_size
+
+        if all(copies):
+            with METRICS.stage("picture.write", file.timings):
+                for _, target in outputs:
+                    self.__copy_source(file, target)
+
+            file.skip_reason = f"already at JPEG quality {source_quality} or lower, copied as is"
+            METRICS.increment("pictures_copied")
 
-    def _optimize_image(
+            return
+
+        RESOURCES.wait_for_io(source_size)
+
+        # Outputs are sorted from largest to smallest, so the first one is the largest size the picture is needed at
+        target_size = self._get_target_size(image.size, outputs[0][0].short_side_limit)
+        memory_limit = options.max_memory_mb * 1024 * 1024
+
+        if get_decoded_size(image.size, image.mode) + get_decoded_size(target_size, image.mode) > memory_limit:
+            try:
+                image = self._load_large_image(file, image, target_size, memory_limit)
+            except LargeImageError as err:
+                file.skip_reason = f"too large to be optimized within {options.max_memory_mb} MiB: {err}"
+
+                return
+        else:
+            with METRICS.stage("picture.decode", file.timings):
+                image.load()
+
+        bytes_written = 0
+
+        for (rendition, target), copy in zip(outputs, copies):
+            if copy:
+                with METRICS.stage("picture.write", file.timings):
+                    self.__copy_source(file, target)
+
+                bytes_written += source_size
+                continue
+
+            # Each output is downscaled from the previous (larger) one instead of from the original, so that small
+            # outputs (e.g. thumbnails) only cost a fraction of a full resize
+            image = self._resize_image(image, rendition.short_side_limit, file.timings)
+            bytes_written += self._save_image(file, image, target, rendition.jpeg_quality, options)
+
+        METRICS.increment("pictures_optimized")
+        METRICS.increment("bytes_read", source_size)
+        METRICS.increment("bytes_written", bytes_written)
+
+    def _save_image(
         self,
-        file: File,
-        short_side_limit: int,
-        output_format: ImageFormat,
+        file: PictureFile,
+        image: Image.Image,
+        target: Path,
         jpeg_quality: int,
-        should_overwrite: bool = True,
+        options: PictureOptions,
+    ) -> int:
+        image_format = Image.registered_extensions().get(target.suffix.lower())
+        encoded = image
+        if image_format == "PNG" and options.png_palette.enabled:
+            encoded = self.__to_palette(file, image, options)
+
+        # Encoding to memory first keeps encoder and disk time apart, and the encoded output is small anyway
+        with METRICS.stage("picture.encode", file.timings):
+            output = io.BytesIO()
+            encoded.save(
+                output,
+                format=image_format,
+                exif=image.info.get("exif", b""),
+                xmp=image.info.get("xmp"),
+                quality=jpeg_quality,
+                optimize=encoded is not image,  # <- palettes are only used to make outputs as small as possible
+            )
+
+        with METRICS.stage("picture.write", file.timings):
+            self.__write_output(file, target, output.getbuffer())
+
+        return output.tell()
+
+    def __write_output(self, file: PictureFile, target: Path, data: bytes | memoryview):
+        """Writes an output to its target, or to the archive of the run if there is one."""
+        RESOURCES.wait_for_io(len(data))
+
+        if self.archive is None:
+            target.write_bytes(data)
+
+            return
+
+        self.archive.add(target, data)
+        file.archived_bytes = (file.archived_bytes or 0) + len(data)
+
+    def __copy_source(self, file: PictureFile, target: Path):
+        if self.archive is None:
+            mirror_file(file.source, target)  # <- reflinked or copied by the kernel when possible
+        else:
+            self.__write_output(file, target, file.source.read_bytes())
+
+    def __get_animation_outputs(
+        self,
+        file: PictureFile,
+        outputs: list[tuple[PictureRendition, Path]],
+        animation_format: AnimationFormat,
+    ) -> list[tuple[PictureRendition, Path]]:
+        """Changes the targets of an animation to the extension of the format it is converted to."""
+        targets = [target.with_suffix(animation_format.extension) for _, target in outputs]
+
+        if len(file.renditions) > 0:
+            file.renditions = targets
+        else:
+            file.target = targets[0]
+
+        return [(rendition, target) for (rendition, _), target in zip(outputs, targets)]
+
+    def __convert_animation(
+        self,
+        file: PictureFile,
+        image: Image.Image,
+        outputs: list[tuple[PictureRendition, Path]],
+        options: PictureOptions,
     ):
-        if file.target.is_file() and not should_overwrite:
+        """Converts an animated GIF to every output, keeping the duration of each frame and the number of plays."""
+        # GIFs without a loop count are played once, and a loop count of N means N repeats after the first play
+        loop = image.info.get("loop")
+        plays = 1 if loop is None else 0 if loop == 0 else loop + 1  # <- 0 = forever
+        source_size = file.source.stat().st_size
+
+        if options.animation_format == AnimationFormat.WEBP:
+            bytes_written = self.__save_animated_webp(file, image, outputs, plays, options)
+        else:
+            bytes_written = 0
+            for rendition, target in outputs:
+                size = self._get_target_size(image.size, rendition.short_side_limit)
+                if not self.__encode_animation_video(file, size, target, plays, options):
+                    return
+
+                bytes_written += target.stat().st_size
+
+                if self.archive is not None:
+                    # FFmpeg needs a seekable output to move the MP4 index to its start, so it goes through a file
+                    with METRICS.stage("picture.write", file.timings):
+                        self.__write_output(file, target, target.read_bytes())
+                        target.unlink()
+
+        if bytes_written is None:
             return
 
-        image = Image.open(file.source)
+        METRICS.increment("animations_converted")
+        METRICS.increment("bytes_read", source_size)
+        METRICS.increment("bytes_written", bytes_written)
+
+    def __save_animated_webp(
+        self,
+        file: PictureFile,
+        image: Image.Image,
+        outputs: list[tuple[PictureRendition, Path]],
+        plays: int,
+        options: PictureOptions,
+    ) -> int | None:
+        sizes = [self._get_target_size(image.size, rendition.short_side_limit) for rendition, _ in outputs]
+
+        # Every frame of every output is held in memory until it is encoded
+        frames_bytes = getattr(image, "n_frames", 1) * sum(get_decoded_size(size, "RGBA") for size in sizes)
+        if frames_bytes > options.max_memory_mb * 1024 * 1024:
+            file.skip_reason = (
+                f"too large to be optimized within {options.max_memory_mb} MiB: its frames need "
+                f"{frames_bytes / 1024 / 1024:.0f} MiB"
+            )
+
+            return None
+
+        RESOURCES.wait_for_io(file.source.stat().st_size)
+
+        frames: list[list[Image.Image]] = [[] for _ in outputs]
+        durations: list[int] = []
+
+        # Pillow composites each frame over the previous ones, following the disposal method of the GIF
+        for frame in ImageSequence.Iterator(image):
+            with METRICS.stage("picture.decode", file.timings):
+                durations.append(frame.info.get("duration", 0))
+                resized = frame.convert("RGBA")
+
+            for idx, (rendition, _) in enumerate(outputs):
+                # Like still pictures, each output is downscaled from the previous (larger) one
+                resized = self._resize_image(resized, rendition.short_side_limit, file.timings)
+                frames[idx].append(resized)
+
+        bytes_written = 0
+
+        for output_frames, (_, target) in zip(frames, outputs):
+            with METRICS.stage("picture.encode", file.timings):
+                output = io.BytesIO()
+                output_frames[0].save(
+                    output,
+                    format="WEBP",
+                    save_all=True,
+                    append_images=output_frames[1:],
+                    duration=durations,
+                    loop=plays,
+                    quality=options.animation_webp_quality,
+                )
+
+            with METRICS.stage("picture.write", file.timings):
+                self.__write_output(file, target, output.getbuffer())
 
-        if short_side_limit != Resolution.KEEP.value:
-            image = self._resize_image(image, short_side_limit)
+            bytes_written += output.tell()
 
-        image.save(
-            file.target if output_format == ImageFormat.KEEP else file.target.with_suffix(output_format.extension),
-            exif=image.info.get("exif"),
-            xmp=image.info.get("xmp"),
-            quality=jpeg_quality,
+        return bytes_written
+
+    def __encode_animation_video(
+        self,
+        file: PictureFile,
+        size: tuple[int, int],
+        target: Path,
+        plays: int,
+        options: PictureOptions,
+    ) -> bool:
+        """
+        Encodes an animation to an MP4 video of the provided size, repeated as many times as it is played. Returns
+        whether it succeeded, and sets the error of the file otherwise.
+        """
+        # pylint: disable=import-outside-toplevel
+        from ffmpeg.errors import FFmpegError
+
+        from src.components.ffmpeg import FFmpeg, RetryPolicy, Watchdog
+
+        # Frames keep their own duration (variable frame rate), and 4:2:0 chroma needs even dimensions
+        width, height = max(size[0] - size[0] % 2, 2), max(size[1] - size[1] % 2, 2)
+        input_options = {"stream_loop": str(plays - 1)} if plays > 1 else {}
+        output_options: dict[str, str] = {"tag:v": "hvc1"} if options.animation_format == AnimationFormat.HEVC else {}
+        threads = RESOURCES.limit_threads(0)
+        if threads > 0:
+            output_options["threads"] = str(threads)
+
+        target.parent.mkdir(parents=True, exist_ok=True)  # <- not created for renditions that are archived
+        ffmpeg_job = (
+            FFmpeg()
+            .option("y")
+            .input(str(file.source), input_options)  # type: ignore
+            .output(
+                str(target),
+                vf=f"scale={width}:{height}:flags=lanczos",
+                vcodec="libx264" if options.animation_format == AnimationFormat.H264 else "libx265",
+                crf=str(options.animation_crf),
+                pix_fmt="yuv420p",
+                fps_mode="vfr",
+                movflags="+faststart",
+                an=None,
+                **output_options,
+            )
+            .watch(Watchdog.from_policy(RetryPolicy()))
         )
 
-    def _resize_image(self, image: Image.Image, target_max_short_side: int) -> Image.Image:
-        w, h = image.size
+        if RESOURCES.throttle is not None:
+            ffmpeg_job.throttle(RESOURCES.throttle, file.source.stat().st_size, None)
+
+        try:
+            with METRICS.stage("picture.encode", file.timings):
+                ffmpeg_job.execute()
+        except FFmpegError as err:
+            file.error = err.message.strip() or type(err).__name__
+            for output in file.outputs:
+                output.unlink(missing_ok=True)
 
-        if min(w, h) <= target_max_short_side:
+            return False
+
+        return True
+
+    def __to_palette(self, file: PictureFile, image: Image.Image, options: PictureOptions) -> Image.Image:
+        """Reduces a picture to a palette, unless it can't be done within the memory limit or loses too much quality."""
+        if image.mode not in ("RGB", "RGBA"):  # <- e.g. already paletted or grayscale
             return image
 
+        if image.width * image.height * BYTES_PER_PIXEL > options.max_memory_mb * 1024 * 1024:
+            METRICS.increment("png_palette_fallbacks")
+
+            return image
+
+        with METRICS.stage("picture.quantize", file.timings):
+            quantized, psnr = quantize(image, options.png_palette.colors, options.png_palette.dither)
+
+        if psnr < options.png_palette.min_psnr:
+            METRICS.increment("png_palette_fallbacks")
+
+            return image
+
+        METRICS.increment("png_palettes")
+
+        return quantized
+
+    def __can_copy(
+        self,
+        image: Image.Image,
+        source_quality: int | None,
+        rendition: PictureRendition,
+        target: Path,
+    ) -> bool:
+        """Whether an output can be a copy of the source, i.e. a JPEG at its size and (at most) the target quality."""
+        return (
+            source_quality is not None
+            and source_quality <= rendition.jpeg_quality
+            and Image.registered_extensions().get(target.suffix.lower()) == "JPEG"
+            and self._get_target_size(image.size, rendition.short_side_limit) == image.size
+        )
+
+    def __get_outputs(self, file: PictureFile, options: PictureOptions) -> list[tuple[PictureRendition, Path]]:
+        """Returns the size and format of every output of a picture along with its target, from largest to smallest."""
+        if len(options.renditions) == 0:
+            if options.output_format != ImageFormat.KEEP:
+                file.target = file.target.with_suffix(options.output_format.extension)
+
+            output = PictureRendition(options.short_side_limit, options.output_format, options.jpeg_quality)
+
+            return [(output, file.target)]
+
+        renditions = sorted(
+            options.renditions,
+            key=lambda rendition: (
+                math.inf if rendition.short_side_limit == Resolution.KEEP.value else rendition.short_side_limit
+            ),
+            reverse=True,
+        )
+
+        for rendition in renditions:
+            target = file.rendition_target(rendition.dir_name)
+            if rendition.output_format != ImageFormat.KEEP:
+                target = target.with_suffix(rendition.output_format.extension)
+
+            if self.archive is None:
+                target.parent.mkdir(parents=True, exist_ok=True)
+            file.renditions.append(target)
+
+        return list(zip(renditions, file.renditions))
+
+    def _load_large_image(
+        self,
+        file: PictureFile,
+        image: Image.Image,
+        target_size: tuple[int, int],
+        memory_limit: int,
+    ) -> Image.Image:
+        """Decodes and resizes a picture that doesn't fit in the memory limit, raising LargeImageError if impossible."""
+        assert isinstance(image, ImageFile.ImageFile)
+
+        if get_decoded_size(target_size, image.mode) > memory_limit:
+            raise LargeImageError("its resized version alone would exceed the memory limit")
+
+        METRICS.increment("pictures_large")
+
+        if image.format == "JPEG":
+            with METRICS.stage("picture.decode", file.timings):
+                image = load_reduced(image, target_size, memory_limit)
+
+            with METRICS.stage("picture.resize", file.timings):
+                return image.resize(target_size, Image.Resampling.LANCZOS) if image.size != target_size else image
+
+        # Decoding and resizing are interleaved, so they are timed together
+        with METRICS.stage("picture.decode_resize", file.timings):
+            return resize_in_strips(file.source, image, target_size, memory_limit)
+
+    def _get_target_size(self, size: tuple[int, int], target_max_short_side: int) -> tuple[int, int]:
+        w, h = size
+
+        if target_max_short_side == Resolution.KEEP.value or min(w, h) <= target_max_short_side:
+            return size
+
         aspect_ratio = w / h
         orientation = Orientation.from_dimensions(w, h)
 
@@ -156,4 +777,20 @@ class PictureOptimizer(MediaOptimizer):
             w = target_max_short_side
             h = int(w / aspect_ratio)
 
-        return image.resize((w, h), Image.Resampling.LANCZOS)
+        return w, h
+
+    def _resize_image(
+        self,
+        image: Image.Image,
+        target_max_short_side: int,
+        timings: dict[str, float] | None = None,
+    ) -> Image.Image:
+        target_size = self._get_target_size(image.size, target_max_short_side)
+
+        if target_size == image.size:
+            return image
+
+        METRICS.increment("pictures_resized")
+
+        with METRICS.stage("picture.resize", timings):
+            return image.resize(target_size, Image.Resampling.LANCZOS)
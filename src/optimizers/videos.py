@@ -13,18 +13,36 @@ depends on the source video and chosen encoding quality and preset).
 
 from __future__ import annotations
 
+from dataclasses import dataclass, field, replace
 from pathlib import Path
+from time import perf_counter, sleep
 from typing import Callable, override
 
 from ffmpeg import Progress
+from ffmpeg.errors import FFmpegError
 from pymediainfo import MediaInfo
 from tqdm import tqdm
 
-from src.components.ffmpeg import FFmpeg
+from src.components.deadline import DeadlinePlanner
+from src.components.estimator import EstimateSample
+from src.components.ffmpeg import TOLERANT_INPUT_OPTIONS, FFmpeg, RetryPolicy, Watchdog
 from src.components.files import File, Files, get_file_size_as_str
 from src.components.media_optimizer import MediaOptimizer
+from src.components.metrics import METRICS
 from src.components.options import MenuOption, Resolution, ask_for_overwrite_permission, ask_for_short_side_limit
-from src.components.stdout import cli_unprint
+from src.components.resources import RESOURCES
+from src.components.results import FileResult, ResultsReport
+from src.components.stdout import cli_unprint, get_progress_bar_format
+from src.components.verification import (
+    VerificationOptions,
+    check_media_info,
+    decode_frame,
+    get_psnr,
+    get_sample_size,
+)
+
+# Length of the segment encoded from the middle of each sampled video when estimating a batch
+SAMPLE_SEGMENT_SECONDS = 5.0
 
 
 class EncodingQuality(int, MenuOption):
@@ -63,6 +81,15 @@ class EncodingPreset(str, MenuOption):
         self._name_ = name
 
 
+# Approximate encoding speed of each preset relative to the fastest one, only used by the deadline mode until the speed
+# of a preset has been measured
+PRESET_RELATIVE_SPEEDS = {
+    EncodingPreset.FAST: 1.0,
+    EncodingPreset.MEDIUM: 0.55,
+    EncodingPreset.SLOW: 0.2,
+}
+
+
 class VideoFile(File):
     def __init__(self, source: Path, target: Path, media_info: MediaInfo):
         super().__init__(source, target)
@@ -74,9 +101,50 @@ class VideoFile(File):
         self.duration = float(track.duration) / 1000.0
 
 
-class VideoOptimizer(MediaOptimizer[VideoFile]):
-    total_duration: float = 0.0
-    progress_tracker: tqdm[VideoFile]
+@dataclass
+class VideoRendition:
+    """An additional size and quality of each video, written to its own subdirectory of the target directory."""
+
+    short_side_limit: int = Resolution.KEEP.value
+    quality: EncodingQuality = EncodingQuality.MEDIUM
+    # Name of the subdirectory, which defaults to the size (e.g. "720p")
+    name: str = ""
+
+    @property
+    def dir_name(self) -> str:
+        if self.name != "":
+            return self.name
+
+        return "original" if self.short_side_limit == Resolution.KEEP.value else f"{self.short_side_limit}p"
+
+
+@dataclass
+class VideoOptions:
+    short_side_limit: int = Resolution.KEEP.value
+    quality: EncodingQuality = EncodingQuality.MEDIUM
+    preset: EncodingPreset = EncodingPreset.MEDIUM
+    should_overwrite: bool = True
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+    # Maximum number of threads used to decode and encode each video (0 = let FFmpeg and x265 use every core)
+    threads: int = 0
+    # When set, each video is decoded once and encoded to every rendition, instead of to a single output with the
+    # size and quality above
+    renditions: list[VideoRendition] = field(default_factory=list)
+    # Wall-clock minutes the whole run must fit in. When set, the preset of each video is the slowest one that still
+    # lets the run finish in time, according to the encoding speed measured so far (0 = always use the preset above)
+    deadline_minutes: float = 0.0
+    verification: VerificationOptions = field(default_factory=VerificationOptions)
+
+    def __post_init__(self):
+        names = [rendition.dir_name for rendition in self.renditions]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Video renditions must be written to different directories, got: {', '.join(names)}")
+
+
+class VideoOptimizer(MediaOptimizer[VideoFile, VideoOptions]):
+    options_class = VideoOptions
+    progress_tracker: tqdm[VideoFile] | None = None
+    deadline_planner: DeadlinePlanner[EncodingPreset] | None = None
 
     @override
     def is_valid_file(self, path: Path) -> bool:
@@ -89,14 +157,69 @@ class VideoOptimizer(MediaOptimizer[VideoFile]):
         media_info = self.media_info_service.get(source)
         assert isinstance(media_info, MediaInfo)
 
-        file = VideoFile(source, target, media_info)
+        return VideoFile(source, target, media_info)
 
-        self.total_duration += file.duration
+    @override
+    def estimate_work(self, file: VideoFile) -> float:
+        return file.duration * file.width * file.height / 1_000_000
 
-        return file
+    @override
+    def sample_file(self, file: VideoFile, options: VideoOptions, target_dir: Path) -> EstimateSample:
+        # Encoding whole videos would take as long as the real run, so only a short segment of each one is encoded
+        segment_duration = min(SAMPLE_SEGMENT_SECONDS, file.duration)
+        fraction = segment_duration / file.duration if file.duration > 0 else 1.0
+        segment = (max(file.duration / 2 - segment_duration / 2, 0.0), segment_duration)
+
+        original_target = file.target
+        file.target = Path(target_dir, file.source.name)
+        self.__prepare_renditions(file, options)
+        start = perf_counter()
+
+        try:
+            self.__build_ffmpeg_job(file, options, False, lambda _: None, segment).execute()
+            error = None
+        except FFmpegError as err:
+            error = err.message.strip() or type(err).__name__
+
+        seconds = perf_counter() - start
+        target_bytes = file.output_bytes if error is None else None
+        file.target = original_target
+        file.renditions.clear()
+
+        return EstimateSample(
+            work=self.estimate_work(file) * fraction,
+            source_bytes=round(file.source.stat().st_size * fraction),
+            target_bytes=target_bytes,
+            seconds=seconds,
+            error=error,
+        )
 
     @override
-    def run(self, files: Files[VideoFile]):
+    def verify_file(self, file: VideoFile, options: VideoOptions) -> str | None:
+        outputs = [
+            (rendition.short_side_limit, target) for rendition, target in zip(options.renditions, file.renditions)
+        ] or [(options.short_side_limit, file.target)]
+
+        for short_side_limit, target in outputs:
+            prefix = f"{target.parent.name}/{target.name}: " if len(file.renditions) > 0 else ""
+            size_divider = self.__get_size_divider(file, short_side_limit)
+            expected_size = (round(file.width / size_divider), round(file.height / size_divider))
+
+            try:
+                info = self.media_info_service.get(target)
+            finally:
+                self.media_info_service.forget(target)
+
+            reason = check_media_info(info, expected_size, file.duration) or self.__verify_frames(
+                file, target, expected_size, options.verification
+            )
+            if reason is not None:
+                return prefix + reason
+
+        return None
+
+    @override
+    def ask_for_options(self, files: Files[VideoFile]) -> VideoOptions:
         # Ask for output resolution limit
         short_side_limit = ask_for_short_side_limit(Resolution.lteq(Resolution.R_1440P))
 
@@ -115,70 +238,244 @@ class VideoOptimizer(MediaOptimizer[VideoFile]):
         # Ask if existing optimized videos should be overwritten
         should_overwrite: bool = ask_for_overwrite_permission(files)
 
+        return VideoOptions(short_side_limit, quality, preset, should_overwrite)
+
+    @override
+    def optimize_file(self, file: VideoFile, options: VideoOptions):
+        self._convert_video(file, options)
+
+    @override
+    def get_run_only_options(self, options: VideoOptions) -> list[str]:
+        # Presets are planned over every remaining file of the run, which watch mode doesn't know
+        return ["deadline_minutes"] if options.deadline_minutes > 0 else []
+
+    @override
+    def run(
+        self,
+        files: Files[VideoFile],
+        options: VideoOptions,
+        report: ResultsReport | None = None,
+        show_progress: bool = True,
+    ) -> list[FileResult]:
+        works = [self.estimate_work(file) for file in files]
+        self.start_deadline(options)
+
+        if not show_progress:
+            self.progress_tracker = None
+
+            results = [
+                self.process_file(file, self.plan(options, works, idx), report) for idx, file in enumerate(files)
+            ]
+            self.wait_for_verification()
+
+            return results
+
         # Process the list of files
         print("\nOptimizing videos...\n")
 
+        results: list[FileResult] = []
         total_count = len(files)
+        # Progress is weighted by work (duration x resolution) rather than by duration, so that the ETA holds up
+        # when resolutions are mixed
+        total_work = sum(works)
 
         self.progress_tracker = tqdm(
             files,
-            total=self.total_duration,
-            unit="vsec",  # <- unit = seconds of video
-            bar_format=self.__get_progress_bar_format(0, total_count),
+            total=total_work,
+            unit="Mpx·s",  # <- unit = seconds of video x megapixels per frame
+            bar_format=get_progress_bar_format(0, total_count),
             leave=False,  # <- necessary to avoid issues, as we're manually handling final display of the progress bar
         )
 
         for idx, file in enumerate(files):
-            self._convert_video(
-                file,
-                short_side_limit,
-                quality,
-                preset,
-                should_overwrite,
-            )
-            self.progress_tracker.bar_format = self.__get_progress_bar_format(idx + 1, total_count)
+            results.append(self.process_file(file, self.plan(options, works, idx), report))
+            self.progress_tracker.bar_format = get_progress_bar_format(idx + 1, total_count)
 
-        self.progress_tracker.update(self.total_duration - self.progress_tracker.n)
+        self.progress_tracker.update(total_work - self.progress_tracker.n)
         cli_unprint(2, force_final_clear=True)
         self.progress_tracker.display()
 
-    def _convert_video(
-        self,
-        file: VideoFile,
-        short_side_limit: int,
-        quality: EncodingQuality,
-        preset: EncodingPreset,
-        should_overwrite: bool = True,
-    ):
-        if file.target.is_file() and not should_overwrite:
+        self.wait_for_verification()
+
+        return results
+
+    def start_deadline(self, options: VideoOptions):
+        """Starts planning presets against the deadline of the options (if any), which starts now."""
+        self.deadline_planner = None
+        if options.deadline_minutes > 0:
+            self.deadline_planner = DeadlinePlanner(options.deadline_minutes * 60, PRESET_RELATIVE_SPEEDS)
+
+    def plan(self, options: VideoOptions, works: list[float], idx: int) -> VideoOptions:
+        """Returns the options for the file at the provided index, with the preset chosen by the deadline planner."""
+        if self.deadline_planner is None:
+            return options
+
+        preset = self.deadline_planner.choose(works[idx], sum(works[idx + 1 :]))
+        METRICS.increment(f"video_preset_{preset.value}")
+
+        return replace(options, preset=preset)
+
+    def _convert_video(self, file: VideoFile, options: VideoOptions):
+        self.__prepare_renditions(file, options)
+
+        if all(output.is_file() for output in file.outputs) and not options.should_overwrite:
+            file.skip_reason = "target already exists"
+
             return
 
-        source_short_side = min(file.width, file.height)
-        size_divider = (source_short_side / short_side_limit) if source_short_side > short_side_limit else 1
+        retry_policy = options.retry_policy
+        on_progress = self.__get_progress_handler(file, options.preset)
+
+        for attempt in range(1, retry_policy.max_attempts + 1):
+            tolerant = attempt > 1 and retry_policy.tolerant_retries
 
+            try:
+                # FFmpeg decodes, scales, encodes and writes in a single pipeline, so it is timed as a whole
+                with METRICS.stage("video.encode", file.timings):
+                    self.__build_ffmpeg_job(file, options, tolerant, on_progress).execute()
+                file.error = None
+
+                METRICS.increment("videos_optimized")
+                METRICS.increment("bytes_read", file.source.stat().st_size)
+                METRICS.increment("bytes_written", file.output_bytes or 0)
+
+                return
+            except FFmpegError as err:
+                file.error = err.message.strip() or type(err).__name__
+                for output in file.outputs:
+                    output.unlink(missing_ok=True)
+
+                METRICS.increment("video_encode_errors")
+
+                if attempt < retry_policy.max_attempts:
+                    self.__write(
+                        f'[WARNING] Encoding "{file.source.name}" failed ({file.error}), '
+                        f"retrying (attempt {attempt + 1}/{retry_policy.max_attempts})..."
+                    )
+                    sleep(retry_policy.backoff_for(attempt + 1))
+                    METRICS.increment("video_retries")
+
+    def __build_ffmpeg_job(
+        self,
+        file: VideoFile,
+        options: VideoOptions,
+        tolerant: bool,
+        on_progress: Callable[[Progress], None],
+        segment: tuple[float, float] | None = None,
+    ) -> FFmpeg:
+        """Builds the encoding job. A segment, as (start, duration) in seconds, limits it to part of the video."""
+        input_options: dict[str, str] = dict(TOLERANT_INPUT_OPTIONS) if tolerant else {}
+        if segment is not None:
+            input_options.update(ss=str(round(segment[0], 3)), t=str(round(segment[1], 3)))
+
+        output_options: dict[str, str] = {}
+        threads = RESOURCES.limit_threads(options.threads)
+        if threads > 0:
+            input_options["threads"] = str(threads)
+            output_options["x265-params"] = f"pools={threads}"
+
+        common_output_options = {
+            "vcodec": "libx265",
+            "acodec": "copy",
+            "preset": options.preset.value,
+            "map_metadata": "0",
+            "movflags": "use_metadata_tags",
+            **output_options,
+        }
+
+        expected_duration = segment[1] if segment is not None else file.duration
         ffmpeg_job = (
             FFmpeg()
             .option("y")
-            .input(str(file.source))
-            .output(
+            .input(str(file.source), input_options)  # type: ignore
+            .watch(Watchdog.from_policy(options.retry_policy, expected_duration))
+        )
+
+        if RESOURCES.throttle is not None:
+            # Segments only read their share of the source
+            input_bytes = file.source.stat().st_size * (expected_duration / file.duration if file.duration > 0 else 1)
+            ffmpeg_job.throttle(RESOURCES.throttle, round(input_bytes), expected_duration)
+
+        if len(options.renditions) == 0:
+            ffmpeg_job.output(
                 str(file.target),
-                vf=f"scale=iw/{size_divider}:ih/{size_divider}",
-                vcodec="libx265",
-                acodec="copy",
-                crf=quality.value,
-                preset=preset.value,
+                vf=self.__get_scale_filter(file, options.short_side_limit),
+                crf=options.quality.value,
                 map=["0:v", "0:a?"],
-                map_metadata="0",
-                movflags="use_metadata_tags",
+                **common_output_options,
             )
-        )
+        else:
+            # The video is decoded once, and its frames are split into a scaled stream for each rendition
+            count = len(options.renditions)
+            filter_graph = f"[0:v]split={count}" + "".join(f"[split{index}]" for index in range(count))
+            for index, rendition in enumerate(options.renditions):
+                filter_graph += f";[split{index}]{self.__get_scale_filter(file, rendition.short_side_limit)}[v{index}]"
+
+            ffmpeg_job.option("filter_complex", filter_graph)
+
+            for index, (rendition, target) in enumerate(zip(options.renditions, file.renditions)):
+                ffmpeg_job.output(
+                    str(target),
+                    crf=rendition.quality.value,
+                    map=[f"[v{index}]", "0:a?"],
+                    **common_output_options,
+                )
+
+        ffmpeg_job.on("progress", on_progress)  # type: ignore
+
+        return ffmpeg_job
+
+    def __prepare_renditions(self, file: VideoFile, options: VideoOptions):
+        file.renditions = [file.rendition_target(rendition.dir_name) for rendition in options.renditions]
+
+        for target in file.renditions:
+            target.parent.mkdir(parents=True, exist_ok=True)
+
+    def __get_scale_filter(self, file: VideoFile, short_side_limit: int) -> str:
+        size_divider = self.__get_size_divider(file, short_side_limit)
 
-        ffmpeg_job.on("progress", self.__get_progress_handler(file))  # type: ignore
+        return f"scale=iw/{size_divider}:ih/{size_divider}"
 
-        ffmpeg_job.execute()
+    def __get_size_divider(self, file: VideoFile, short_side_limit: int) -> float:
+        source_short_side = min(file.width, file.height)
+
+        return (
+            (source_short_side / short_side_limit)
+            if short_side_limit != Resolution.KEEP.value and source_short_side > short_side_limit
+            else 1
+        )
 
-    def __get_progress_handler(self, file: VideoFile) -> Callable[[Progress], None]:
+    def __verify_frames(
+        self,
+        file: VideoFile,
+        target: Path,
+        size: tuple[int, int],
+        verification: VerificationOptions,
+    ) -> str | None:
+        """Decodes frames evenly spread over the output, and compares them with the source if a min PSNR is set."""
+        sample_size = get_sample_size(size)
+
+        for idx in range(verification.samples):
+            seconds = file.duration * (idx + 1) / (verification.samples + 1)
+
+            try:
+                frame = decode_frame(target, seconds, sample_size)
+            except FFmpegError as err:
+                return f"its frame at {seconds:.2f}s could not be decoded ({err.message.strip() or type(err).__name__})"
+
+            if verification.min_psnr > 0:
+                psnr = get_psnr(decode_frame(file.source, seconds, sample_size), frame)
+                if psnr < verification.min_psnr:
+                    return (
+                        f"its frame at {seconds:.2f}s has a PSNR of {psnr:.1f} dB against the source "
+                        f"(minimum: {verification.min_psnr} dB)"
+                    )
+
+        return None
+
+    def __get_progress_handler(self, file: VideoFile, preset: EncodingPreset) -> Callable[[Progress], None]:
         fname = file.source.name
+        megapixels = file.width * file.height / 1_000_000
         last_progress = 0.0
 
         def on_progress(progress: Progress):
@@ -194,16 +491,28 @@ class VideoOptimizer(MediaOptimizer[VideoFile]):
                 # For some reason, this happens at the end of each video encoding. We can just skip those cases.
                 return
 
-            delta = time.total_seconds() - last_progress
+            if self.deadline_planner is not None:
+                # Speed is in seconds of video per second, so this is the work (see estimate_work()) done per second
+                self.deadline_planner.observe(preset, progress.speed * megapixels)
+
+            if self.progress_tracker is None:
+                # There is nothing to report when running without a progress bar (e.g. when watching a directory)
+                return
+
+            # Retries start over from the beginning of the video, so only count progress past the furthest point
+            delta = max(time.total_seconds() - last_progress, 0.0)
             last_progress += delta
 
             self.progress_tracker.write(f'Encoding "{fname}"')
             self.progress_tracker.write(f"frame={frame} | fps={fps} | size={size} | time={time} | bitrate={bitrate}")
-            self.progress_tracker.update(delta)
+            self.progress_tracker.update(delta * megapixels)
 
             cli_unprint(3)
 
         return on_progress
 
-    def __get_progress_bar_format(self, completed: int, total: int) -> str:
-        return f"{{l_bar}}{{bar}}| {completed}/{total} [{{elapsed}}<{{remaining}}, {{rate_fmt}}{{postfix}}]"
+    def __write(self, message: str):
+        if self.progress_tracker is not None:
+            self.progress_tracker.write(message)
+        else:
+            print(message)